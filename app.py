@@ -11,6 +11,7 @@ MeowDev 群聊界面 —— Chainlit 主入口（简化版）
 import asyncio
 import random
 import sys
+from datetime import datetime
 from pathlib import Path
 
 import chainlit as cl
@@ -20,22 +21,27 @@ from fastapi.responses import JSONResponse
 
 sys.path.insert(0, str(Path(__file__).parent))
 
-from cats import arch, stack, pixel, ALL_CATS, CAT_MAP, CatAgent
+from cats import (
+    arch, stack, pixel, ALL_CATS, CAT_MAP, CatAgent,
+    cancel_turns, process_stats, start_cli_processes,
+)
+from cli_process import Priority, utility_lane
 from data_layer import data_layer
-from memory import (
+import maintenance
+from memory_async import (
     add_message,
-    get_all_cats_stats,
     get_messages_paginated,
     get_message_count,
-    get_trend,
-    init_db,
     add_cat_usage,
     create_session,
     get_session,
     update_cat_last_spoke,
     get_recent_messages,
     update_session_summary,
+    search_messages,
+    get_context_snapshot,
 )
+from memory import ContextSnapshot
 from team import MeowDevTeam, Phase
 from feature_list import FeatureList
 from progress import Progress
@@ -63,18 +69,62 @@ async def header_auth_callback(headers: dict):
 
 # ── 内置 API 接口（插入到 Chainlit catch-all 之前）─────────────────────────
 
+from email.utils import formatdate, parsedate_to_datetime
+
 from starlette.routing import Route
-from starlette.responses import JSONResponse as StarletteJSONResponse
+from starlette.responses import Response
+
+from stats_cache import StatsSnapshot, stats_cache
+
+
+def _is_not_modified(request, snapshot: StatsSnapshot) -> bool:
+    """根据 If-None-Match / If-Modified-Since 判断能否返回 304"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in tags or snapshot.etag in tags or f"W/{snapshot.etag}" in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(snapshot.last_modified) <= since
+    return False
+
 
 async def _api_stats(request):
     range_val = request.query_params.get("range", "day")
-    stats = get_all_cats_stats(range_val)
-    trend = get_trend(range_val)
-    return StarletteJSONResponse({"stats": stats, "trend": trend, "range": range_val})
+    snapshot = await stats_cache.get(range_val)
+    headers = {
+        "ETag": snapshot.etag,
+        "Last-Modified": formatdate(snapshot.last_modified, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+    if _is_not_modified(request, snapshot):
+        return Response(status_code=304, headers=headers)
+    return Response(snapshot.body, media_type="application/json", headers=headers)
+
+
+async def _api_search(request):
+    query = request.query_params.get("q", "").strip()
+    session_id = request.query_params.get("session_id") or None
+    try:
+        limit = min(max(int(request.query_params.get("limit", 20)), 1), 50)
+    except ValueError:
+        limit = 20
+    results = await search_messages(query, session_id, limit) if query else []
+    return JSONResponse({"query": query, "results": results})
+
+async def _api_processes(request):
+    return JSONResponse(process_stats())
 
-_existing = [r for r in fastapi_app.routes if getattr(r, 'path', '') == '/api/stats']
-if not _existing:
-    fastapi_app.routes.insert(0, Route("/api/stats", _api_stats, methods=["GET"]))
+for _path, _endpoint in (("/api/stats", _api_stats), ("/api/search", _api_search),
+                         ("/api/processes", _api_processes)):
+    _existing = [r for r in fastapi_app.routes if getattr(r, 'path', '') == _path]
+    if not _existing:
+        fastapi_app.routes.insert(0, Route(_path, _endpoint, methods=["GET"]))
 
 
 def cat_msg(cat: CatAgent, content: str) -> cl.Message:
@@ -84,10 +134,24 @@ def cat_msg(cat: CatAgent, content: str) -> cl.Message:
         metadata={"avatarName": cat.cat_id},
     )
 
+
+def queue_reporter(cat: CatAgent, msg: cl.Message):
+    """回合排队时把"正在思考"占位消息换成排队位置，排到后换回来"""
+    async def report(position: int):
+        if position:
+            msg.content = f"_{cat.name} 正在排队（第 {position} 位）..._"
+        else:
+            msg.content = f"_{cat.name} 正在思考..._"
+        await msg.update()
+    return report
+
+
 @cl.on_chat_start
 async def on_start():
     """新聊天开始 - 不在 DB 创建 session，等用户发第一条消息再创建"""
-    init_db()
+    # 数据库结构在 import memory 时已经迁移好；这里只确保后台维护线程在跑
+    maintenance.start()
+    start_cli_processes()
 
     thread_id = context.session.thread_id
     cl.user_session.set("session_id", thread_id)
@@ -104,7 +168,8 @@ async def on_start():
             "- `/team 需求` — 启动团队协作\n"
             "- `/status` — 查看功能进度\n"
             "- `/usage` — 查看猫猫使用统计\n"
-            "- `/history [页码]` — 查看历史消息\n"
+            "- `/history [翻页标记]` — 查看历史消息\n"
+            "- `/search 关键词` — 搜索所有历史对话\n"
             "- `/stop` — 暂停工作"
         ),
     ).send()
@@ -113,13 +178,14 @@ async def on_start():
 @cl.on_chat_resume
 async def on_chat_resume(thread: dict):
     """恢复聊天 - Chainlit 会传递 Thread 信息"""
-    init_db()
+    maintenance.start()
+    start_cli_processes()
 
     thread_id = thread.get("id") or context.session.thread_id
 
     cl.user_session.set("session_id", thread_id)
     cl.user_session.set("should_stop", False)
-    cl.user_session.set("session_created", bool(get_session(thread_id)))
+    cl.user_session.set("session_created", bool(await get_session(thread_id)))
 
     print(f"[MeowDev] 恢复聊天，会话 ID: {thread_id}")
 
@@ -127,18 +193,17 @@ async def on_chat_resume(thread: dict):
 @cl.on_stop
 async def on_stop():
     cl.user_session.set("should_stop", True)
-    # Phase 2: 只清理当前 session 的进程，不影响其他 session
+    # 只打断当前 session 正在进行的回合：立刻让出名额，进程在后台中断后留着继续用
     session_id = cl.user_session.get("session_id")
     if session_id:
-        for cat in ALL_CATS:
-            await cat.cleanup(session_id)
+        cancel_turns(session_id)
 
 
-def _ensure_session(session_id: str):
+async def _ensure_session(session_id: str):
     """确保 DB 中存在 session 记录（lazy creation）"""
     if not cl.user_session.get("session_created"):
-        if not get_session(session_id):
-            create_session("新对话", session_id=session_id)
+        if not await get_session(session_id):
+            await create_session("新对话", session_id=session_id)
         cl.user_session.set("session_created", True)
 
 
@@ -147,10 +212,12 @@ async def on_message(message: cl.Message):
     text = message.content.strip()
     session_id = cl.user_session.get("session_id") or "meowdev"
 
-    _ensure_session(session_id)
+    await _ensure_session(session_id)
 
     if text == "/stop":
+        # 和停止按钮一样：打断进行中的回合，排队中的直接放弃
         cl.user_session.set("should_stop", True)
+        cancel_turns(session_id)
         await cl.Message(content="*猫猫们暂停了~*").send()
         return
 
@@ -163,10 +230,18 @@ async def on_message(message: cl.Message):
         return
 
     if text.startswith("/history"):
-        # 解析页码
+        # 解析翻页标记
         parts = text.split()
-        page = int(parts[1]) if len(parts) > 1 else 1
-        await _show_history(page, session_id)
+        cursor = parts[1] if len(parts) > 1 else None
+        await _show_history(cursor, session_id)
+        return
+
+    if text.startswith("/search"):
+        query = text[7:].strip()
+        if query:
+            await _show_search(query)
+        else:
+            await cl.Message(content="用法：`/search 登录接口`").send()
         return
 
     if text.startswith("/team"):
@@ -178,7 +253,8 @@ async def on_message(message: cl.Message):
         return
 
     # 普通聊天
-    add_message("用户", text, session_id)
+    await add_message("用户", text, session_id)
+    maintenance.record_activity()
     cl.user_session.set("should_stop", False)
 
     responders = _pick_responders(text)
@@ -188,12 +264,14 @@ async def on_message(message: cl.Message):
     while responders and round_count < max_rounds:
         round_count += 1
         next_round = []
+        # 本轮所有猫猫共用一份上下文快照，每只猫只从里面切出自己的增量
+        snapshot = await get_context_snapshot(session_id, [c.cat_id for c in responders])
 
         for cat in responders:
             if cl.user_session.get("should_stop"):
                 break
 
-            result = await _cat_respond(cat, session_id)
+            result = await _cat_respond(cat, session_id, snapshot)
             if result:
                 clean_text, skip, targets = result
 
@@ -205,13 +283,17 @@ async def on_message(message: cl.Message):
         responders = next_round
 
     # 摘要更新触发：每 20 条消息检查一次
-    message_count = get_message_count(session_id)
+    message_count = await get_message_count(session_id)
     if message_count > 0 and message_count % 20 == 0:
         asyncio.create_task(_update_summary_background(session_id))
 
 
-async def _cat_respond(cat: CatAgent, session_id: str) -> tuple[str, bool, list[str]] | None:
-    """猫猫回复 - 带实时流式输出，返回 (清理后文本, 是否跳过, 下一轮目标列表)"""
+async def _cat_respond(cat: CatAgent, session_id: str,
+                       snapshot: ContextSnapshot | None = None) -> tuple[str, bool, list[str]] | None:
+    """猫猫回复 - 带实时流式输出，返回 (清理后文本, 是否跳过, 下一轮目标列表)
+
+    传了本轮的上下文快照时，回复也追加进快照，同一轮后面的猫猫能看到。
+    """
     # 清空上次的使用数据
     cat.last_usage_data = {}
 
@@ -223,7 +305,8 @@ async def _cat_respond(cat: CatAgent, session_id: str) -> tuple[str, bool, list[
     first_chunk = True
 
     try:
-        async for chunk in cat.chat_stream_in_group(session_id):
+        async for chunk in cat.chat_stream_in_group(session_id, snapshot=snapshot,
+                                                     on_queued=queue_reporter(cat, msg)):
             if first_chunk:
                 msg.content = ""
                 first_chunk = False
@@ -232,8 +315,15 @@ async def _cat_respond(cat: CatAgent, session_id: str) -> tuple[str, bool, list[
             msg.content = full
             await msg.update()
 
+        if cl.user_session.get("should_stop"):
+            # 这一轮被 /stop 打断：半截回复只留在界面上，不当作正常消息保存，
+            # 发言高水位也不推进，下次这只猫猫还能看到这段上下文
+            msg.content = f"{full}\n\n*（{cat.name}被暂停了）*" if full.strip() else ""
+            await msg.update()
+            return None
+
         if not full.strip():
-            full = await cat.chat_in_group(session_id)
+            full = await cat.chat_in_group(session_id, snapshot=snapshot)
 
     except Exception as e:
         msg.content = f"（{cat.name}出了点状况: {e}）"
@@ -242,21 +332,26 @@ async def _cat_respond(cat: CatAgent, session_id: str) -> tuple[str, bool, list[
 
     # 记录使用统计
     if cat.last_usage_data:
-        add_cat_usage(cat.cat_id, cat.last_usage_data)
-
-    # 更新发言时间戳（增量历史优化）
-    update_cat_last_spoke(cat.cat_id, session_id)
+        await add_cat_usage(cat.cat_id, cat.last_usage_data)
 
     clean, skip, targets = cat.process_response(full)
 
     if skip or not clean.strip():
+        # 没有回复也要推进发言高水位（增量历史优化）
+        await update_cat_last_spoke(cat.cat_id, session_id)
+        if snapshot is not None:
+            snapshot.mark_spoke(cat.cat_id)
         msg.content = ""
         await msg.update()
         return None
 
     msg.content = clean
     await msg.update()
-    add_message(cat.name, clean, session_id)
+    # 写入回复的同时推进该猫的发言高水位
+    await add_message(cat.name, clean, session_id, cat_id=cat.cat_id)
+    if snapshot is not None:
+        snapshot.mark_spoke(cat.cat_id)
+        snapshot.add_message(cat.name, clean)
     return (clean, skip, targets)
 
 
@@ -276,27 +371,29 @@ def _pick_responders(text: str) -> list[CatAgent]:
     return cats
 
 
-async def _show_history(page: int = 1, session_id: str = "meowdev", page_size: int = 20):
-    """显示历史消息（分页）"""
-    total = get_message_count(session_id)
-    total_pages = (total + page_size - 1) // page_size
+async def _show_history(cursor: str | None = None, session_id: str = "meowdev", page_size: int = 20):
+    """显示历史消息（游标分页，从新到旧）"""
+    # 总数直接读会话计数器，不再每次 COUNT(*)
+    session = await get_session(session_id)
+    total = session["message_count"] if session else 0
 
     if total == 0:
         await cl.Message(content="**📜 历史消息**\n\n暂无历史消息").send()
         return
 
-    # 确保页码在有效范围内
-    page = max(1, min(page, total_pages))
-
-    offset = (page - 1) * page_size
-    messages = get_messages_paginated(session_id, offset, page_size)
+    try:
+        messages, next_cursor = await get_messages_paginated(session_id, cursor, page_size)
+    except ValueError:
+        await cl.Message(content="翻页标记无效，用 `/history` 从最新消息开始查看").send()
+        return
 
     if not messages:
         await cl.Message(content="没有更多历史消息了").send()
         return
 
     # 构建历史消息显示
-    lines = [f"**📜 历史消息（第 {page}/{total_pages} 页，共 {total} 条）**\n"]
+    title = "最新消息" if not cursor else "更早的消息"
+    lines = [f"**📜 历史消息（{title}，共 {total} 条）**\n"]
 
     for m in messages:
         role = m["role"]
@@ -308,10 +405,10 @@ async def _show_history(page: int = 1, session_id: str = "meowdev", page_size: i
 
     # 添加翻页提示
     nav_hints = []
-    if page > 1:
-        nav_hints.append(f"← `/history {page - 1}` 上一页")
-    if page < total_pages:
-        nav_hints.append(f"`/history {page + 1}` 下一页 →")
+    if cursor:
+        nav_hints.append("`/history` 回到最新")
+    if next_cursor:
+        nav_hints.append(f"`/history {next_cursor}` 更早 →")
 
     if nav_hints:
         lines.append("---\n" + " | ".join(nav_hints))
@@ -319,6 +416,24 @@ async def _show_history(page: int = 1, session_id: str = "meowdev", page_size: i
     await cl.Message(content="\n".join(lines)).send()
 
 
+async def _show_search(query: str, limit: int = 10):
+    """全文搜索所有会话的历史消息"""
+    results = await search_messages(query, limit=limit)
+    if not results:
+        await cl.Message(content=f"**🔍 搜索「{query}」**\n\n没有找到相关消息").send()
+        return
+
+    lines = [f"**🔍 搜索「{query}」（前 {len(results)} 条）**\n"]
+    for r in results:
+        when = datetime.fromtimestamp(r["timestamp"]).strftime("%Y-%m-%d %H:%M")
+        lines.append(
+            f"**{r['role']}** · {r['session_name']} · {when}\n"
+            f"> {r['snippet']}\n"
+            f"会话 `{r['session_id']}`\n"
+        )
+    await cl.Message(content="\n".join(lines)).send()
+
+
 async def _show_status():
     """显示功能进度"""
     from config import OUTPUT_DIR
@@ -344,14 +459,14 @@ async def _run_team(requirement: str, session_id: str = "meowdev"):
     """运行团队协作"""
     from config import OUTPUT_DIR
 
-    add_message("用户", f"[启动团队协作] {requirement}", session_id)
+    await add_message("用户", f"[启动团队协作] {requirement}", session_id)
     await cl.Message(content=f"**团队协作启动**\n\n需求：{requirement}\n---").send()
 
     team = MeowDevTeam()
 
     async def on_cat_speak(cat: CatAgent, phase: Phase, task: str) -> str:
         """猫猫发言 - 带实时流式输出"""
-        add_message("system", f"[{cat.name}的任务] {task}", session_id)
+        await add_message("system", f"[{cat.name}的任务] {task}", session_id)
 
         # 创建消息并显示"正在思考"状态
         msg = cat_msg(cat, f"_{cat.name} 正在思考..._")
@@ -361,7 +476,8 @@ async def _run_team(requirement: str, session_id: str = "meowdev"):
         first_chunk = True
 
         try:
-            async for chunk in cat.chat_stream_in_group(session_id):
+            async for chunk in cat.chat_stream_in_group(session_id, priority=Priority.TEAM,
+                                                         on_queued=queue_reporter(cat, msg)):
                 if first_chunk:
                     # 收到第一个 chunk，清除"正在思考"
                     msg.content = ""
@@ -374,7 +490,7 @@ async def _run_team(requirement: str, session_id: str = "meowdev"):
 
             # 流式结束后，处理回复
             if not full.strip():
-                full = await cat.chat_in_group(session_id)
+                full = await cat.chat_in_group(session_id, priority=Priority.TEAM)
 
             clean, _, _ = cat.process_response(full)
             result = clean or full
@@ -382,7 +498,7 @@ async def _run_team(requirement: str, session_id: str = "meowdev"):
             # 最终更新
             msg.content = result
             await msg.update()
-            add_message(cat.name, result, session_id)
+            await add_message(cat.name, result, session_id)
             return result
 
         except Exception as e:
@@ -436,13 +552,14 @@ async def _update_summary_background(session_id: str):
     """
     后台更新会话摘要
 
-    使用 Arch 酱来生成摘要（因为她擅长总结）
+    走后台任务通道（cli_process.utility_lane）的一次性进程，不写进猫猫的会话
+    上下文，也不占对话回合的名额
     """
     import json
 
     try:
         # 获取消息历史
-        messages = get_recent_messages(session_id, limit=50)
+        messages = await get_recent_messages(session_id, limit=50)
         if not messages:
             return
 
@@ -454,10 +571,7 @@ async def _update_summary_background(session_id: str):
 
         prompt = SUMMARY_PROMPT.format(chat_history=chat_text)
 
-        # 使用 Arch 酱来生成摘要（直接发送 prompt，不使用群聊上下文）
-        summary_text = ""
-        async for chunk in arch.send_message(prompt, session_id):
-            summary_text += chunk
+        summary_text = await utility_lane.run(prompt)
 
         if not summary_text.strip():
             return
@@ -476,7 +590,7 @@ async def _update_summary_background(session_id: str):
                 summary_text = "\n".join(lines)
 
             parsed = json.loads(summary_text)
-            update_session_summary(
+            await update_session_summary(
                 session_id,
                 parsed.get("summary", summary_text),
                 parsed.get("key_goals", []),
@@ -485,7 +599,7 @@ async def _update_summary_background(session_id: str):
             print(f"[MeowDev] 已更新会话 {session_id[:8]} 的摘要")
         except json.JSONDecodeError:
             # JSON 解析失败，直接使用文本作为摘要
-            update_session_summary(session_id, summary_text[:500], [], [])
+            await update_session_summary(session_id, summary_text[:500], [], [])
             print(f"[MeowDev] 已更新会话 {session_id[:8]} 的摘要（文本模式）")
 
     except Exception as e:
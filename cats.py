@@ -11,33 +11,34 @@ Phase 1 升级：
 - 持久化交互式会话：每只猫猫维护独立的持久进程
 - 实时流式输出：支持 stdin/stdout 双向通信
 - Session 管理：通过 --session-id 绑定会话上下文
+
+进程的启动、预热池、全局回合调度和进程守护见 cli_process.py。
 """
 
 import asyncio
 import json
-import os
 import re
 import uuid
 from pathlib import Path
 from typing import AsyncIterator, Optional
 
-from config import CAT_CONFIGS, CLI_TIMEOUT
-
-
-# ── 交互式 CLI 配置 ──────────────────────────────────────
-
-CLAUDE_CLI_PATH = os.getenv("CLAUDE_CLI_PATH", "claude")
-
-# 交互式模式的基础 flags
-# Phase 1 修复：必须保留 -p（headless 模式入口），stream-json 功能才能生效
-INTERACTIVE_FLAGS = [
-    "-p",  # 必须保留！这是 headless 模式入口，stream-json 功能只在此模式下生效
-    "--output-format", "stream-json",
-    "--input-format", "stream-json",
-    "--verbose",  # 必需！stream-json 输出格式需要此标志
-    # "--include-partial-messages",  # 暂时注释，先验证基本流程
-    "--dangerously-skip-permissions",
-]
+from cli_process import (
+    CLAUDE_CLI_PATH,
+    Priority,
+    QueueCallback,
+    TurnControl,
+    TurnInterrupted,
+    WarmPool,
+    _get_subprocess_env,
+    interrupt_turn,
+    registry,
+    spawn_cli,
+    supervisor,
+    terminate_process,
+    turn_scheduler,
+    utility_lane,
+)
+from config import CAT_CONFIGS, CLI_INTERRUPT_GRACE, CLI_TIMEOUT
 
 
 # ── 工具名称中文映射 ──────────────────────────────────────
@@ -69,19 +70,6 @@ TOOL_ICONS = {
 }
 
 
-def _get_subprocess_env() -> dict:
-    """获取 subprocess 环境变量，清除 CLAUDECODE 避免嵌套会话检测"""
-    env = os.environ.copy()
-    # 显式设为空字符串，确保子进程不会继承父进程的 CLAUDECODE
-    env["CLAUDECODE"] = ""
-    # 同时清除可能相关的其他变量
-    env.pop("CLAUDE_CODE_SESSION", None)
-    env.pop("ANTHROPIC_API_KEY", None)  # 让子进程用自己的配置
-    # 增加 Node.js 流处理的缓冲区大小
-    env["NODE_OPTIONS"] = "--max-old-space-size=4096"
-    return env
-
-
 def _parse_stream_json_line(line: str) -> Optional[dict]:
     """解析单行 JSON，失败返回 None"""
     line = line.strip()
@@ -238,14 +226,16 @@ def _parse_stream_json_output(raw: str) -> str:
     return final_text
 
 
-from memory import (
-    add_cat_memory,
+import memory
+from memory import ContextSnapshot
+from memory_async import (
     format_cat_memory_context,
-    format_chat_context,
     format_chat_context_since,
+    format_snapshot_context,
     format_user_profile_context,
-    set_user_info,
-    get_cat_last_spoke,
+    get_cli_session,
+    set_cli_session,
+    submit_write,
 )
 
 
@@ -289,6 +279,25 @@ class CatAgent:
         self._locks: dict[str, asyncio.Lock] = {}
         # 全局锁，保护 _locks 字典的并发访问
         self._global_lock = asyncio.Lock()
+        # 预热进程池：thread 第一次发言时直接领一个已启动的进程
+        self.warm_pool = WarmPool(cat_id)
+        # 本进程里用过 CLI 的 thread → CLI session id
+        # （领用的预热进程是随机 id，现场启动的是按 thread 生成的确定性 id）
+        self._cli_session_ids: dict[str, str] = {}
+        # 已经发过消息的 thread：CLI 里有它的会话，进程重启时要 --resume
+        self._resumable: set[str] = set()
+        # 正在处理消息的 thread → 进行中的请求数，进程登记表不会回收它们
+        self._in_flight: dict[str, int] = {}
+        # 还没结束的回合（排队、启动进程、读输出中）的时限 / 取消信号（cancel() 用）
+        self._turns: dict[str, set[TurnControl]] = {}
+        # 被打断的一轮在后台收尾的任务，收尾完之前同一 thread 的下一轮要等着
+        self._draining: dict[str, asyncio.Task] = {}
+        # 进程意外退出、还没重启的 thread（重启时记一次 respawn）
+        self._crashed: set[str] = set()
+        # 打断统计：cancelled / deadline / idle 是原因，kept / killed 是收尾结果
+        self.turn_stats = {"cancelled": 0, "deadline": 0, "idle": 0,
+                           "interrupt_kept": 0, "interrupt_killed": 0}
+        registry.register_owner(cat_id, self._evict_process)
 
         prompt_file = cfg["prompt_file"]
         if Path(prompt_file).exists():
@@ -296,23 +305,35 @@ class CatAgent:
         else:
             self.personality = f"你是{self.name}，一只{self.breed}。"
 
-    def _build_group_prompt(self, session_id: str = "default") -> str:
-        """构建群聊 prompt = 性格 + 记忆 + 用户画像 + 增量对话历史"""
+    async def _build_group_prompt(self, session_id: str = "default",
+                                  snapshot: Optional[ContextSnapshot] = None) -> str:
+        """构建群聊 prompt = 性格 + 记忆 + 用户画像 + 增量对话历史
+
+        传了 snapshot（本轮共享的上下文快照）时直接从快照切出自己的部分，
+        不再单独查询对话、摘要和画像。
+        """
         parts = [self.personality]
 
+        if snapshot is not None:
+            memory_ctx, profile_ctx, chat_ctx, is_cold_start = await format_snapshot_context(
+                snapshot, self.cat_id, self.name,
+            )
+        else:
+            # 三块上下文互不依赖，并发读取
+            memory_ctx, profile_ctx, (chat_ctx, is_cold_start) = await asyncio.gather(
+                format_cat_memory_context(self.cat_id, session_id=session_id),  # 只带和当前话题相关的记忆
+                format_user_profile_context(session_id),
+                format_chat_context_since(self.cat_id, self.name, session_id),  # 增量对话历史（关键改动）
+            )
+
         # 猫猫记忆
-        memory_ctx = format_cat_memory_context(self.cat_id)
         if memory_ctx:
             parts.append(f"\n\n【你的记忆】\n{memory_ctx}")
 
         # 用户画像
-        profile_ctx = format_user_profile_context()
         if profile_ctx:
             parts.append(f"\n\n【{profile_ctx}】")
 
-        # 增量对话历史（关键改动）
-        chat_ctx, is_cold_start = format_chat_context_since(self.cat_id, self.name, session_id)
-
         if is_cold_start:
             # 冷启动：使用摘要
             if chat_ctx:
@@ -357,9 +378,29 @@ class CatAgent:
             return self._locks[session_id]
 
     def _get_cli_session_id(self, session_id: str) -> str:
-        """基于 Chainlit session_id 生成确定性 CLI session UUID"""
+        """thread 对应的 CLI session UUID：已绑定过的沿用，否则基于 Chainlit session_id 确定性生成"""
+        bound = self._cli_session_ids.get(session_id)
+        if bound:
+            return bound
         return str(uuid.uuid5(uuid.NAMESPACE_URL, f"meow-{self.cat_id}-{session_id}"))
 
+    async def _load_cli_session(self, session_id: str):
+        """从数据库找回 thread 上次用的 CLI 会话 id，找到时下次启动用 --resume 接上
+
+        记录 CLI 会话 id 之前的老 thread 只要猫猫发过言，就按确定性 id 接上。
+        两者都没有的才算全新 thread，可以领预热进程。
+        """
+        try:
+            cli_session_id, spoke = await get_cli_session(self.cat_id, session_id)
+        except Exception as e:
+            print(f"[MeowDev] 读取 {self.cat_id} 的 CLI 会话失败（session_id={session_id}）：{e}")
+            return
+        if cli_session_id is None and spoke:
+            cli_session_id = self._get_cli_session_id(session_id)
+        if cli_session_id is not None:
+            self._cli_session_ids[session_id] = cli_session_id
+            self._resumable.add(session_id)
+
     async def _start_cli_process(self, session_id: str, cwd: Optional[str] = None) -> asyncio.subprocess.Process:
         """
         启动或复用持久化 CLI 进程
@@ -368,6 +409,7 @@ class CatAgent:
         - 每个 session_id 对应独立的进程
         - 同一 session_id 复用进程（保持记忆）
         - 不同 session_id 使用不同进程
+        - 第一次启动时优先从预热池领用（见 cli_process.WarmPool）
 
         Args:
             session_id: Chainlit thread ID
@@ -376,6 +418,11 @@ class CatAgent:
         Returns:
             该 session 对应的进程对象
         """
+        # 上一轮被打断、还在后台收尾时等它结束，免得读到上一轮剩下的输出
+        draining = self._draining.get(session_id)
+        if draining is not None:
+            await asyncio.shield(draining)
+
         lock = await self._get_session_lock(session_id)
 
         async with lock:
@@ -385,52 +432,68 @@ class CatAgent:
                 print(f"[DEBUG] 复用进程 PID={process.pid}, cat_id={self.cat_id}, session_id={session_id}")
                 return process
 
-            # 生成确定性 CLI session UUID
-            cli_session_id = self._get_cli_session_id(session_id)
-
-            cmd = [
-                CLAUDE_CLI_PATH,
-                "-p",
-                "--session-id", cli_session_id,  # 关键：绑定会话，实现记忆持久化
-                "--output-format", "stream-json",
-                "--input-format", "stream-json",
-                "--verbose",
-                "--dangerously-skip-permissions",
-            ]
+            # 进程数到上限时先回收最久没用的
+            await registry.make_room(self.cat_id)
+
+            # 本进程里第一次碰到这个 thread：先找回上次用的 CLI 会话（app 重启过）
+            if session_id not in self._cli_session_ids:
+                await self._load_cli_session(session_id)
+
+            # 全新的 thread 且用默认工作目录时，优先领预热进程
+            if cwd is None and session_id not in self._cli_session_ids:
+                warm = self.warm_pool.acquire()
+                if warm is not None:
+                    self._cli_session_ids[session_id] = warm.cli_session_id
+                    self._processes[session_id] = warm.process
+                    registry.touch(self.cat_id, session_id)
+                    supervisor.watch(self.cat_id, session_id, warm.process, self._on_process_crash)
+                    print(f"[DEBUG] 领用预热进程 PID={warm.process.pid}, cat_id={self.cat_id}, "
+                          f"session_id={session_id}, cli_session_id={warm.cli_session_id}")
+                    return warm.process
 
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=cwd,
-                env=_get_subprocess_env(),
+            cli_session_id = self._get_cli_session_id(session_id)
+            # 被回收 / 清理过的 thread 接着原来的 CLI 会话
+            resume = session_id in self._resumable
+            process = await spawn_cli(
+                cli_session_id, label=f"{self.cat_id}:{session_id[:8]}", cwd=cwd, resume=resume,
             )
-            # 增大缓冲区支持大文件
-            if process.stdout:
-                process.stdout._limit = 10 * 1024 * 1024  # 10MB
 
             # 存储到字典
             self._processes[session_id] = process
+            self._cli_session_ids[session_id] = cli_session_id
+            registry.touch(self.cat_id, session_id)
+            supervisor.watch(self.cat_id, session_id, process, self._on_process_crash)
+            if session_id in self._crashed:
+                self._crashed.discard(session_id)
+                supervisor.respawns += 1
 
             # DEBUG 打印
-            print(f"[DEBUG] 启动新进程 PID={process.pid}, cat_id={self.cat_id}, session_id={session_id}, cli_session_id={cli_session_id}")
-
-            # 启动后台 stderr 监听
-            asyncio.create_task(self._read_stderr(process, session_id))
+            print(f"[DEBUG] {'恢复' if resume else '启动新'}进程 PID={process.pid}, cat_id={self.cat_id}, "
+                  f"session_id={session_id}, cli_session_id={cli_session_id}")
 
             return process
 
-    async def _read_stderr(self, process: asyncio.subprocess.Process, session_id: str):
-        """后台读取 stderr，打印错误信息（调试用）"""
-        if process and process.stderr:
-            try:
-                async for line in process.stderr:
-                    print(f"[STDERR:{self.cat_id}:{session_id[:8]}] {line.decode('utf-8').strip()}")
-            except Exception as e:
-                print(f"[STDERR:{self.cat_id}:{session_id[:8]}] 读取错误: {e}")
+    async def _evict_process(self, session_id: str, reason: str) -> bool:
+        """被进程登记表回收（LRU / 空闲超时）：终止进程，释放锁
 
-    async def send_message(self, message: str, session_id: str = "default", cwd: Optional[str] = None) -> AsyncIterator[str]:
+        CLI session id 保留，thread 下次发言时 --resume 重新启动。
+        正在处理消息的进程不回收，返回 False。
+        """
+        lock = self._locks.get(session_id)
+        if (session_id in self._in_flight or session_id in self._draining
+                or (lock is not None and lock.locked())):
+            return False
+        process = self._processes.pop(session_id, None)
+        self._locks.pop(session_id, None)
+        if process is not None:
+            await terminate_process(process)
+            print(f"[MeowDev] 回收 {self.cat_id} 的 CLI 进程 PID={process.pid}"
+                  f"（session_id={session_id}，原因：{reason}）")
+        return True
+
+    async def send_message(self, message: str, session_id: str = "default", cwd: Optional[str] = None,
+                           priority: Priority = Priority.INTERACTIVE,
+                           on_queued: Optional[QueueCallback] = None) -> AsyncIterator[str]:
         """
         交互式发送消息并实时流式读取响应
 
@@ -438,73 +501,163 @@ class CatAgent:
         - session_id 参数用于区分不同 Chainlit thread
         - 每个 session 使用独立的 CLI 进程
 
+        每一轮都先经过全局回合调度（turn_scheduler），名额满时按优先级排队。
+        排队、启动进程时被 cancel() 的回合直接放弃，不会再发给 CLI。
+
         Args:
             message: 用户消息/提示词
             session_id: Chainlit thread ID，用于进程隔离
             cwd: 工作目录
+            priority: 回合优先级
+            on_queued: 排队时报告排队位置（见 cli_process.TurnScheduler.turn）
 
         Yields:
             流式输出的文本片段
         """
-        process = await self._start_cli_process(session_id, cwd)
-
-        # Step 2: DEBUG 打印
-        print(f"[DEBUG] send_message: PID={process.pid}, alive={process.returncode is None}")
-
-        # 发送 JSON 格式消息（不关闭 stdin！）
-        # Phase 1 修复 v3：正确格式是 {"type": "user", "message": {"role": "user", "content": "xxx"}}
-        input_json = json.dumps({
-            "type": "user",
-            "message": {"role": "user", "content": message}
-        }) + "\n"
-        process.stdin.write(input_json.encode("utf-8"))
-        await process.stdin.drain()  # 刷新缓冲区，但不关闭
-
-        accumulated_text = ""
-        seen_tool_ids = set()
-        final_result = ""
-
-        # 读取响应直到收到 result 类型消息
-        async for line in process.stdout:
-            line_str = line.decode("utf-8")
-
-            data = _parse_stream_json_line(line_str)
-            if not data:
-                continue
-
-            # 1. 提取并显示工具调用
-            tool = _extract_tool_details(data)
-            if tool:
-                tool_id = tool.get("id")
-                if tool_id and tool_id not in seen_tool_ids:
-                    seen_tool_ids.add(tool_id)
-                    yield self._format_tool_call(tool)
-
-            # 2. 提取文本内容（增量）
-            text = _extract_text_content(data)
-            if text and text != accumulated_text:
-                if text.startswith(accumulated_text):
-                    new_text = text[len(accumulated_text):]
-                    accumulated_text = text
-                    if new_text:
-                        yield new_text
+        control = TurnControl()
+        self._turns.setdefault(session_id, set()).add(control)
+        try:
+            async with turn_scheduler.turn(priority, on_queued, control):
+                self._in_flight[session_id] = self._in_flight.get(session_id, 0) + 1
+                try:
+                    async for chunk in self._send_message(message, session_id, cwd, control):
+                        yield chunk
+                finally:
+                    remaining = self._in_flight.pop(session_id) - 1
+                    if remaining:
+                        self._in_flight[session_id] = remaining
+                    if session_id in self._processes:
+                        registry.touch(self.cat_id, session_id)
+        except TurnInterrupted as e:
+            # 还在排队就被取消了
+            self.turn_stats[e.reason] += 1
+            print(f"[MeowDev] {self.cat_id} 排队中的一轮被取消（session_id={session_id}）")
+        finally:
+            controls = self._turns.get(session_id)
+            if controls is not None:
+                controls.discard(control)
+                if not controls:
+                    del self._turns[session_id]
+
+    async def _send_message(self, message: str, session_id: str, cwd: Optional[str],
+                            control: TurnControl) -> AsyncIterator[str]:
+        """send_message 的一轮对话：写 stdin，读 stdout 直到 result
+
+        超过总时限、长时间没有输出或被 cancel() 时立刻结束；没读完的输出
+        交给后台 _drain_turn 收尾，进程尽量留着继续用。
+        进程在这一轮中途退出时用 --resume 重启，把这一轮重发一次。
+        """
+        interrupted: Optional[str] = None
+        for attempt in range(2):
+            process = await self._start_cli_process(session_id, cwd)
+            if control.cancelled:
+                # 启动进程时被取消：消息还没发出去，进程留着给下一轮
+                interrupted = control.reason
+                break
+
+            # Step 2: DEBUG 打印
+            print(f"[DEBUG] send_message: PID={process.pid}, alive={process.returncode is None}")
+
+            control.start()
+            finished = False
+            crashed = False
+            accumulated_text = ""
+            seen_tool_ids = set()
+            final_result = ""
+            try:
+                try:
+                    # 发送 JSON 格式消息（不关闭 stdin！）
+                    # Phase 1 修复 v3：正确格式是 {"type": "user", "message": {"role": "user", "content": "xxx"}}
+                    input_json = json.dumps({
+                        "type": "user",
+                        "message": {"role": "user", "content": message}
+                    }) + "\n"
+                    process.stdin.write(input_json.encode("utf-8"))
+                    await process.stdin.drain()  # 刷新缓冲区，但不关闭
+                except (BrokenPipeError, ConnectionResetError):
+                    crashed = True  # 进程已经退出了
                 else:
-                    accumulated_text = text
-                    yield text
-
-            # 3. 提取 result 类型的最终结果（兜底）
-            result_text = _extract_final_result(data)
-            if result_text:
-                final_result = result_text
-
-            # 4. 提取 modelUsage 统计数据
-            usage = extract_model_usage(data)
-            if usage:
-                self.last_usage_data = usage
+                    if session_id not in self._resumable:
+                        # CLI 会话从这一轮开始存在，记下来，重启后按它 --resume
+                        self._resumable.add(session_id)
+                        try:
+                            await set_cli_session(self.cat_id, session_id, self._cli_session_ids[session_id])
+                        except Exception as e:
+                            # 记不下来只影响重启后接上下文，这一轮照常进行
+                            print(f"[MeowDev] 保存 {self.cat_id} 的 CLI 会话失败（session_id={session_id}）：{e}")
+
+                    # 读取响应直到收到 result 类型消息
+                    while line := await control.readline(process.stdout):
+                        line_str = line.decode("utf-8")
+
+                        data = _parse_stream_json_line(line_str)
+                        if not data:
+                            continue
+
+                        # 1. 提取并显示工具调用
+                        tool = _extract_tool_details(data)
+                        if tool:
+                            tool_id = tool.get("id")
+                            if tool_id and tool_id not in seen_tool_ids:
+                                seen_tool_ids.add(tool_id)
+                                yield self._format_tool_call(tool)
+
+                        # 2. 提取文本内容（增量）
+                        text = _extract_text_content(data)
+                        if text and text != accumulated_text:
+                            if text.startswith(accumulated_text):
+                                new_text = text[len(accumulated_text):]
+                                accumulated_text = text
+                                if new_text:
+                                    yield new_text
+                            else:
+                                accumulated_text = text
+                                yield text
+
+                        # 3. 提取 result 类型的最终结果（兜底）
+                        result_text = _extract_final_result(data)
+                        if result_text:
+                            final_result = result_text
+
+                        # 4. 提取 modelUsage 统计数据
+                        usage = extract_model_usage(data)
+                        if usage:
+                            self.last_usage_data = usage
+
+                        # 5. 检测响应结束（result 类型）
+                        if data.get("type") == "result":
+                            finished = True
+                            break  # 退出循环，但不关闭进程
+                    else:
+                        crashed = True  # stdout 关闭：进程在这一轮中途退出了
+
+            except TurnInterrupted as e:
+                interrupted = e.reason
+            finally:
+                if not finished and not crashed:
+                    # 被打断 / 调用方中途放弃：后台收尾，立刻让出回合名额
+                    self._start_drain(session_id, process)
+
+            if not crashed:
+                break
+
+            await self._reap_crashed(session_id, process)
+            if attempt == 0:
+                supervisor.replays += 1
+                print(f"[MeowDev] {self.cat_id} 的 CLI 进程在回合中退出，重启后重发这一轮（session_id={session_id}）")
+                if accumulated_text or seen_tool_ids:
+                    yield f"\n\n（{self.name}的进程意外退出了，重启后重新回答喵...）\n\n"
+                continue
+            supervisor.replay_failures += 1
+            yield f"\n（{self.name}的进程重启后又退出了，这次没能回复喵...）"
+            return
 
-            # 5. 检测响应结束（result 类型）
-            if data.get("type") == "result":
-                break  # 退出循环，但不关闭进程
+        if interrupted:
+            self.turn_stats[interrupted] += 1
+            print(f"[MeowDev] {self.cat_id} 的一轮对话被打断（session_id={session_id}，原因：{interrupted}）")
+            if interrupted != "cancelled":
+                yield f"\n（{self.name}想了太久，超时了喵...）"
+            return
 
         # 如果没有从 assistant 消息获取到文本，使用 result 作为兜底
         if not accumulated_text and final_result:
@@ -515,6 +668,57 @@ class CatAgent:
         # 不要重置 self.process = None！
         # 不要关闭 stdin！进程保持常驻等待下一条消息
 
+    async def _reap_crashed(self, session_id: str, process: asyncio.subprocess.Process):
+        """回合中发现进程退出：等它退出完（stdout 关了进程却还在就终止），从 session 上摘掉"""
+        try:
+            await asyncio.wait_for(process.wait(), timeout=CLI_INTERRUPT_GRACE)
+        except asyncio.TimeoutError:
+            await terminate_process(process)
+        self._on_process_crash(session_id, process)
+
+    def _on_process_crash(self, session_id: str, process: asyncio.subprocess.Process):
+        """进程意外退出（进程守护或回合中发现）：摘掉死进程，下次用到时 --resume 重启"""
+        if self._processes.get(session_id) is process:
+            del self._processes[session_id]
+            registry.forget(self.cat_id, session_id)
+            self._crashed.add(session_id)
+
+    def cancel(self, session_id: str, reason: str = "cancelled") -> bool:
+        """打断 session 还没结束的回合（/stop 用），没有时返回 False
+
+        正在读输出的一轮立刻结束并让出回合名额，进程在后台中断后留着继续用；
+        还在排队或启动进程的直接放弃，不会再发给 CLI。
+        """
+        controls = self._turns.get(session_id)
+        if not controls:
+            return False
+        for control in controls:
+            control.cancel(reason)
+        return True
+
+    def _start_drain(self, session_id: str, process: asyncio.subprocess.Process):
+        task = asyncio.create_task(self._drain_turn(session_id, process))
+        self._draining[session_id] = task
+
+        def _done(t: asyncio.Task):
+            if self._draining.get(session_id) is t:
+                del self._draining[session_id]
+
+        task.add_done_callback(_done)
+
+    async def _drain_turn(self, session_id: str, process: asyncio.subprocess.Process):
+        """后台收尾没读完的一轮：CLI 停下就保留进程，否则终止（下次发言 --resume 重启）"""
+        if await interrupt_turn(process):
+            self.turn_stats["interrupt_kept"] += 1
+            print(f"[DEBUG] 已中断 {self.cat_id} 的进行中回合，保留进程 PID={process.pid}")
+            return
+        self.turn_stats["interrupt_killed"] += 1
+        if self._processes.get(session_id) is process:
+            del self._processes[session_id]
+            registry.forget(self.cat_id, session_id)
+        await terminate_process(process)
+        print(f"[MeowDev] {self.cat_id} 的 CLI 进程没有响应中断，已终止 PID={process.pid}（session_id={session_id}）")
+
     async def cleanup(self, session_id: Optional[str] = None):
         """
         清理资源：终止进程
@@ -539,12 +743,8 @@ class CatAgent:
                 process = self._processes.get(sid)
                 if process and process.returncode is None:
                     try:
-                        process.terminate()
-                        await asyncio.wait_for(process.wait(), timeout=5.0)
+                        await terminate_process(process)
                         print(f"[DEBUG] 清理进程 PID={process.pid}, cat_id={self.cat_id}, session_id={sid}")
-                    except asyncio.TimeoutError:
-                        process.kill()
-                        await process.wait()
                     except Exception:
                         pass
                 # 从字典中删除
@@ -552,6 +752,8 @@ class CatAgent:
                     del self._processes[sid]
                 if sid in self._locks:
                     del self._locks[sid]
+                registry.forget(self.cat_id, sid)
+                self._crashed.discard(sid)
 
     def _format_tool_call(self, tool: dict) -> str:
         """格式化工具调用为友好显示"""
@@ -627,13 +829,14 @@ class CatAgent:
         # 清理标记和提取记忆
         clean_text = re.sub(r'\[讨论\]|\[问:\w+\]', '', response).strip()
         clean_text, memories = _extract_memories(clean_text)
+        # 写入交给数据库写线程，不阻塞事件循环
         for mem in memories:
-            add_cat_memory(self.cat_id, mem.strip(), importance=2)
+            submit_write(memory.add_cat_memory, self.cat_id, mem.strip(), importance=2)
 
         # 提取用户信息
         user_info = re.findall(r'\[用户[：:]\s*(\w+)[：:]\s*(.+?)\]', clean_text)
         for key, value in user_info:
-            set_user_info(key.strip(), value.strip())
+            submit_write(memory.set_user_info, key.strip(), value.strip())
 
         # 清理用户信息标记
         clean_text = re.sub(r'\[用户[：:]\s*\w+[：:]\s*.+?\]', '', clean_text).strip()
@@ -644,7 +847,10 @@ class CatAgent:
 
     async def chat_in_group(self, session_id: str = "default",
                             cwd: Optional[str] = None,
-                            use_interactive: bool = True) -> str:
+                            use_interactive: bool = True,
+                            snapshot: Optional[ContextSnapshot] = None,
+                            priority: Priority = Priority.INTERACTIVE,
+                            on_queued: Optional[QueueCallback] = None) -> str:
         """
         群聊模式：基于完整上下文生成回复
 
@@ -652,13 +858,13 @@ class CatAgent:
         - session_id 直接传递给 send_message，不再修改实例属性
         - 每个 Chainlit thread 使用独立的 CLI 进程
         """
-        prompt = self._build_group_prompt(session_id)
+        prompt = await self._build_group_prompt(session_id, snapshot)
 
         if use_interactive:
             # Phase 2: 传递 session_id 实现进程隔离
             full = ""
             try:
-                async for chunk in self.send_message(prompt, session_id, cwd):
+                async for chunk in self.send_message(prompt, session_id, cwd, priority, on_queued):
                     full += chunk
                 return full
             except FileNotFoundError:
@@ -696,7 +902,10 @@ class CatAgent:
 
     async def chat_stream_in_group(self, session_id: str = "default",
                                     cwd: Optional[str] = None,
-                                    use_interactive: bool = True) -> AsyncIterator[str]:
+                                    use_interactive: bool = True,
+                                    snapshot: Optional[ContextSnapshot] = None,
+                                    priority: Priority = Priority.INTERACTIVE,
+                                    on_queued: Optional[QueueCallback] = None) -> AsyncIterator[str]:
         """
         群聊模式的流式输出版本
         支持 stream-json 格式，显示工具调用进度和流式文本
@@ -705,12 +914,12 @@ class CatAgent:
         - session_id 直接传递给 send_message，不再修改实例属性
         - 每个 Chainlit thread 使用独立的 CLI 进程
         """
-        prompt = self._build_group_prompt(session_id)
+        prompt = await self._build_group_prompt(session_id, snapshot)
 
         if use_interactive:
             # Phase 2: 传递 session_id 实现进程隔离
             try:
-                async for chunk in self.send_message(prompt, session_id, cwd):
+                async for chunk in self.send_message(prompt, session_id, cwd, priority, on_queued):
                     yield chunk
                 return
             except FileNotFoundError:
@@ -801,3 +1010,34 @@ pixel = CatAgent("pixel")
 
 ALL_CATS = [arch, stack, pixel]
 CAT_MAP = {c.cat_id: c for c in ALL_CATS}
+
+
+def start_cli_processes():
+    """启动三只猫猫和后台任务通道的预热进程池、空闲进程回收任务（需要在事件循环里调用，幂等）"""
+    for cat in ALL_CATS:
+        cat.warm_pool.start()
+    utility_lane.start()
+    registry.start()
+
+
+def cancel_turns(session_id: str) -> int:
+    """打断三只猫猫在这个 thread 里还没结束的回合（含排队中的），返回打断的猫猫数"""
+    return sum(cat.cancel(session_id) for cat in ALL_CATS)
+
+
+def process_stats() -> dict:
+    """CLI 进程指标（/api/processes）"""
+    return {
+        "cats": {
+            cat.cat_id: {
+                "sessions": sum(1 for p in cat._processes.values() if p.returncode is None),
+                "warm_pool": cat.warm_pool.stats(),
+                "turns": dict(cat.turn_stats),
+            }
+            for cat in ALL_CATS
+        },
+        "registry": registry.stats(),
+        "scheduler": turn_scheduler.stats(),
+        "utility": utility_lane.stats(),
+        "supervisor": supervisor.stats(),
+    }
@@ -0,0 +1,776 @@
+"""
+Claude CLI 进程管理
+
+CatAgent 为每个 Chainlit thread 维护一个常驻的 `claude -p` 进程（stdin/stdout
+上 stream-json 双向通信），进程统一由这里的 spawn_cli() 启动。
+
+预热池（WarmPool）：每只猫猫预先启动 CLI_WARM_POOL_SIZE 个空闲进程，thread
+第一次需要进程时直接领走一个，Node 启动和 CLI 初始化不再算进用户的首字延迟，
+领走之后在后台补齐。预热进程启动时还不知道要服务哪个 thread，用的是随机的
+CLI session id，由 CatAgent 在领走时记下 thread → CLI session id 的对应关系。
+
+进程登记表（registry）：所有猫猫的会话进程按最近使用时间排队，总数超过
+CLI_MAX_PROCESSES、或单只猫超过 CLI_MAX_PROCESSES_PER_CAT 时回收最久没用的，
+后台任务每 CLI_REAPER_INTERVAL 秒回收空闲超过 CLI_IDLE_TIMEOUT 的。正在处理
+消息的进程不会被回收；被回收的 thread 下次发言时用 --resume 接着原来的 CLI
+会话重新启动，对用户透明。
+
+用法：
+    pool = WarmPool("arch")
+    pool.start()              # 在事件循环里调用，幂等
+    proc = pool.acquire()     # 没有空闲进程时返回 None，由调用方现场启动
+
+    registry.register_owner("arch", evict)   # evict(session_id, reason) -> 是否已回收
+    await registry.make_room("arch")         # 启动新进程前按上限腾位置
+    registry.touch("arch", session_id)       # 每次使用时调用
+    registry.start()                         # 启动空闲回收任务（幂等）
+
+回合调度（turn_scheduler）：所有猫猫的对话回合共用 CLI_MAX_CONCURRENT_TURNS 个
+名额，满了之后按优先级排队（用户聊天 > /team 阶段 > 后台任务），同一优先级先来
+先到。排队不设超时，等待期间通过回调报告排队位置，由界面显示给用户。
+
+    async with turn_scheduler.turn(Priority.TEAM, on_queued=report):
+        ...                                  # report(位置)，开始执行时报告 0
+
+单轮时限与打断（TurnControl）：交互式一轮对话有总时限（CLI_TIMEOUT），CLI 连续
+CLI_IDLE_OUTPUT_TIMEOUT 秒没有输出也算卡住；调用方可以随时 cancel()。读输出时
+三者一起等，任何一个先到都立刻结束这一轮、让出回合名额。没读完的输出交给
+interrupt_turn() 在后台处理：发 interrupt 控制消息让 CLI 停下并读掉剩余输出，
+进程留着继续用；CLI 在 CLI_INTERRUPT_GRACE 秒内没收尾才终止进程。
+
+后台任务通道（utility_lane）：会话摘要这类不需要猫猫会话上下文的调用走单独的
+一次性进程（有自己的预热池和 CLI_UTILITY_CONCURRENCY 并发上限），不写进任何
+thread 的 CLI 会话，也不占对话回合的名额。
+
+    text = await utility_lane.run(prompt)
+
+进程守护（supervisor）：盯着每个会话进程的退出。terminate_process() 终止的算
+正常退出，其余（OOM 被杀、Node 崩溃等）记一次崩溃和退出原因，并通知所属猫猫
+把死进程摘掉；正在进行的一轮由 CatAgent 用 --resume 重启进程后重发一次。
+崩溃 / 重启 / 重发次数见 supervisor.stats()。
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import signal
+import time
+import uuid
+import weakref
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from config import (
+    CLI_IDLE_OUTPUT_TIMEOUT,
+    CLI_IDLE_TIMEOUT,
+    CLI_INTERRUPT_GRACE,
+    CLI_MAX_CONCURRENT_TURNS,
+    CLI_MAX_PROCESSES,
+    CLI_MAX_PROCESSES_PER_CAT,
+    CLI_REAPER_INTERVAL,
+    CLI_TIMEOUT,
+    CLI_UTILITY_CONCURRENCY,
+    CLI_UTILITY_POOL_SIZE,
+    CLI_WARM_POOL_SIZE,
+)
+
+CLAUDE_CLI_PATH = os.getenv("CLAUDE_CLI_PATH", "claude")
+
+# 交互式模式的基础 flags
+# Phase 1 修复：必须保留 -p（headless 模式入口），stream-json 功能才能生效
+INTERACTIVE_FLAGS = [
+    "-p",  # 必须保留！这是 headless 模式入口，stream-json 功能只在此模式下生效
+    "--output-format", "stream-json",
+    "--input-format", "stream-json",
+    "--verbose",  # 必需！stream-json 输出格式需要此标志
+    # "--include-partial-messages",  # 暂时注释，先验证基本流程
+    "--dangerously-skip-permissions",
+]
+
+STDOUT_LIMIT = 10 * 1024 * 1024  # stdout 单行上限 10MB，支持大文件
+
+
+def _get_subprocess_env() -> dict:
+    """获取 subprocess 环境变量，清除 CLAUDECODE 避免嵌套会话检测"""
+    env = os.environ.copy()
+    # 显式设为空字符串，确保子进程不会继承父进程的 CLAUDECODE
+    env["CLAUDECODE"] = ""
+    # 同时清除可能相关的其他变量
+    env.pop("CLAUDE_CODE_SESSION", None)
+    env.pop("ANTHROPIC_API_KEY", None)  # 让子进程用自己的配置
+    # 增加 Node.js 流处理的缓冲区大小
+    env["NODE_OPTIONS"] = "--max-old-space-size=4096"
+    return env
+
+
+async def _read_stderr(process: asyncio.subprocess.Process, label: str):
+    """后台读取 stderr 并打印（调试用），同时避免管道写满卡住子进程"""
+    if process and process.stderr:
+        try:
+            async for line in process.stderr:
+                print(f"[STDERR:{label}] {line.decode('utf-8').strip()}")
+        except Exception as e:
+            print(f"[STDERR:{label}] 读取错误: {e}")
+
+
+async def spawn_cli(cli_session_id: str, label: str,
+                    cwd: Optional[str] = None,
+                    resume: bool = False) -> asyncio.subprocess.Process:
+    """启动一个常驻的交互式 CLI 进程
+
+    Args:
+        cli_session_id: 绑定的 CLI 会话 id，CLI 按它保存上下文
+        label: stderr 日志前缀
+        cwd: 工作目录
+        resume: 该 CLI 会话已经有过对话（进程被回收 / 退出后重新启动），
+            用 --resume 接上原来的上下文；否则用 --session-id 新建
+    """
+    process = await asyncio.create_subprocess_exec(
+        CLAUDE_CLI_PATH,
+        "--resume" if resume else "--session-id", cli_session_id,  # 关键：绑定会话，实现记忆持久化
+        *INTERACTIVE_FLAGS,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        env=_get_subprocess_env(),
+        limit=STDOUT_LIMIT,
+    )
+    asyncio.create_task(_read_stderr(process, label))
+    return process
+
+
+async def terminate_process(process: asyncio.subprocess.Process, timeout: float = 5.0):
+    """先 terminate，超时未退出再 kill（进程守护会把这次退出当作正常退出）"""
+    supervisor.expect_exit(process)
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+        await asyncio.wait_for(process.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+    except ProcessLookupError:
+        pass
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 单轮时限与打断
+# ═══════════════════════════════════════════════════════════════════════
+
+class TurnInterrupted(Exception):
+    """一轮对话被打断：reason 为 cancelled（调用方取消）/ deadline（总时限）/ idle（长时间无输出）"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class TurnControl:
+    """一轮对话的时限和取消信号"""
+
+    def __init__(self, timeout: float = CLI_TIMEOUT, idle_timeout: float = CLI_IDLE_OUTPUT_TIMEOUT):
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self.idle_timeout = idle_timeout
+        self.reason: Optional[str] = None
+        self._cancelled = asyncio.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self, reason: str = "cancelled"):
+        if self.reason is None:
+            self.reason = reason
+        self._cancelled.set()
+
+    def start(self):
+        """重新开始计总时限（排队、启动进程的时间不算在内）"""
+        self.deadline = time.monotonic() + self.timeout
+
+    async def wait_cancelled(self):
+        await self._cancelled.wait()
+
+    async def readline(self, stream: asyncio.StreamReader) -> bytes:
+        """读一行输出；被取消、超过总时限或空闲超时时抛 TurnInterrupted
+
+        没读完的半行留在缓冲区里，不会丢。
+        """
+        if self._cancelled.is_set():
+            raise TurnInterrupted(self.reason)
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise TurnInterrupted("deadline")
+        reader = asyncio.ensure_future(stream.readline())
+        waiter = asyncio.ensure_future(self._cancelled.wait())
+        try:
+            await asyncio.wait({reader, waiter}, timeout=min(self.idle_timeout, remaining),
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            if not reader.done():
+                reader.cancel()
+        if reader.done() and not reader.cancelled():
+            return reader.result()
+        if self._cancelled.is_set():
+            raise TurnInterrupted(self.reason)
+        raise TurnInterrupted("deadline" if remaining <= self.idle_timeout else "idle")
+
+
+async def interrupt_turn(process: asyncio.subprocess.Process, grace: float = CLI_INTERRUPT_GRACE) -> bool:
+    """打断进程里还没结束的一轮：发 interrupt 控制消息，读掉剩余输出直到 result
+
+    返回 True 表示 CLI 已经停下、进程可以继续用；进程已退出或 grace 秒内
+    没收尾返回 False，由调用方终止进程。
+    """
+    if process.returncode is not None:
+        return False
+    request = {
+        "type": "control_request",
+        "request_id": f"interrupt-{uuid.uuid4().hex[:8]}",
+        "request": {"subtype": "interrupt"},
+    }
+
+    async def _drain() -> bool:
+        process.stdin.write((json.dumps(request) + "\n").encode("utf-8"))
+        await process.stdin.drain()
+        async for line in process.stdout:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(data, dict) and data.get("type") == "result":
+                return True
+        return False  # EOF：进程已经退出
+
+    try:
+        return await asyncio.wait_for(_drain(), timeout=grace)
+    except (asyncio.TimeoutError, ConnectionError, OSError):
+        return False
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 预热池
+# ═══════════════════════════════════════════════════════════════════════
+
+@dataclass
+class CliProcess:
+    """一个常驻 CLI 进程和它的 CLI session id"""
+    process: asyncio.subprocess.Process
+    cli_session_id: str
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+
+class WarmPool:
+    """一只猫猫的预热进程池：保持 size 个已启动、未绑定 thread 的空闲进程"""
+
+    def __init__(self, cat_id: str, size: int = CLI_WARM_POOL_SIZE):
+        self.cat_id = cat_id
+        self.size = size
+        self._idle: deque[CliProcess] = deque()
+        self._refill_task: Optional[asyncio.Task] = None
+        self._closed = False
+        # 指标
+        self.hits = 0           # 领到了预热进程
+        self.misses = 0         # 池子空了，调用方只能现场启动
+        self.spawned = 0        # 累计启动的预热进程
+        self.discarded = 0      # 空闲期间就退出了、被丢弃的进程
+        self.spawn_errors = 0
+
+    def start(self):
+        """在后台把空闲进程补齐到 size 个（需要在事件循环里调用，幂等）"""
+        if self.size <= 0 or self._closed:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        while not self._closed and len(self._idle) < self.size:
+            cli_session_id = str(uuid.uuid4())
+            try:
+                process = await spawn_cli(cli_session_id, label=f"{self.cat_id}:warm")
+            except Exception as e:
+                # 找不到 CLI 之类的错误重试也没用，等下一次 acquire 再试
+                self.spawn_errors += 1
+                print(f"[MeowDev] {self.cat_id} 预热进程启动失败: {e}")
+                return
+            self.spawned += 1
+            self._idle.append(CliProcess(process, cli_session_id))
+
+    def acquire(self) -> Optional[CliProcess]:
+        """领走一个空闲进程（不等待），没有时返回 None；领走后后台补齐"""
+        if self.size <= 0:
+            return None
+        proc = None
+        while self._idle:
+            candidate = self._idle.popleft()
+            if candidate.alive:
+                proc = candidate
+                break
+            self.discarded += 1
+        if proc is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.start()
+        return proc
+
+    async def close(self):
+        """停止补齐并终止所有空闲进程"""
+        self._closed = True
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+        while self._idle:
+            await terminate_process(self._idle.popleft().process)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": sum(1 for p in self._idle if p.alive),
+            "hits": self.hits,
+            "misses": self.misses,
+            "spawned": self.spawned,
+            "discarded": self.discarded,
+            "spawn_errors": self.spawn_errors,
+        }
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 会话进程登记表（LRU 上限 + 空闲回收）
+# ═══════════════════════════════════════════════════════════════════════
+
+# 回收回调：(session_id, 原因) -> 是否真的回收了（进程正忙时返回 False）
+EvictFunc = Callable[[str, str], Awaitable[bool]]
+
+
+class ProcessRegistry:
+    """所有猫猫的会话进程，按最近使用时间排序"""
+
+    def __init__(self, max_total: int = CLI_MAX_PROCESSES,
+                 max_per_cat: int = CLI_MAX_PROCESSES_PER_CAT,
+                 idle_timeout: float = CLI_IDLE_TIMEOUT,
+                 interval: float = CLI_REAPER_INTERVAL):
+        self.max_total = max_total
+        self.max_per_cat = max_per_cat
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+        self._entries: OrderedDict[tuple[str, str], float] = OrderedDict()  # (cat_id, session_id) → 最后使用时间
+        self._owners: dict[str, EvictFunc] = {}
+        self._reaper_task: Optional[asyncio.Task] = None
+        # 指标
+        self.evicted_lru = 0
+        self.evicted_idle = 0
+        self.reaper_runs = 0
+        self.last_reap_at: Optional[float] = None
+
+    def register_owner(self, cat_id: str, evict: EvictFunc):
+        self._owners[cat_id] = evict
+
+    def touch(self, cat_id: str, session_id: str):
+        """登记 / 刷新一个会话进程的最后使用时间"""
+        key = (cat_id, session_id)
+        self._entries[key] = time.monotonic()
+        self._entries.move_to_end(key)
+
+    def forget(self, cat_id: str, session_id: str):
+        self._entries.pop((cat_id, session_id), None)
+
+    def count(self, cat_id: Optional[str] = None) -> int:
+        if cat_id is None:
+            return len(self._entries)
+        return sum(1 for cat, _ in self._entries if cat == cat_id)
+
+    async def _evict(self, key: tuple[str, str], reason: str) -> bool:
+        cat_id, session_id = key
+        evict = self._owners.get(cat_id)
+        if evict is None or not await evict(session_id, reason):
+            return False
+        self._entries.pop(key, None)
+        return True
+
+    async def make_room(self, cat_id: str):
+        """为 cat_id 的一个新进程腾位置：超出上限时从最久没用的开始回收
+
+        全是正在处理消息的进程、一个也回收不了时允许暂时超出上限。
+        """
+        for key in list(self._entries):
+            over_cat = self.count(cat_id) >= self.max_per_cat
+            over_total = self.count() >= self.max_total
+            if not over_cat and not over_total:
+                return
+            if over_cat and not over_total and key[0] != cat_id:
+                continue
+            if await self._evict(key, "lru"):
+                self.evicted_lru += 1
+        if self.count(cat_id) >= self.max_per_cat or self.count() >= self.max_total:
+            print(f"[MeowDev] CLI 进程数已达上限（{self.count()}），且都在处理消息，暂时超出")
+
+    async def reap_idle(self) -> int:
+        """回收空闲超过 idle_timeout 的进程，返回回收数"""
+        cutoff = time.monotonic() - self.idle_timeout
+        reaped = 0
+        for key, last_used in list(self._entries.items()):
+            if last_used >= cutoff:
+                break  # 按使用时间排序，后面的都更新
+            if await self._evict(key, "idle"):
+                reaped += 1
+        self.evicted_idle += reaped
+        self.reaper_runs += 1
+        self.last_reap_at = time.time()
+        if reaped:
+            print(f"[MeowDev] 回收了 {reaped} 个空闲 CLI 进程，剩余 {self.count()} 个")
+        return reaped
+
+    async def _reaper_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reap_idle()
+            except Exception as e:
+                print(f"[MeowDev] 回收空闲 CLI 进程出错: {e}")
+
+    def start(self):
+        """启动后台空闲回收任务（需要在事件循环里调用，幂等）"""
+        if self._reaper_task is None or self._reaper_task.done():
+            self._reaper_task = asyncio.create_task(self._reaper_loop())
+
+    def stats(self) -> dict:
+        return {
+            "processes": self.count(),
+            "max_total": self.max_total,
+            "max_per_cat": self.max_per_cat,
+            "idle_timeout": self.idle_timeout,
+            "evicted_lru": self.evicted_lru,
+            "evicted_idle": self.evicted_idle,
+            "reaper_runs": self.reaper_runs,
+            "last_reap_at": self.last_reap_at,
+        }
+
+
+registry = ProcessRegistry()
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 进程守护
+# ═══════════════════════════════════════════════════════════════════════
+
+# 进程意外退出时的回调：(session_id, 进程)
+CrashFunc = Callable[[str, asyncio.subprocess.Process], None]
+
+
+def describe_exit(returncode: int) -> str:
+    """退出码转成退出原因：负数是被信号终止（asyncio 的约定），否则是退出码"""
+    if returncode < 0:
+        try:
+            return signal.Signals(-returncode).name
+        except ValueError:
+            return f"signal {-returncode}"
+    return f"exit {returncode}"
+
+
+class ProcessSupervisor:
+    """盯着所有会话进程的退出：区分主动终止和意外退出，记录退出原因和重启次数"""
+
+    def __init__(self, history: int = 20):
+        self._expected: weakref.WeakSet = weakref.WeakSet()  # terminate_process 终止的进程
+        self._watchers: set[asyncio.Task] = set()
+        # 指标
+        self.crashes = 0
+        self.respawns = 0           # 崩溃后重新启动的进程
+        self.replays = 0            # 崩溃时正在进行、重启后重发的回合
+        self.replay_failures = 0    # 重发之后又崩溃的回合
+        self.exit_reasons: Counter[str] = Counter()
+        self.recent: deque[dict] = deque(maxlen=history)
+
+    def expect_exit(self, process: asyncio.subprocess.Process):
+        self._expected.add(process)
+
+    def watch(self, cat_id: str, session_id: str,
+              process: asyncio.subprocess.Process, on_crash: CrashFunc):
+        """开始盯一个会话进程（需要在事件循环里调用）"""
+        task = asyncio.create_task(self._watch(cat_id, session_id, process, on_crash))
+        self._watchers.add(task)
+        task.add_done_callback(self._watchers.discard)
+
+    async def _watch(self, cat_id: str, session_id: str,
+                     process: asyncio.subprocess.Process, on_crash: CrashFunc):
+        started = time.monotonic()
+        returncode = await process.wait()
+        if process in self._expected:
+            return
+        reason = describe_exit(returncode)
+        uptime = time.monotonic() - started
+        self.crashes += 1
+        self.exit_reasons[reason] += 1
+        self.recent.append({
+            "cat_id": cat_id,
+            "session_id": session_id,
+            "pid": process.pid,
+            "returncode": returncode,
+            "reason": reason,
+            "uptime": round(uptime, 1),
+            "at": time.time(),
+        })
+        hint = "，可能是内存不足被系统杀掉" if returncode in (-signal.SIGKILL, 128 + signal.SIGKILL) else ""
+        print(f"[MeowDev] {cat_id} 的 CLI 进程意外退出 PID={process.pid}"
+              f"（session_id={session_id}，{reason}，运行了 {uptime:.0f} 秒{hint}）")
+        on_crash(session_id, process)
+
+    def stats(self) -> dict:
+        return {
+            "crashes": self.crashes,
+            "respawns": self.respawns,
+            "replays": self.replays,
+            "replay_failures": self.replay_failures,
+            "exit_reasons": dict(self.exit_reasons),
+            "recent": list(self.recent),
+        }
+
+
+supervisor = ProcessSupervisor()
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 回合调度（全局并发上限 + 优先级）
+# ═══════════════════════════════════════════════════════════════════════
+
+class Priority(IntEnum):
+    """回合优先级，数值越小越先执行"""
+    INTERACTIVE = 0   # 用户在聊天里等着的回复
+    TEAM = 1          # /team 协作的各个阶段
+    BACKGROUND = 2    # 需要会话进程的后台任务（不需要的走 utility_lane）
+
+
+# 排队位置回调：(位置) -> None，位置从 1 开始，0 表示排到了、开始执行
+QueueCallback = Callable[[int], Awaitable[None]]
+
+_QUEUE_REPORT_INTERVAL = 1.0  # 排队期间检查位置变化的间隔（秒）
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+
+
+class TurnScheduler:
+    """所有猫猫共用的回合准入控制：最多 limit 个回合同时进行，其余按优先级排队"""
+
+    def __init__(self, limit: int = CLI_MAX_CONCURRENT_TURNS):
+        self.limit = limit
+        self._running = 0
+        self._queue: list[_Waiter] = []  # 按 (priority, seq) 排序的堆
+        self._seq = itertools.count()
+        # 指标
+        self.admitted = {p.name.lower(): 0 for p in Priority}
+        self.queued_total = 0      # 需要排队的回合数
+        self.waits = 0             # 排过队、已经开始执行的回合数
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.cancelled = 0         # 排队时被取消的回合数
+
+    def _waiting(self) -> list[_Waiter]:
+        return [w for w in self._queue if not w.future.done()]
+
+    def _position(self, waiter: _Waiter) -> int:
+        return 1 + sum(1 for w in self._waiting() if w < waiter)
+
+    async def _acquire(self, priority: Priority, on_queued: Optional[QueueCallback],
+                       control: Optional[TurnControl]) -> bool:
+        """拿到一个名额，返回是否排过队；排队时被取消抛 TurnInterrupted"""
+        if control is not None and control.cancelled:
+            raise TurnInterrupted(control.reason)
+        if self._running < self.limit and not self._waiting():
+            self._running += 1
+            self.admitted[priority.name.lower()] += 1
+            return False
+
+        waiter = _Waiter(int(priority), next(self._seq), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, waiter)
+        self.queued_total += 1
+        reported = None
+        cancelled = asyncio.ensure_future(control.wait_cancelled()) if control is not None else None
+        try:
+            while not waiter.future.done():
+                position = self._position(waiter)
+                if on_queued is not None and position != reported:
+                    reported = position
+                    await on_queued(position)
+                await asyncio.wait({waiter.future, cancelled} - {None}, timeout=_QUEUE_REPORT_INTERVAL)
+                if control is not None and control.cancelled:
+                    self.cancelled += 1
+                    raise TurnInterrupted(control.reason)
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()  # 名额已经分到手了，转给下一个
+            else:
+                waiter.future.cancel()
+            raise
+        finally:
+            if cancelled is not None:
+                cancelled.cancel()
+
+        waited = time.monotonic() - waiter.enqueued_at
+        self.waits += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.admitted[priority.name.lower()] += 1
+        return True
+
+    def _release(self):
+        self._running -= 1
+        while self._queue and self._running < self.limit:
+            waiter = heapq.heappop(self._queue)
+            if waiter.future.done():
+                continue  # 排队时被取消了
+            waiter.future.set_result(None)
+            self._running += 1
+
+    @asynccontextmanager
+    async def turn(self, priority: Priority = Priority.INTERACTIVE,
+                   on_queued: Optional[QueueCallback] = None,
+                   control: Optional[TurnControl] = None) -> AsyncIterator[None]:
+        """占用一个回合名额，with 块结束时归还
+
+        Args:
+            priority: 回合优先级
+            on_queued: 需要排队时报告排队位置（位置变化时才调用），排到后报告 0
+            control: 这一轮的取消信号，排队时被取消就出队并抛 TurnInterrupted
+        """
+        queued = await self._acquire(priority, on_queued, control)
+        try:
+            if queued and on_queued is not None:
+                await on_queued(0)
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        waiting = self._waiting()
+        return {
+            "limit": self.limit,
+            "running": self._running,
+            "queued": {p.name.lower(): sum(1 for w in waiting if w.priority == p) for p in Priority},
+            "admitted": dict(self.admitted),
+            "queued_total": self.queued_total,
+            "avg_wait": self.total_wait / self.waits if self.waits else 0.0,
+            "max_wait": self.max_wait,
+            "cancelled": self.cancelled,
+        }
+
+
+turn_scheduler = TurnScheduler()
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 后台任务通道
+# ═══════════════════════════════════════════════════════════════════════
+
+class UtilityLane:
+    """会话摘要等后台任务专用的 CLI 进程通道
+
+    和用户会话的进程完全隔开：不占回合调度的名额，不碰任何 thread 的 CLI 会话。
+    每个任务用一个全新的进程（优先从自己的预热池领），做完就终止，任务之间
+    不共享上下文。
+    """
+
+    def __init__(self, size: int = CLI_UTILITY_POOL_SIZE, concurrency: int = CLI_UTILITY_CONCURRENCY):
+        self.pool = WarmPool("utility", size)
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._running = 0
+        self._waiting = 0
+        # 指标
+        self.jobs = 0
+        self.failures = 0
+        self.timeouts = 0
+
+    def start(self):
+        """启动预热池（需要在事件循环里调用，幂等）"""
+        self.pool.start()
+
+    async def run(self, prompt: str, timeout: float = CLI_TIMEOUT) -> str:
+        """执行一个一次性任务，返回 CLI 的最终文本
+
+        超时抛 TurnInterrupted，CLI 出错时抛原来的异常。
+        """
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._running += 1
+        self.jobs += 1
+        process = None
+        try:
+            warm = self.pool.acquire()
+            if warm is not None:
+                process = warm.process
+            else:
+                process = await spawn_cli(str(uuid.uuid4()), label="utility")
+            return await self._ask(process, prompt, TurnControl(timeout))
+        except TurnInterrupted:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            if process is not None:
+                await terminate_process(process)
+            self._running -= 1
+            self._semaphore.release()
+
+    @staticmethod
+    async def _ask(process: asyncio.subprocess.Process, prompt: str, control: TurnControl) -> str:
+        process.stdin.write((json.dumps({
+            "type": "user",
+            "message": {"role": "user", "content": prompt},
+        }) + "\n").encode("utf-8"))
+        await process.stdin.drain()
+
+        texts = []
+        while line := await control.readline(process.stdout):
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(data, dict):
+                continue
+            if data.get("type") == "assistant":
+                texts.extend(
+                    item.get("text", "")
+                    for item in data.get("message", {}).get("content", [])
+                    if item.get("type") == "text"
+                )
+            elif data.get("type") == "result":
+                result = data.get("result")
+                return result if isinstance(result, str) and result else "".join(texts)
+        raise RuntimeError(f"后台任务 CLI 进程提前退出（returncode={process.returncode}）")
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "waiting": self._waiting,
+            "jobs": self.jobs,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "warm_pool": self.pool.stats(),
+        }
+
+
+utility_lane = UtilityLane()
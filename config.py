@@ -5,6 +5,7 @@ MeowDev 配置文件（简化版）
 - 项目设置
 """
 
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).parent
@@ -59,5 +60,64 @@ CAT_CONFIGS = {
 }
 
 
-CLI_TIMEOUT = 600
+CLI_TIMEOUT = 600              # 单次调用 / 交互式一轮对话的总时限
 MAX_REVIEW_ROUNDS = 3
+
+
+# ── CLI 进程 ────────────────────────────────────────────
+
+CLI_WARM_POOL_SIZE = 1         # 每只猫猫预先启动的空闲 CLI 进程数（0 关闭预热）
+CLI_MAX_PROCESSES = 45         # 所有猫猫的会话进程总数上限，超出时回收最久没用的
+CLI_MAX_PROCESSES_PER_CAT = 20 # 单只猫猫的会话进程上限
+CLI_IDLE_TIMEOUT = 30 * 60     # 会话进程空闲超过这么久就回收（下次发言时 --resume 重启）
+CLI_REAPER_INTERVAL = 60       # 空闲回收任务的检查间隔
+CLI_MAX_CONCURRENT_TURNS = 6   # 全局同时进行的对话回合上限，超出的按优先级排队
+CLI_IDLE_OUTPUT_TIMEOUT = 300  # 一轮对话中 CLI 连续这么久没有任何输出就视为卡住，打断这一轮
+CLI_INTERRUPT_GRACE = 5        # 打断后等 CLI 收尾的时间，超时就终止进程（下次发言 --resume 重启）
+CLI_UTILITY_POOL_SIZE = 1      # 后台任务通道（会话摘要等）预先启动的空闲进程数
+CLI_UTILITY_CONCURRENCY = 2    # 后台任务通道同时运行的任务上限，和对话回合的名额分开
+
+
+# ── 数据库配置 ──────────────────────────────────────────
+
+# 留空使用 BASE_DIR/meowdev.db；设为 postgresql://... 则使用 PostgreSQL（多 worker 部署）
+DATABASE_URL = os.getenv("MEOWDEV_DATABASE_URL", "")
+DB_READ_POOL_SIZE = 4          # 只读连接池上限
+DB_BUSY_TIMEOUT_MS = 5000      # 写锁等待时间
+DB_STATEMENT_CACHE = 256       # 每个连接的预编译语句缓存数
+DB_GROUP_COMMIT_MS = 5         # 合并写入的攒批窗口
+DB_GROUP_COMMIT_MAX_OPS = 500  # 单个事务最多合并的写操作数
+DB_PG_POOL_SIZE = 8            # PostgreSQL 连接池上限（读写共用）
+SHARED_CACHE_TTL = 5           # 多 worker 共用数据库时，进程内缓存最多用这么久（秒）
+EXPORT_BATCH_ROWS = 500        # 导出时每次查询读取的行数
+IMPORT_BATCH_RECORDS = 1000    # 导入时每个事务提交的记录数
+
+
+# ── 后台维护 ────────────────────────────────────────────
+
+MAINTENANCE_TICK_SECONDS = 60          # 维护调度器检查间隔
+PHANTOM_CLEANUP_INTERVAL = 6 * 3600    # 清理空会话的周期
+PHANTOM_SESSION_MIN_AGE = 3600         # 空会话至少闲置这么久才清理
+ARCHIVE_INTERVAL = 24 * 3600           # 冷数据归档的周期
+ARCHIVE_AFTER_DAYS = 30                # 超过这么多天的消息移进压缩归档
+ARCHIVE_BLOCK_MESSAGES = 200           # 每个归档块最多打包的消息数
+WAL_CHECKPOINT_INTERVAL = 15 * 60      # WAL 写回并截断的周期
+DB_OPTIMIZE_INTERVAL = 6 * 3600        # PRAGMA optimize 的周期
+VACUUM_INTERVAL = 24 * 3600            # 增量 VACUUM 的周期
+VACUUM_MAX_PAGES = 2000                # 每次增量 VACUUM 最多回收的页数
+ORPHAN_CLEANUP_INTERVAL = 6 * 3600     # 清理孤儿记录的周期
+MAINTENANCE_MIN_GAP = 60               # 两次维护任务之间至少间隔这么久
+MAINTENANCE_BUSY_WINDOW = 60           # 统计用户流量的时间窗（秒）
+MAINTENANCE_BUSY_MESSAGES = 10         # 时间窗内用户消息超过这个数就推迟维护
+
+
+# ── 猫猫记忆 ────────────────────────────────────────────
+
+MEMORY_CONTEXT_LIMIT = 5        # 每次注入 prompt 的记忆条数上限
+MEMORY_QUERY_MESSAGES = 6       # 用最近几条消息判断记忆是否相关
+MEMORY_DUP_THRESHOLD = 0.65     # 与已有记忆的相似度超过它就视为重复
+MEMORY_DUP_CANDIDATES = 8       # 判断近似重复时只和语义最相近的几条比较
+MEMORY_HALF_LIFE_DAYS = 30      # 记忆新鲜度的半衰期
+MEMORY_SEMANTIC_MIN_SCORE = 0.2 # 语义相似度低于它的记忆不算相关
+PROFILE_CONTEXT_LIMIT = 8       # 用户画像超过这么多条时只带相关的
+SEMANTIC_DIM = 128              # 本地语义索引的向量维度
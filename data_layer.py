@@ -2,11 +2,10 @@
 Chainlit Data Layer 实现
 
 将 Chainlit 的 Thread 概念映射到现有的 sessions 表，
-复用 memory.py 中的数据库结构。
+复用 memory.py 中的数据库结构，连接统一从 storage.py 获取。
 """
 
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import TYPE_CHECKING, Dict, List, Optional
 
@@ -19,20 +18,30 @@ if TYPE_CHECKING:
     from chainlit.user import PersistedUser, User
 
 from memory import (
-    _get_conn,
+    _session_messages,
+    delete_archived_message,
     update_session as db_update_session,
     delete_session as db_delete_session,
+    delete_sessions as db_delete_sessions,
+    archive_sessions as db_archive_sessions,
+    restore_sessions as db_restore_sessions,
 )
+from memory_async import run_read, run_write
+from storage import get_storage
 
+_storage = get_storage()
 
-async def cleanup_cat_processes(thread_id: str):
-    """清理指定 thread 对应的所有猫猫进程"""
+
+async def cleanup_cat_processes(*thread_ids: str):
+    """清理指定 thread（可以是多个）对应的所有猫猫进程"""
     # 延迟导入避免循环依赖
     from cats import ALL_CATS
-    for cat in ALL_CATS:
-        await cat.cleanup(thread_id)
-
-_executor = ThreadPoolExecutor(max_workers=4)
+    # 空 ID 会让 cat.cleanup 清理全部进程，这里过滤掉
+    await asyncio.gather(*(
+        cat.cleanup(thread_id)
+        for thread_id in thread_ids if thread_id
+        for cat in ALL_CATS
+    ))
 
 DEFAULT_USER_ID = "default_user"
 DEFAULT_USER_IDENTIFIER = "MeowDev User"
@@ -52,16 +61,12 @@ class MeowDevDataLayer(BaseDataLayer):
     MeowDev 自定义 Data Layer
 
     将 Chainlit 的 Thread 映射到 sessions 表，
-    将 Step 映射到 chat_history 表。
+    将 Step 映射到 chat_messages 表。
     """
 
     def __init__(self):
         self._loop = None
 
-    def _run_sync(self, func, *args, **kwargs):
-        loop = asyncio.get_event_loop()
-        return loop.run_in_executor(_executor, lambda: func(*args, **kwargs))
-
     # ═══════════════════════════════════════════════════════════════════════
     # 用户管理
     # ═══════════════════════════════════════════════════════════════════════
@@ -83,8 +88,7 @@ class MeowDevDataLayer(BaseDataLayer):
 
     async def get_thread(self, thread_id: str) -> Optional[ThreadDict]:
         def _get():
-            conn = _get_conn()
-            try:
+            with _storage.reader(barrier=True) as conn:
                 session = conn.execute(
                     "SELECT id, name, created_at, updated_at FROM sessions WHERE id = ?",
                     (thread_id,),
@@ -93,11 +97,8 @@ class MeowDevDataLayer(BaseDataLayer):
                 if not session:
                     return None
 
-                rows = conn.execute(
-                    "SELECT id, role, content, timestamp FROM chat_history "
-                    "WHERE session_id = ? ORDER BY timestamp ASC",
-                    (thread_id,),
-                ).fetchall()
+                # 包括已移进冷归档的旧消息
+                rows = _session_messages(conn, thread_id)
 
                 steps = []
                 for row in rows:
@@ -154,10 +155,8 @@ class MeowDevDataLayer(BaseDataLayer):
                     "steps": steps,
                     "elements": [],
                 }
-            finally:
-                conn.close()
 
-        return await self._run_sync(_get)
+        return await run_read(_get)
 
     async def update_thread(
         self,
@@ -171,13 +170,13 @@ class MeowDevDataLayer(BaseDataLayer):
             if name:
                 db_update_session(thread_id, name=name)
 
-        await self._run_sync(_update)
+        await run_write(_update)
 
     async def delete_thread(self, thread_id: str):
         # 先清理对应的猫猫进程
         await cleanup_cat_processes(thread_id)
         # 再删除数据库记录
-        await self._run_sync(db_delete_session, thread_id)
+        await run_write(db_delete_session, thread_id)
         print(f"[MeowDev] 删除 thread {thread_id}，已清理对应进程")
 
     async def list_threads(
@@ -187,8 +186,7 @@ class MeowDevDataLayer(BaseDataLayer):
             limit = pagination.first or 20
             cursor = pagination.cursor
 
-            conn = _get_conn()
-            try:
+            with _storage.reader(barrier=True) as conn:
                 if cursor:
                     try:
                         cursor_ts = float(cursor)
@@ -237,14 +235,32 @@ class MeowDevDataLayer(BaseDataLayer):
                     },
                     data=threads,
                 )
-            finally:
-                conn.close()
 
-        return await self._run_sync(_list)
+        return await run_read(_list)
 
     async def get_thread_author(self, thread_id: str) -> str:
         return DEFAULT_USER_IDENTIFIER
 
+    # ═══════════════════════════════════════════════════════════════════════
+    # Thread 批量操作（Chainlit 不会调用，供管理脚本 / 接口使用）
+    # ═══════════════════════════════════════════════════════════════════════
+    #
+    # 筛选参数同 memory.delete_sessions：older_than_days / without_user_messages / archived。
+    # 数据库在一个事务里改完，再清理所有受影响 thread 的猫猫进程。
+
+    async def delete_threads(self, thread_ids: Optional[List[str]] = None, **filters) -> List[str]:
+        deleted = await run_write(db_delete_sessions, thread_ids, **filters)
+        await cleanup_cat_processes(*deleted)
+        return deleted
+
+    async def archive_threads(self, thread_ids: Optional[List[str]] = None, **filters) -> List[str]:
+        archived = await run_write(db_archive_sessions, thread_ids, **filters)
+        await cleanup_cat_processes(*archived)
+        return archived
+
+    async def restore_threads(self, thread_ids: Optional[List[str]] = None, **filters) -> List[str]:
+        return await run_write(db_restore_sessions, thread_ids, **filters)
+
     # ═══════════════════════════════════════════════════════════════════════
     # Step（消息）管理
     # ═══════════════════════════════════════════════════════════════════════
@@ -257,16 +273,16 @@ class MeowDevDataLayer(BaseDataLayer):
 
     async def delete_step(self, step_id: str):
         def _delete():
-            conn = _get_conn()
             try:
-                conn.execute("DELETE FROM chat_history WHERE id = ?", (int(step_id),))
-                conn.commit()
+                message_id = int(step_id)
             except (ValueError, TypeError):
-                pass
-            finally:
-                conn.close()
+                return
+            with _storage.writer() as conn:
+                deleted = conn.execute("DELETE FROM chat_messages WHERE id = ?", (message_id,)).rowcount
+            if not deleted:
+                delete_archived_message(message_id)
 
-        await self._run_sync(_delete)
+        await run_write(_delete)
 
     # ═══════════════════════════════════════════════════════════════════════
     # Element（文件）管理
@@ -0,0 +1,291 @@
+"""
+SQLite 连接管理
+
+- 一个长期存活的写连接（全局串行，线程安全）
+- 一个有上限的只读连接池（按需创建，用完归还）
+- PRAGMA 只在连接打开时设置一次
+- 每个连接开启预编译语句缓存（cached_statements）
+- 高频小写入走 WriteBehindQueue，几毫秒内的写操作合并成一个事务提交
+
+用法：
+    pool = ConnectionPool(DB_PATH)
+    with pool.reader() as conn:
+        conn.execute("SELECT ...")
+    with pool.writer() as conn:
+        conn.execute("INSERT ...")   # 退出时自动 commit，异常时 rollback
+
+    queue = WriteBehindQueue(pool)
+    queue.submit(lambda conn: conn.execute("INSERT ..."))   # 立即返回 Future
+    queue.flush()                                          # 屏障：等待之前的写入全部提交
+"""
+
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from config import (
+    DB_BUSY_TIMEOUT_MS,
+    DB_GROUP_COMMIT_MAX_OPS,
+    DB_GROUP_COMMIT_MS,
+    DB_READ_POOL_SIZE,
+    DB_STATEMENT_CACHE,
+)
+
+
+class ConnectionPool:
+    """长期写连接 + 有界只读连接池"""
+
+    dialect = "sqlite"
+
+    def __init__(self, db_path: Path, read_pool_size: int = DB_READ_POOL_SIZE):
+        self.db_path = Path(db_path)
+        self.read_pool_size = max(1, read_pool_size)
+
+        self._writer: sqlite3.Connection | None = None
+        # RLock：允许同一线程内嵌套 writer()（例如 init_db 中调用迁移函数）
+        self._write_lock = threading.RLock()
+        self._write_depth = threading.local()
+
+        self._idle_readers: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+
+    def _open(self, readonly: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            str(self.db_path),
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,  # 连接会被池在不同线程间传递，但同一时刻只有一个使用者
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        else:
+            # 新库在切换 WAL 之前设为增量 VACUUM 模式，之后就改不了了；
+            # 旧库要停服后 python -m memory vacuum 切换
+            if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL 是持久化设置，写连接打开时设置一次即可
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # ── 写连接 ────────────────────────────────────────────
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """独占写连接，退出时提交，异常时回滚"""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._open()
+            conn = self._writer
+            depth = getattr(self._write_depth, "value", 0)
+            self._write_depth.value = depth + 1
+            try:
+                yield conn
+            except BaseException:
+                if depth == 0:
+                    conn.rollback()
+                raise
+            else:
+                if depth == 0:
+                    conn.commit()
+            finally:
+                self._write_depth.value = depth
+
+    def holds_writer(self) -> bool:
+        """当前线程是否正持有写连接"""
+        return getattr(self._write_depth, "value", 0) > 0
+
+    # ── 只读连接池 ────────────────────────────────────────
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._idle_readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._reader_lock:
+            if self._reader_count < self.read_pool_size:
+                self._reader_count += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._open(readonly=True)
+            except Exception:
+                with self._reader_lock:
+                    self._reader_count -= 1
+                raise
+
+        # 池已满，等待其他线程归还
+        return self._idle_readers.get()
+
+    def _release_reader(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle_readers.put(conn)
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """从池中借一个只读连接，退出时归还"""
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            self._release_reader(conn)
+
+    # ── 关闭 ──────────────────────────────────────────────
+
+    def close(self):
+        """关闭所有连接（进程退出或测试时用）"""
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._reader_lock:
+            while True:
+                try:
+                    self._idle_readers.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._reader_count = 0
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 合并写入队列（group commit）
+# ═══════════════════════════════════════════════════════════════════════
+
+WriteOp = Callable[[sqlite3.Connection], Any]
+
+
+class WriteBehindQueue:
+    """写后合并队列
+
+    submit() 把写操作放进队列后立即返回；后台线程每隔几毫秒把攒下的操作
+    放进同一个事务执行，一次 fsync 提交整批。每个操作包在独立的 SAVEPOINT
+    里，单个操作失败只回滚它自己，不影响同批次的其他写入。
+
+    返回的 Future 在事务提交后才完成，需要"读自己的写"时调用 flush()。
+    """
+
+    def __init__(self, pool: ConnectionPool,
+                 interval_ms: float = DB_GROUP_COMMIT_MS,
+                 max_batch: int = DB_GROUP_COMMIT_MAX_OPS):
+        self._pool = pool
+        self._interval = interval_ms / 1000
+        self._max_batch = max(1, max_batch)
+
+        self._pending: list[tuple[WriteOp, Future, Optional[Callable[[], None]]]] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._in_flight = False
+
+    def submit(self, op: WriteOp, on_commit: Optional[Callable[[], None]] = None) -> Future:
+        """提交一个写操作（op 接收写连接作为参数），立即返回 Future
+
+        on_commit 在事务提交成功后、Future 完成前调用（用于缓存失效等）。
+        """
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("WriteBehindQueue 已关闭")
+            self._pending.append((op, future, on_commit))
+            self._ensure_thread()
+            self._cond.notify()
+        return future
+
+    def flush(self, timeout: Optional[float] = None):
+        """写屏障：阻塞到此前提交的写操作全部落盘"""
+        if threading.current_thread() is self._thread:
+            return  # 写线程自己调用时，之前的操作本来就在同一批里
+        with self._cond:
+            if not self._pending and not self._in_flight:
+                return
+        self.submit(lambda conn: None).result(timeout)
+
+    def close(self):
+        """提交剩余写操作并停止后台线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    # ── 后台线程 ──────────────────────────────────────────
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="meowdev-db-group-commit", daemon=True,
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending and self._closed:
+                    return
+
+            # 攒批窗口：让同一时刻的其他写入赶上这一班
+            if self._interval > 0:
+                time.sleep(self._interval)
+
+            with self._cond:
+                batch = self._pending[:self._max_batch]
+                del self._pending[:self._max_batch]
+                self._in_flight = True
+            try:
+                self._commit_batch(batch)
+            finally:
+                with self._cond:
+                    self._in_flight = False
+
+    def _commit_batch(self, batch: list[tuple[WriteOp, Future, Optional[Callable[[], None]]]]):
+        results: list[tuple[Future, Any, Optional[BaseException], Optional[Callable[[], None]]]] = []
+        try:
+            with self._pool.writer() as conn:
+                if not conn.in_transaction:
+                    conn.execute("BEGIN")
+                for op, future, on_commit in batch:
+                    conn.execute("SAVEPOINT write_op")
+                    try:
+                        value = op(conn)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write_op")
+                        conn.execute("RELEASE write_op")
+                        results.append((future, None, e, None))
+                    else:
+                        conn.execute("RELEASE write_op")
+                        results.append((future, value, None, on_commit))
+        except Exception as e:
+            # 提交失败：整批都没写进去
+            print(f"[MeowDev] 合并写入提交失败（{len(batch)} 个操作）: {e}", file=sys.stderr)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for future, value, error, on_commit in results:
+            if error is not None:
+                print(f"[MeowDev] 写入操作失败: {error}", file=sys.stderr)
+                future.set_exception(error)
+                continue
+            if on_commit is not None:
+                try:
+                    on_commit()
+                except Exception as e:
+                    print(f"[MeowDev] 提交回调出错: {e}", file=sys.stderr)
+            future.set_result(value)
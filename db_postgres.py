@@ -0,0 +1,202 @@
+"""
+PostgreSQL 连接管理
+
+与 db.ConnectionPool 接口相同（reader() / writer() / holds_writer() / close()），
+memory.py 里的 SQL 不用区分后端：
+- 占位符照旧写 ?，执行前换成 %s（字符串、带引号的标识符、注释里的 ? 不动）
+- 行对象和 sqlite3.Row 一样，按列名或下标取值，dict(row) / tuple(row) 可用
+- 写连接进入时 BEGIN、退出时 COMMIT，同一线程内嵌套 writer() 复用同一个事务
+- 读连接是 autocommit；显式 BEGIN 会开一个只读的可重复读事务（一致快照）
+
+和 SQLite 不同，PostgreSQL 允许多个写事务并发，所以这里没有全局写锁，
+多个 app worker 可以共用同一个库。
+
+依赖 psycopg 3（pip install "psycopg[binary,pool]"），只有配置了
+MEOWDEV_DATABASE_URL 时才会导入。
+"""
+
+import functools
+import re
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Any, Iterator, Optional, Sequence
+
+from config import DB_BUSY_TIMEOUT_MS, DB_PG_POOL_SIZE
+
+try:
+    import psycopg
+    from psycopg.adapt import Loader
+    from psycopg.pq import TransactionStatus
+    from psycopg_pool import ConnectionPool as _PsycopgPool
+except ImportError as e:  # pragma: no cover - 只在选用 PostgreSQL 时才需要
+    raise ImportError(
+        "使用 PostgreSQL 需要安装 psycopg 3：pip install \"psycopg[binary,pool]\""
+    ) from e
+
+
+class Row:
+    """按列名或下标取值的只读行，对应 sqlite3.Row"""
+
+    __slots__ = ("_values", "_index")
+
+    def __init__(self, values: tuple, index: dict[str, int]):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self) -> list[str]:
+        return list(self._index)
+
+    def __repr__(self):
+        return f"Row({dict(zip(self._index, self._values))!r})"
+
+
+def _row_factory(cursor):
+    index = {col.name: i for i, col in enumerate(cursor.description or ())}
+    return lambda values: Row(values, index)
+
+
+class _NumericLoader(Loader):
+    """SUM(bigint) 之类的 numeric 结果转回 int / float（与 SQLite 一致，也能直接 json.dumps）"""
+
+    def load(self, data):
+        value = Decimal(bytes(data).decode())
+        return int(value) if value == value.to_integral_value() else float(value)
+
+
+# 字符串 / 带引号的标识符 / 注释 / $$ 字符串整体算一个记号，其余只关心 ? 和 %
+_SQL_TOKEN = re.compile(
+    r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?\*/|\$(\w*)\$.*?\$\1\$|[?%]""",
+    re.S,
+)
+
+
+@functools.lru_cache(maxsize=1024)
+def _translate(sql: str) -> str:
+    """SQLite 风格的 ? 占位符换成 psycopg 的 %s
+
+    只替换引号和注释之外的 ?。带参数执行时 psycopg 会解析整条语句里的 %，
+    所以所有字面量 %（包括字符串、LIKE 模式里的）都转义成 %%。
+    """
+    def _sub(m: re.Match) -> str:
+        token = m.group(0)
+        return "%s" if token == "?" else token.replace("%", "%%")
+
+    return _SQL_TOKEN.sub(_sub, sql)
+
+
+class PostgresConnection:
+    """包一层 psycopg 连接，提供 memory.py 用到的 sqlite3.Connection 子集"""
+
+    def __init__(self, raw: "psycopg.Connection", readonly: bool = False):
+        self._raw = raw
+        self._readonly = readonly
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._raw.info.transaction_status != TransactionStatus.IDLE
+
+    def execute(self, sql: str, params: Optional[Sequence[Any]] = None):
+        if sql.strip().upper() == "BEGIN":
+            if self.in_transaction:
+                return self._raw.cursor()  # 写连接进入时已经 BEGIN 过
+            if self._readonly:
+                sql = "BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY"
+        if params is None:
+            return self._raw.execute(sql)
+        return self._raw.execute(_translate(sql), tuple(params))
+
+    def executemany(self, sql: str, seq_of_params):
+        cursor = self._raw.cursor()
+        cursor.executemany(_translate(sql), [tuple(p) for p in seq_of_params])
+        return cursor
+
+    def commit(self):
+        if self.in_transaction:
+            self._raw.execute("COMMIT")
+
+    def rollback(self):
+        if self.in_transaction:
+            self._raw.execute("ROLLBACK")
+
+
+class PostgresPool:
+    """有界连接池；读写共用，写连接按线程嵌套复用"""
+
+    dialect = "postgres"
+
+    def __init__(self, dsn: str, pool_size: int = DB_PG_POOL_SIZE):
+        self.dsn = dsn
+        self._pool = _PsycopgPool(
+            dsn,
+            min_size=1,
+            max_size=max(2, pool_size),
+            kwargs={
+                "autocommit": True,
+                "row_factory": _row_factory,
+                "options": f"-c lock_timeout={DB_BUSY_TIMEOUT_MS}",
+            },
+            configure=self._configure,
+            open=True,
+        )
+        self._local = threading.local()
+
+    @staticmethod
+    def _configure(conn: "psycopg.Connection"):
+        conn.adapters.register_loader("numeric", _NumericLoader)
+
+    # ── 写连接 ────────────────────────────────────────────
+
+    @contextmanager
+    def writer(self) -> Iterator[PostgresConnection]:
+        """写事务，退出时提交，异常时回滚；同一线程内嵌套调用复用外层事务"""
+        outer = getattr(self._local, "writer", None)
+        if outer is not None:
+            yield outer
+            return
+
+        with self._pool.connection() as raw:
+            conn = PostgresConnection(raw)
+            conn.execute("BEGIN")
+            self._local.writer = conn
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            finally:
+                self._local.writer = None
+
+    def holds_writer(self) -> bool:
+        """当前线程是否正持有写连接"""
+        return getattr(self._local, "writer", None) is not None
+
+    # ── 读连接 ────────────────────────────────────────────
+
+    @contextmanager
+    def reader(self) -> Iterator[PostgresConnection]:
+        """借一个读连接，退出时归还（未结束的事务会回滚）"""
+        with self._pool.connection() as raw:
+            conn = PostgresConnection(raw, readonly=True)
+            try:
+                yield conn
+            finally:
+                conn.rollback()
+
+    # ── 关闭 ──────────────────────────────────────────────
+
+    def close(self):
+        self._pool.close()
@@ -0,0 +1,171 @@
+"""
+后台维护任务调度
+
+不适合放在请求路径上的数据库整理工作（清理空会话、归档旧消息、WAL 写回、
+统计信息更新、增量 VACUUM、孤儿记录清理）统一放到这里，由一个后台线程按周期
+执行，不阻塞 Chainlit 的事件循环，也不拖慢新标签页。
+
+- 两个任务之间至少间隔 MAINTENANCE_MIN_GAP，不会一口气把所有到期任务跑完
+- 用户正在密集聊天时（record_activity 统计）推迟执行，等流量下来再跑
+- 每次执行都打印耗时
+
+用法：
+    import maintenance
+    maintenance.start()             # 幂等，重复调用无副作用
+    maintenance.record_activity()   # 每条用户消息调用一次
+"""
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import memory
+from config import (
+    ARCHIVE_INTERVAL,
+    DB_OPTIMIZE_INTERVAL,
+    MAINTENANCE_BUSY_MESSAGES,
+    MAINTENANCE_BUSY_WINDOW,
+    MAINTENANCE_MIN_GAP,
+    MAINTENANCE_TICK_SECONDS,
+    ORPHAN_CLEANUP_INTERVAL,
+    PHANTOM_CLEANUP_INTERVAL,
+    VACUUM_INTERVAL,
+    WAL_CHECKPOINT_INTERVAL,
+)
+
+
+@dataclass
+class MaintenanceJob:
+    """一个周期性维护任务"""
+    name: str
+    interval: float
+    func: Callable[[], object]
+    next_run: float = 0.0
+    last_error: Optional[str] = None
+    last_duration: Optional[float] = None
+
+
+class ActivityMeter:
+    """滑动时间窗内的事件计数（判断用户流量高不高）"""
+
+    def __init__(self, window: float = MAINTENANCE_BUSY_WINDOW):
+        self._window = window
+        self._events: deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float):
+        while self._events and self._events[0] <= now - self._window:
+            self._events.popleft()
+
+    def hit(self):
+        now = time.monotonic()
+        with self._lock:
+            self._events.append(now)
+            self._trim(now)
+
+    def count(self) -> int:
+        with self._lock:
+            self._trim(time.monotonic())
+            return len(self._events)
+
+
+class MaintenanceScheduler:
+    """单线程周期任务调度器：任务串行执行，某个任务出错不影响其他任务"""
+
+    def __init__(self, tick: float = MAINTENANCE_TICK_SECONDS,
+                 min_gap: float = MAINTENANCE_MIN_GAP,
+                 busy_threshold: int = MAINTENANCE_BUSY_MESSAGES):
+        self._tick = tick
+        self._min_gap = min_gap
+        self._busy_threshold = busy_threshold
+        self.activity = ActivityMeter()
+        self._last_run_end = 0.0
+        self._jobs: list[MaintenanceJob] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, name: str, interval: float, func: Callable[[], object],
+                 initial_delay: Optional[float] = None):
+        """注册任务；initial_delay 默认为一个调度周期，避免和启动流程抢写锁"""
+        delay = self._tick if initial_delay is None else initial_delay
+        with self._lock:
+            self._jobs.append(MaintenanceJob(name, interval, func, time.time() + delay))
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="meowdev-maintenance", daemon=True,
+            )
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run_now(self, name: str):
+        """立即执行指定任务（调试 / 手动触发用）"""
+        for job in self._due_jobs(force=name):
+            self._run_job(job)
+
+    def _due_jobs(self, force: Optional[str] = None) -> list[MaintenanceJob]:
+        now = time.time()
+        with self._lock:
+            if force is not None:
+                return [j for j in self._jobs if j.name == force]
+            return [j for j in self._jobs if j.next_run <= now]
+
+    def is_busy(self) -> bool:
+        """用户流量是否高到应该推迟维护"""
+        return self.activity.count() > self._busy_threshold
+
+    def _run_job(self, job: MaintenanceJob):
+        start = time.perf_counter()
+        try:
+            result = job.func()
+            job.last_error = None
+            job.last_duration = time.perf_counter() - start
+            detail = f"，结果 {result}" if result not in (None, 0) else ""
+            print(f"[MeowDev] 维护任务 {job.name} 完成，用时 {job.last_duration * 1000:.0f} ms{detail}")
+        except Exception as e:
+            job.last_error = str(e)
+            job.last_duration = time.perf_counter() - start
+            print(f"[MeowDev] 维护任务 {job.name} 失败（用时 {job.last_duration * 1000:.0f} ms）: {e}")
+        finally:
+            job.next_run = time.time() + job.interval
+            self._last_run_end = time.monotonic()
+
+    def _run(self):
+        while not self._stop.is_set():
+            # 每个周期最多跑一个任务，且离上一个任务结束至少 min_gap；
+            # 流量高时整体推迟（到期的任务留到下个周期再看）
+            if time.monotonic() - self._last_run_end >= self._min_gap and not self.is_busy():
+                due = sorted(self._due_jobs(), key=lambda j: j.next_run)
+                if due and not self._stop.is_set():
+                    self._run_job(due[0])
+            self._stop.wait(self._tick)
+
+
+scheduler = MaintenanceScheduler()
+scheduler.register("phantom_sessions", PHANTOM_CLEANUP_INTERVAL, memory.cleanup_phantom_sessions)
+scheduler.register("archive_messages", ARCHIVE_INTERVAL, memory.archive_old_messages)
+scheduler.register("orphan_cleanup", ORPHAN_CLEANUP_INTERVAL, memory.cleanup_orphans)
+scheduler.register("wal_checkpoint", WAL_CHECKPOINT_INTERVAL, memory.checkpoint_wal)
+scheduler.register("optimize", DB_OPTIMIZE_INTERVAL, memory.optimize_db)
+scheduler.register("incremental_vacuum", VACUUM_INTERVAL, memory.incremental_vacuum)
+
+
+def start():
+    """启动后台维护线程（幂等）"""
+    scheduler.start()
+
+
+def record_activity():
+    """记一次用户活动（流量高时维护任务会推迟）"""
+    scheduler.activity.hit()
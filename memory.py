@@ -1,8 +1,8 @@
 """
-记忆系统 —— SQLite 实现
+记忆系统 —— SQLite / PostgreSQL 实现（见 storage.py）
 
 包含：
-- 对话历史（chat_history）
+- 对话历史（chat_messages，chat_history 视图方便直接查看）
 - 猫猫个性化记忆（cat_memories）
 - 用户画像（user_profile）
 
@@ -16,30 +16,129 @@
    import sqlite3
    conn = sqlite3.connect('meowdev.db')
    for row in conn.execute("SELECT * FROM cat_memories"): print(row)
+
+3. 导出 / 导入（JSONL，换环境或离线分析用）：
+   python -m memory export -o backup.jsonl.gz
+   python -m memory import backup.jsonl.gz
 """
 
+import argparse
+import base64
+import gzip
+import hashlib
+import heapq
+import json
+import math
+import re
 import sqlite3
+import sys
+import threading
 import time
+import unicodedata
 import uuid
+import zlib
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Optional
-
-from config import BASE_DIR
+from typing import Any, Callable, ContextManager, Iterable, Iterator, Optional, TextIO
+
+from config import (
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_BLOCK_MESSAGES,
+    EXPORT_BATCH_ROWS,
+    IMPORT_BATCH_RECORDS,
+    MEMORY_CONTEXT_LIMIT,
+    MEMORY_DUP_CANDIDATES,
+    MEMORY_DUP_THRESHOLD,
+    MEMORY_HALF_LIFE_DAYS,
+    MEMORY_QUERY_MESSAGES,
+    MEMORY_SEMANTIC_MIN_SCORE,
+    PHANTOM_SESSION_MIN_AGE,
+    PROFILE_CONTEXT_LIMIT,
+    SHARED_CACHE_TTL,
+    VACUUM_MAX_PAGES,
+)
+from semantic_index import SemanticIndex
+from storage import get_storage
 
-DB_PATH = BASE_DIR / "meowdev.db"
 MAX_RECENT_MESSAGES = 30
 
+def _log(message: str):
+    """日志写到标准错误：python -m memory export 的标准输出就是导出内容，
+    导入本模块时的迁移 / 回填日志不能混进去"""
+    print(message, file=sys.stderr)
 
-def _get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(str(DB_PATH))
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    return conn
 
+# 进程内共享的存储后端：连接池 + 高频小写入（消息、发言时间戳、使用统计）的合并写入队列
+_storage = get_storage()
 
-def init_db():
-    conn = _get_conn()
+# 猫猫记忆 / 用户画像的本地语义索引（memmap 文件放在数据库旁边）。
+# 多个 worker 共用数据库时各自在内存里建索引，定期和数据库对齐。
+# 文件名跟着实际打开的数据库走（meowdev.db → meowdev.cat_memories），MEOWDEV_DATABASE_URL
+# 指向别的 SQLite 文件时不会和默认库的索引混用。
+_memory_index = SemanticIndex(None if _storage.shared else _storage.pool.db_path.with_suffix(".cat_memories"))
+_profile_index = SemanticIndex(None if _storage.shared else _storage.pool.db_path.with_suffix(".user_profile"))
+_PROFILE_GROUP = "profile"
+
+
+def _read_conn(barrier: bool = False) -> ContextManager[sqlite3.Connection]:
+    """借一个只读连接（with 语句结束自动归还）
+
+    Args:
+        barrier: 先等待写队列落盘，保证能读到本进程之前提交的写入
+    """
+    return _storage.reader(barrier)
+
+
+def _write_conn() -> ContextManager[sqlite3.Connection]:
+    """获取写连接（with 语句结束自动提交，异常回滚）
+
+    直接写之前先清空写队列，保证与排队中的写入保持提交顺序。
+    """
+    return _storage.writer()
+
+
+def flush_writes():
+    """写屏障：等待所有排队中的写入提交"""
+    _storage.flush()
+
+
+def is_shared_storage() -> bool:
+    """是否和其他进程共用数据库（此时进程内缓存需要按时间过期）"""
+    return _storage.shared
 
+
+@contextmanager
+def _exclusive_job(name: str) -> Iterator[bool]:
+    """多个 worker 共用 PostgreSQL 时，同一个维护任务同一时间只让一个 worker 执行
+
+    用会话级 pg_try_advisory_lock：拿不到锁（别的 worker 正在跑）时返回 False，
+    调用方跳过这一轮，不排队等待。锁挂在单独借出的连接上，任务自己的读写照常
+    走连接池。SQLite 的写事务本身就是串行的，直接放行。
+    """
+    if _storage.dialect != "postgres":
+        yield True
+        return
+    key = f"meowdev_job:{name}"
+    with _read_conn() as conn:
+        acquired = conn.execute("SELECT pg_try_advisory_lock(hashtext(?))", (key,)).fetchone()[0]
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute("SELECT pg_advisory_unlock(hashtext(?))", (key,))
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 数据库结构迁移
+# ═══════════════════════════════════════════════════════════════════════
+#
+# 结构版本记在 PRAGMA user_version 里，每个迁移只执行一次。
+# 新增表 / 索引时在 _MIGRATIONS 末尾追加一个函数，不要修改已发布的迁移。
+
+def _migration_1_base_schema(conn: sqlite3.Connection):
+    """初始结构：对话、记忆、画像、统计、会话、增量读取、摘要"""
     # 对话历史表
     conn.execute("""
         CREATE TABLE IF NOT EXISTS chat_history (
@@ -149,23 +248,476 @@ def init_db():
     # 迁移旧的 "meowdev" 数据到新系统
     _migrate_legacy_session(conn)
 
-    # 清理幽灵 session：没有用户消息的 session（由 on_chat_start 误创建的）
-    phantom_ids = [r["id"] for r in conn.execute("""
-        SELECT s.id FROM sessions s
-        WHERE s.message_count <= 1
-        AND s.id NOT IN (
-            SELECT DISTINCT session_id FROM chat_history
-            WHERE role IN ('用户', 'user')
+
+def _migration_2_usage_rollups(conn: sqlite3.Connection):
+    """使用统计汇总表（按小时 / 按天）
+
+    add_cat_usage 在同一事务内增量更新，统计查询直接读汇总表。
+    """
+    for table, slot in (("cat_usage_hourly", "hour_slot"), ("cat_usage_daily", "date_slot")):
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {slot}                  TEXT NOT NULL,
+                cat_id                  TEXT NOT NULL,
+                input_tokens            INTEGER DEFAULT 0,
+                output_tokens           INTEGER DEFAULT 0,
+                cache_read_tokens       INTEGER DEFAULT 0,
+                cache_creation_tokens   INTEGER DEFAULT 0,
+                cost_usd                REAL DEFAULT 0,
+                call_count              INTEGER DEFAULT 0,
+                PRIMARY KEY ({slot}, cat_id)
+            ) WITHOUT ROWID
+        """)
+
+    # 汇总表为空时从原始记录回填
+    _backfill_usage_rollups(conn)
+
+
+def _migration_3_chat_fts(conn: sqlite3.Connection):
+    """对话全文索引（FTS5）
+
+    中文没有空格分词，写入前由 _fts_segment 把每个汉字切成独立的词，
+    再交给 unicode61 分词器；查询时按短语匹配，相邻汉字必须连续出现。
+    插入走 add_message 的写路径，删除由触发器同步。
+    """
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts
+        USING fts5(body, tokenize='unicode61 remove_diacritics 2')
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS chat_history_fts_delete
+        AFTER DELETE ON chat_history BEGIN
+            DELETE FROM chat_fts WHERE rowid = old.id;
+        END
+    """)
+
+    # 回填已有消息（按 id 分批，避免一次性读入全部历史）
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, content FROM chat_history WHERE id > ? ORDER BY id LIMIT 1000",
+            (last_id,),
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            "INSERT OR REPLACE INTO chat_fts (rowid, body) VALUES (?, ?)",
+            [(r["id"], _fts_segment(r["content"])) for r in rows],
+        )
+        last_id = rows[-1]["id"]
+
+
+def _migration_4_chat_archive(conn: sqlite3.Connection):
+    """冷数据归档表
+
+    旧消息按会话打包成块（每块最多 ARCHIVE_BLOCK_MESSAGES 条），zlib 压缩后
+    存成一行，chat_history 只保留热数据。
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_archive (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id    TEXT NOT NULL,
+            first_id      INTEGER NOT NULL,
+            last_id       INTEGER NOT NULL,
+            first_ts      REAL NOT NULL,
+            last_ts       REAL NOT NULL,
+            message_count INTEGER NOT NULL,
+            data          BLOB NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_archive_session
+        ON chat_archive(session_id, last_ts)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_archive_ids
+        ON chat_archive(first_id, last_id)
+    """)
+
+
+def _migration_5_compact_messages(conn: sqlite3.Connection):
+    """紧凑消息表：会话 ID、角色名字典化为整数键
+
+    chat_history 每行都重复存一遍完整的 session_id（UUID）和角色名，
+    (session_id, timestamp) 索引里又存一遍。新表 chat_messages 只存整数键，
+    字符串放在 session_keys / roles 里各存一份。消息 id 原样保留，
+    全文索引和归档块里的 id 不受影响。
+
+    原来的 chat_history 换成同名视图，命令行查询照旧可用。
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS session_keys (
+            key         INTEGER PRIMARY KEY,
+            session_id  TEXT NOT NULL UNIQUE
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS roles (
+            id          INTEGER PRIMARY KEY,
+            name        TEXT NOT NULL UNIQUE
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_key INTEGER NOT NULL,
+            role_id     INTEGER NOT NULL,
+            content     TEXT NOT NULL,
+            timestamp   REAL NOT NULL
         )
-    """).fetchall()]
-    if phantom_ids:
-        ph = ",".join("?" * len(phantom_ids))
-        conn.execute(f"DELETE FROM chat_history WHERE session_id IN ({ph})", phantom_ids)
-        conn.execute(f"DELETE FROM sessions WHERE id IN ({ph})", phantom_ids)
-        conn.commit()
-        print(f"[MeowDev] 清理了 {len(phantom_ids)} 个空会话")
+    """)
+
+    # 整表搬迁：先建字典，再按 id 顺序批量插入
+    conn.execute("""
+        INSERT OR IGNORE INTO session_keys (session_id)
+        SELECT DISTINCT COALESCE(session_id, 'default') FROM chat_history
+    """)
+    conn.execute("INSERT OR IGNORE INTO roles (name) SELECT DISTINCT role FROM chat_history")
+    moved = conn.execute("""
+        INSERT INTO chat_messages (id, session_key, role_id, content, timestamp)
+        SELECT h.id, k.key, r.id, h.content, h.timestamp
+        FROM chat_history h
+        JOIN session_keys k ON k.session_id = COALESCE(h.session_id, 'default')
+        JOIN roles r ON r.name = h.role
+        ORDER BY h.id
+    """).rowcount
+    # 沿用旧表的自增序列：已删除 / 已归档消息的 id 不能被新消息复用
+    old_seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'chat_history'").fetchone()
+    if old_seq:
+        updated = conn.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'chat_messages'", (old_seq[0],),
+        ).rowcount
+        if not updated:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('chat_messages', ?)", (old_seq[0],))
+
+    conn.execute("DROP TRIGGER IF EXISTS chat_history_fts_delete")
+    conn.execute("DROP TABLE chat_history")
+
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_session
+        ON chat_messages(session_key, timestamp)
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete
+        AFTER DELETE ON chat_messages BEGIN
+            DELETE FROM chat_fts WHERE rowid = old.id;
+        END
+    """)
+    conn.execute("""
+        CREATE VIEW IF NOT EXISTS chat_history AS
+        SELECT m.id, r.name AS role, m.content, m.timestamp, k.session_id
+        FROM chat_messages m
+        JOIN roles r ON r.id = m.role_id
+        JOIN session_keys k ON k.key = m.session_key
+    """)
+    if moved:
+        _log(f"[MeowDev] 已迁移 {moved} 条消息到紧凑消息表")
+
+
+def _migration_6_memory_dedup(conn: sqlite3.Connection):
+    """猫猫记忆去重：规范化文本哈希 + 命中次数"""
+    conn.execute("ALTER TABLE cat_memories ADD COLUMN memory_hash TEXT")
+    conn.execute("ALTER TABLE cat_memories ADD COLUMN hit_count INTEGER DEFAULT 1")
+
+    # 合并已有的重复记忆：保留最新的一条，重要性取最大，次数累加
+    keep: dict[tuple[str, str], dict] = {}
+    duplicates: list[int] = []
+    for r in conn.execute(
+        "SELECT id, cat_id, memory, importance FROM cat_memories ORDER BY timestamp DESC, id DESC"
+    ).fetchall():
+        key = (r["cat_id"], _memory_hash(r["memory"]))
+        kept = keep.get(key)
+        if kept is None:
+            keep[key] = {"id": r["id"], "hash": key[1], "importance": r["importance"], "hits": 1}
+        else:
+            kept["importance"] = max(kept["importance"], r["importance"])
+            kept["hits"] += 1
+            duplicates.append(r["id"])
+
+    for i in range(0, len(duplicates), 500):
+        chunk = duplicates[i:i + 500]
+        conn.execute(f"DELETE FROM cat_memories WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+    conn.executemany(
+        "UPDATE cat_memories SET memory_hash = ?, importance = ?, hit_count = ? WHERE id = ?",
+        [(k["hash"], k["importance"], k["hits"], k["id"]) for k in keep.values()],
+    )
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_cat_memories_hash
+        ON cat_memories(cat_id, memory_hash)
+    """)
+    if duplicates:
+        _log(f"[MeowDev] 合并了 {len(duplicates)} 条重复记忆")
+
+
+def _migration_7_spoke_message_id(conn: sqlite3.Connection):
+    """增量读取改用消息 id 高水位（按 (会话, 消息 id) 索引范围扫描）
+
+    发言时间戳是浮点墙钟时间，同一时刻的两条消息、或者系统时钟回拨时，
+    "timestamp > ?" 会漏读或重读。消息 id 单调递增，没有这个问题。
+    旧记录按"发言时间之前的最后一条消息"回填。
+    """
+    conn.execute("ALTER TABLE cat_last_spoke ADD COLUMN last_message_id INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""
+        UPDATE cat_last_spoke SET last_message_id = MAX(
+            COALESCE((
+                SELECT MAX(m.id) FROM chat_messages m
+                JOIN session_keys k ON k.key = m.session_key
+                WHERE k.session_id = cat_last_spoke.session_id
+                  AND m.timestamp <= cat_last_spoke.last_spoke_at
+            ), 0),
+            COALESCE((
+                SELECT MAX(a.last_id) FROM chat_archive a
+                WHERE a.session_id = cat_last_spoke.session_id
+                  AND a.last_ts <= cat_last_spoke.last_spoke_at
+            ), 0)
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_session_id
+        ON chat_messages(session_key, id)
+    """)
+
+
+def _migration_8_cli_sessions(conn: sqlite3.Connection):
+    """猫猫在各 thread 里用的 CLI 会话 id（重启后 --resume 接上原来的上下文）
+
+    预热进程用的是随机 id，只记在内存里的话重启后就找不回来了。
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cli_sessions (
+            cat_id          TEXT NOT NULL,
+            session_id      TEXT NOT NULL,
+            cli_session_id  TEXT NOT NULL,
+            updated_at      REAL NOT NULL,
+            PRIMARY KEY (cat_id, session_id)
+        )
+    """)
+
+
+_MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_usage_rollups,
+    _migration_3_chat_fts,
+    _migration_4_chat_archive,
+    _migration_5_compact_messages,
+    _migration_6_memory_dedup,
+    _migration_7_spoke_message_id,
+    _migration_8_cli_sessions,
+]
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+# PostgreSQL 没有历史包袱，直接建出与最新 SQLite 迁移等价的结构。
+# 在 _MIGRATIONS 里新增表 / 列时，这里也要同步加上（语句需可重复执行）。
+# 全文索引用 tsvector + GIN 代替 FTS5，user_profile 的 rowid 是显式的自增列。
+_POSTGRES_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS session_keys (
+        key         BIGSERIAL PRIMARY KEY,
+        session_id  TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS roles (
+        id          BIGSERIAL PRIMARY KEY,
+        name        TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chat_messages (
+        id          BIGSERIAL PRIMARY KEY,
+        session_key BIGINT NOT NULL,
+        role_id     BIGINT NOT NULL,
+        content     TEXT NOT NULL,
+        timestamp   DOUBLE PRECISION NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_messages_session ON chat_messages(session_key, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_session_id ON chat_messages(session_key, id)",
+    """
+    CREATE TABLE IF NOT EXISTS chat_fts (
+        rowid       BIGINT PRIMARY KEY,
+        body        TEXT NOT NULL,
+        tsv         TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_chat_fts_tsv ON chat_fts USING GIN (tsv)",
+    """
+    CREATE OR REPLACE FUNCTION chat_messages_fts_delete() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM chat_fts WHERE rowid = OLD.id;
+        RETURN OLD;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS chat_messages_fts_delete ON chat_messages",
+    """
+    CREATE TRIGGER chat_messages_fts_delete AFTER DELETE ON chat_messages
+    FOR EACH ROW EXECUTE FUNCTION chat_messages_fts_delete()
+    """,
+    """
+    CREATE OR REPLACE VIEW chat_history AS
+    SELECT m.id, r.name AS role, m.content, m.timestamp, k.session_id
+    FROM chat_messages m
+    JOIN roles r ON r.id = m.role_id
+    JOIN session_keys k ON k.key = m.session_key
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chat_archive (
+        id            BIGSERIAL PRIMARY KEY,
+        session_id    TEXT NOT NULL,
+        first_id      BIGINT NOT NULL,
+        last_id       BIGINT NOT NULL,
+        first_ts      DOUBLE PRECISION NOT NULL,
+        last_ts       DOUBLE PRECISION NOT NULL,
+        message_count INTEGER NOT NULL,
+        data          BYTEA NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_chat_archive_session ON chat_archive(session_id, last_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_archive_ids ON chat_archive(first_id, last_id)",
+    """
+    CREATE TABLE IF NOT EXISTS cat_memories (
+        id          BIGSERIAL PRIMARY KEY,
+        cat_id      TEXT NOT NULL,
+        memory      TEXT NOT NULL,
+        importance  INTEGER DEFAULT 1,
+        timestamp   DOUBLE PRECISION NOT NULL,
+        memory_hash TEXT,
+        hit_count   INTEGER DEFAULT 1
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_cat_memories_cat ON cat_memories(cat_id, importance DESC)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_cat_memories_hash ON cat_memories(cat_id, memory_hash)",
+    """
+    CREATE TABLE IF NOT EXISTS user_profile (
+        rowid       BIGSERIAL UNIQUE,
+        key         TEXT PRIMARY KEY,
+        value       TEXT NOT NULL,
+        updated_at  DOUBLE PRECISION NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS cat_usage (
+        id                      BIGSERIAL PRIMARY KEY,
+        cat_id                  TEXT NOT NULL,
+        input_tokens            BIGINT DEFAULT 0,
+        output_tokens           BIGINT DEFAULT 0,
+        cache_read_tokens       BIGINT DEFAULT 0,
+        cache_creation_tokens   BIGINT DEFAULT 0,
+        cost_usd                DOUBLE PRECISION DEFAULT 0,
+        hour_slot               TEXT,
+        date_slot               TEXT,
+        timestamp               DOUBLE PRECISION NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_cat_usage_cat ON cat_usage(cat_id, timestamp)",
+    *(
+        f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            {slot}                  TEXT NOT NULL,
+            cat_id                  TEXT NOT NULL,
+            input_tokens            BIGINT DEFAULT 0,
+            output_tokens           BIGINT DEFAULT 0,
+            cache_read_tokens       BIGINT DEFAULT 0,
+            cache_creation_tokens   BIGINT DEFAULT 0,
+            cost_usd                DOUBLE PRECISION DEFAULT 0,
+            call_count              BIGINT DEFAULT 0,
+            PRIMARY KEY ({slot}, cat_id)
+        )
+        """
+        for table, slot in (("cat_usage_hourly", "hour_slot"), ("cat_usage_daily", "date_slot"))
+    ),
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        id            TEXT PRIMARY KEY,
+        name          TEXT NOT NULL,
+        created_at    DOUBLE PRECISION NOT NULL,
+        updated_at    DOUBLE PRECISION NOT NULL,
+        message_count INTEGER DEFAULT 0,
+        is_archived   INTEGER DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at DESC)",
+    """
+    CREATE TABLE IF NOT EXISTS cat_last_spoke (
+        cat_id          TEXT NOT NULL,
+        session_id      TEXT NOT NULL,
+        last_spoke_at   DOUBLE PRECISION NOT NULL,
+        last_message_id BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (cat_id, session_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS session_summaries (
+        session_id    TEXT PRIMARY KEY,
+        summary       TEXT NOT NULL,
+        key_goals     TEXT,
+        key_decisions TEXT,
+        updated_at    DOUBLE PRECISION NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS cli_sessions (
+        cat_id          TEXT NOT NULL,
+        session_id      TEXT NOT NULL,
+        cli_session_id  TEXT NOT NULL,
+        updated_at      DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (cat_id, session_id)
+    )
+    """,
+)
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _init_postgres_schema():
+    """PostgreSQL：建表（幂等），版本号记在 meowdev_schema 表里
 
-    conn.close()
+    用事务级 advisory lock 串行化，多个 worker 同时启动也只有一个在建表。
+    """
+    with _write_conn() as conn:
+        conn.execute("SELECT pg_advisory_xact_lock(hashtext('meowdev_schema'))")
+        conn.execute("CREATE TABLE IF NOT EXISTS meowdev_schema (version INTEGER NOT NULL)")
+        row = conn.execute("SELECT version FROM meowdev_schema").fetchone()
+        current = row[0] if row else 0
+        if current > SCHEMA_VERSION:
+            _log(f"[MeowDev] 数据库结构版本 {current} 比代码新（{SCHEMA_VERSION}），跳过建表")
+            return
+        if current == SCHEMA_VERSION:
+            return
+        for statement in _POSTGRES_SCHEMA:
+            conn.execute(statement)
+        conn.execute("DELETE FROM meowdev_schema")
+        conn.execute("INSERT INTO meowdev_schema (version) VALUES (?)", (SCHEMA_VERSION,))
+    _log(f"[MeowDev] PostgreSQL 数据库结构已升级到 v{SCHEMA_VERSION}")
+
+
+def init_db():
+    """把数据库结构升级到最新版本（每个进程只真正执行一次）"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        if _storage.dialect == "postgres":
+            _init_postgres_schema()
+            _schema_ready = True
+            return
+        with _write_conn() as conn:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+        if current > SCHEMA_VERSION:
+            _log(f"[MeowDev] 数据库结构版本 {current} 比代码新（{SCHEMA_VERSION}），跳过迁移")
+        for version in range(current + 1, SCHEMA_VERSION + 1):
+            migration = _MIGRATIONS[version - 1]
+            # 每个迁移一个事务：结构变更和版本号一起提交，失败整体回滚
+            with _write_conn() as conn:
+                conn.execute("BEGIN")
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+            _log(f"[MeowDev] 数据库结构已升级到 v{version}（{migration.__doc__.splitlines()[0]}）")
+        _schema_ready = True
 
 
 def _migrate_legacy_session(conn):
@@ -199,8 +751,30 @@ def _migrate_legacy_session(conn):
                 INSERT INTO sessions (id, name, created_at, updated_at, message_count)
                 VALUES (?, ?, ?, ?, ?)
             """, ("meowdev", "历史对话", created_at, updated_at, row["count"]))
-            conn.commit()  # 必须提交事务！
-            print(f"[MeowDev] 已迁移 {row['count']} 条历史消息到会话 'meowdev'")
+            _log(f"[MeowDev] 已迁移 {row['count']} 条历史消息到会话 'meowdev'")
+
+
+def _backfill_usage_rollups(conn):
+    """从 cat_usage 原始记录回填按小时 / 按天汇总表（只在汇总表为空时执行）"""
+    if conn.execute("SELECT 1 FROM cat_usage_hourly LIMIT 1").fetchone():
+        return
+    if not conn.execute("SELECT 1 FROM cat_usage LIMIT 1").fetchone():
+        return
+
+    for table, slot in (("cat_usage_hourly", "hour_slot"), ("cat_usage_daily", "date_slot")):
+        conn.execute(f"""
+            INSERT INTO {table}
+            ({slot}, cat_id, input_tokens, output_tokens,
+             cache_read_tokens, cache_creation_tokens, cost_usd, call_count)
+            SELECT {slot}, cat_id,
+                   SUM(input_tokens), SUM(output_tokens),
+                   SUM(cache_read_tokens), SUM(cache_creation_tokens),
+                   SUM(cost_usd), COUNT(*)
+            FROM cat_usage
+            WHERE {slot} IS NOT NULL
+            GROUP BY {slot}, cat_id
+        """)
+    _log("[MeowDev] 已从 cat_usage 回填使用统计汇总表")
 
 
 # ═══════════════════════════════════════════════════════════════════════
@@ -217,24 +791,21 @@ def create_session(name: str = "新对话", session_id: str = None) -> str:
     if not session_id:
         session_id = str(uuid.uuid4())[:8]  # 使用短 UUID
     now = time.time()
-    conn = _get_conn()
-    conn.execute(
-        "INSERT INTO sessions (id, name, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, 0)",
-        (session_id, name, now, now),
-    )
-    conn.commit()
-    conn.close()
+    with _write_conn() as conn:
+        conn.execute(
+            "INSERT INTO sessions (id, name, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, 0)",
+            (session_id, name, now, now),
+        )
     return session_id
 
 
 def get_session(session_id: str) -> Optional[dict]:
     """获取会话元数据"""
-    conn = _get_conn()
-    row = conn.execute(
-        "SELECT id, name, created_at, updated_at, message_count, is_archived FROM sessions WHERE id = ?",
-        (session_id,),
-    ).fetchone()
-    conn.close()
+    with _read_conn(barrier=True) as conn:
+        row = conn.execute(
+            "SELECT id, name, created_at, updated_at, message_count, is_archived FROM sessions WHERE id = ?",
+            (session_id,),
+        ).fetchone()
     if row:
         return {
             "id": row["id"],
@@ -249,25 +820,23 @@ def get_session(session_id: str) -> Optional[dict]:
 
 def update_session(session_id: str, name: str = None):
     """更新会话名称"""
-    conn = _get_conn()
-    if name:
+    if not name:
+        return
+    with _write_conn() as conn:
         conn.execute(
             "UPDATE sessions SET name = ?, updated_at = ? WHERE id = ?",
             (name, time.time(), session_id),
         )
-        conn.commit()
-    conn.close()
 
 
 def list_sessions(limit: int = 50) -> list[dict]:
     """获取会话列表，按更新时间倒序"""
-    conn = _get_conn()
-    rows = conn.execute(
-        "SELECT id, name, created_at, updated_at, message_count, is_archived "
-        "FROM sessions WHERE is_archived = 0 ORDER BY updated_at DESC LIMIT ?",
-        (limit,),
-    ).fetchall()
-    conn.close()
+    with _read_conn(barrier=True) as conn:
+        rows = conn.execute(
+            "SELECT id, name, created_at, updated_at, message_count, is_archived "
+            "FROM sessions WHERE is_archived = 0 ORDER BY updated_at DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
     return [
         {
             "id": r["id"],
@@ -282,69 +851,333 @@ def list_sessions(limit: int = 50) -> list[dict]:
 
 
 def delete_session(session_id: str):
-    """删除会话及其消息"""
-    conn = _get_conn()
-    conn.execute("DELETE FROM chat_history WHERE session_id = ?", (session_id,))
-    conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-    conn.commit()
-    conn.close()
+    """删除会话及其消息、摘要和发言高水位"""
+    with _write_conn() as conn:
+        _delete_sessions(conn, [session_id])
+
+
+# ── 批量操作 ──────────────────────────────────────────────
+#
+# 按 ID 列表和 / 或筛选条件批量删除、归档、恢复会话。筛选和修改在同一个
+# 写事务里完成，依赖表（消息、归档块、全文索引、发言高水位、摘要）一起清理。
+# 使用统计（cat_usage）按猫猫记账、不关联会话，不受影响。
+
+_BULK_CHUNK = 500  # IN (...) 列表每批的参数个数
+
+# 没有用户消息的会话；有归档块的会话一律视为有（归档块是压缩的，SQL 里看不到角色）
+_NO_USER_MESSAGES = """
+    NOT EXISTS (
+        SELECT 1 FROM chat_messages m
+        JOIN session_keys k ON k.key = m.session_key
+        WHERE k.session_id = s.id
+        AND m.role_id IN (SELECT id FROM roles WHERE name IN ('用户', 'user'))
+    )
+    AND NOT EXISTS (SELECT 1 FROM chat_archive a WHERE a.session_id = s.id)
+"""
+
+
+def _select_sessions(conn: sqlite3.Connection, session_ids: Optional[Iterable[str]],
+                     older_than_days: Optional[float] = None,
+                     without_user_messages: bool = False,
+                     archived: Optional[bool] = None) -> list[str]:
+    """按 ID 列表和筛选条件挑出会话（同时给出时取交集）"""
+    conditions: list[str] = []
+    params: list = []
+    if older_than_days is not None:
+        conditions.append("s.updated_at < ?")
+        params.append(time.time() - older_than_days * 86400)
+    if archived is not None:
+        conditions.append("s.is_archived = ?")
+        params.append(int(archived))
+    if without_user_messages:
+        conditions.append(_NO_USER_MESSAGES)
+    if session_ids is None and not conditions:
+        raise ValueError("批量操作需要会话 ID 列表或至少一个筛选条件")
+    where = " AND ".join(conditions) or "1 = 1"
+
+    if session_ids is None:
+        return [r["id"] for r in conn.execute(
+            f"SELECT s.id FROM sessions s WHERE {where} ORDER BY s.id", params,
+        ).fetchall()]
+    ids = list(dict.fromkeys(session_ids))
+    selected: list[str] = []
+    for i in range(0, len(ids), _BULK_CHUNK):
+        chunk = ids[i:i + _BULK_CHUNK]
+        selected.extend(r["id"] for r in conn.execute(
+            f"SELECT s.id FROM sessions s WHERE s.id IN ({','.join('?' * len(chunk))}) AND {where}",
+            (*chunk, *params),
+        ).fetchall())
+    return selected
+
+
+def _delete_sessions(conn: sqlite3.Connection, session_ids: list[str]):
+    """在当前事务里删除会话和所有依赖它的行"""
+    for i in range(0, len(session_ids), _BULK_CHUNK):
+        chunk = session_ids[i:i + _BULK_CHUNK]
+        ph = ",".join("?" * len(chunk))
+        # 热消息的全文索引条目由删除触发器同步删掉
+        conn.execute(
+            f"DELETE FROM chat_messages WHERE session_key IN "
+            f"(SELECT key FROM session_keys WHERE session_id IN ({ph}))",
+            chunk,
+        )
+        _delete_archived_sessions(conn, chunk)
+        for table in ("cat_last_spoke", "session_summaries", "cli_sessions", "session_keys"):
+            conn.execute(f"DELETE FROM {table} WHERE session_id IN ({ph})", chunk)
+        conn.execute(f"DELETE FROM sessions WHERE id IN ({ph})", chunk)
+
+
+def delete_sessions(session_ids: Optional[Iterable[str]] = None, *,
+                    older_than_days: Optional[float] = None,
+                    without_user_messages: bool = False,
+                    archived: Optional[bool] = None) -> list[str]:
+    """批量删除会话（一个事务），返回实际删除的会话 ID
+
+    Args:
+        session_ids: 要处理的会话；None 表示按筛选条件从全部会话里挑
+        older_than_days: 只处理超过这么多天没更新的会话
+        without_user_messages: 只处理没有用户消息的会话
+        archived: 只处理已归档（True）/ 未归档（False）的会话
+
+    Raises:
+        ValueError: 既没有 ID 列表也没有任何筛选条件（防止误删全部会话）
+    """
+    with _write_conn() as conn:
+        ids = _select_sessions(conn, session_ids, older_than_days, without_user_messages, archived)
+        _delete_sessions(conn, ids)
+    if ids:
+        _log(f"[MeowDev] 批量删除了 {len(ids)} 个会话")
+    return ids
+
+
+def _set_sessions_archived(session_ids: Optional[Iterable[str]], is_archived: bool,
+                           older_than_days: Optional[float],
+                           without_user_messages: bool) -> list[str]:
+    with _write_conn() as conn:
+        # 只挑状态确实会变的会话，返回值就是受影响的会话
+        ids = _select_sessions(conn, session_ids, older_than_days, without_user_messages,
+                               archived=not is_archived)
+        for i in range(0, len(ids), _BULK_CHUNK):
+            chunk = ids[i:i + _BULK_CHUNK]
+            conn.execute(
+                f"UPDATE sessions SET is_archived = ? WHERE id IN ({','.join('?' * len(chunk))})",
+                (int(is_archived), *chunk),
+            )
+    return ids
+
+
+def archive_sessions(session_ids: Optional[Iterable[str]] = None, *,
+                     older_than_days: Optional[float] = None,
+                     without_user_messages: bool = False) -> list[str]:
+    """批量归档会话（一个事务），返回本次归档的会话 ID，参数同 delete_sessions
+
+    归档后会话从列表里隐藏，消息由维护任务移进压缩归档。
+    """
+    ids = _set_sessions_archived(session_ids, True, older_than_days, without_user_messages)
+    if ids:
+        _log(f"[MeowDev] 批量归档了 {len(ids)} 个会话")
+    return ids
+
+
+def restore_sessions(session_ids: Optional[Iterable[str]] = None, *,
+                     older_than_days: Optional[float] = None,
+                     without_user_messages: bool = False) -> list[str]:
+    """批量恢复已归档的会话（一个事务），返回本次恢复的会话 ID，参数同 delete_sessions"""
+    ids = _set_sessions_archived(session_ids, False, older_than_days, without_user_messages)
+    if ids:
+        _log(f"[MeowDev] 批量恢复了 {len(ids)} 个会话")
+    return ids
+
+
+def cleanup_phantom_sessions(min_age_seconds: float = PHANTOM_SESSION_MIN_AGE) -> int:
+    """清理幽灵 session：没有用户消息的 session（由 on_chat_start 误创建的）
+
+    只处理超过 min_age_seconds 没更新的会话，避免误删刚创建、用户消息还在
+    写队列里的会话。返回清理的会话数。
+    """
+    cutoff = time.time() - min_age_seconds
+    with _exclusive_job("phantom_sessions") as acquired:
+        if not acquired:
+            return 0
+        with _write_conn() as conn:
+            phantom_ids = [r["id"] for r in conn.execute(f"""
+                SELECT s.id FROM sessions s
+                WHERE s.message_count <= 1
+                AND s.updated_at < ?
+                AND {_NO_USER_MESSAGES}
+            """, (cutoff,)).fetchall()]
+            if phantom_ids:
+                _delete_sessions(conn, phantom_ids)
+                _log(f"[MeowDev] 清理了 {len(phantom_ids)} 个空会话")
+    return len(phantom_ids)
 
 
 # ═══════════════════════════════════════════════════════════════════════
 # 对话历史
 # ═══════════════════════════════════════════════════════════════════════
+#
+# chat_messages 只存整数键：会话 ID 在 session_keys，角色名在 roles。
+# 按会话查询时先用 _SESSION_KEY 子查询换成整数键，再走 (session_key, timestamp) 索引。
 
-def add_message(role: str, content: str, session_id: str = "default"):
-    conn = _get_conn()
-    now = time.time()
-    conn.execute(
-        "INSERT INTO chat_history (role, content, timestamp, session_id) VALUES (?, ?, ?, ?)",
-        (role, content, now, session_id),
+_SESSION_KEY = "(SELECT key FROM session_keys WHERE session_id = ?)"
+_MESSAGE_SELECT = (
+    "SELECT m.id, r.name AS role, m.content, m.timestamp "
+    "FROM chat_messages m JOIN roles r ON r.id = m.role_id "
+)
+
+
+def _intern_keys(conn: sqlite3.Connection, session_id: str, role: str):
+    """确保会话 ID 和角色名已登记（已存在时只是一次唯一索引查找）
+
+    先查再插：PostgreSQL 上 INSERT ... ON CONFLICT DO NOTHING 即使没插入也会
+    消耗一个 BIGSERIAL 序列值，每条消息都试插的话序列会无限增长。
+    ON CONFLICT 留着，应对多个 worker 同时登记同一个键。
+    """
+    if conn.execute("SELECT 1 FROM session_keys WHERE session_id = ?", (session_id,)).fetchone() is None:
+        conn.execute("INSERT INTO session_keys (session_id) VALUES (?) ON CONFLICT DO NOTHING", (session_id,))
+    if conn.execute("SELECT 1 FROM roles WHERE name = ?", (role,)).fetchone() is None:
+        conn.execute("INSERT INTO roles (name) VALUES (?) ON CONFLICT DO NOTHING", (role,))
+
+
+def _insert_message(conn: sqlite3.Connection, session_id: str, role: str,
+                    content: str, timestamp: float) -> int:
+    """写入消息和它的全文索引条目，返回消息 id（不更新 sessions）"""
+    _intern_keys(conn, session_id, role)
+    message_id = _storage.insert(
+        conn,
+        "INSERT INTO chat_messages (session_key, role_id, content, timestamp) "
+        f"VALUES ({_SESSION_KEY}, (SELECT id FROM roles WHERE name = ?), ?, ?)",
+        (session_id, role, content, timestamp),
     )
-    # 更新会话的 updated_at 和 message_count
     conn.execute(
-        "UPDATE sessions SET updated_at = ?, message_count = message_count + 1 WHERE id = ?",
-        (now, session_id),
+        "INSERT INTO chat_fts (rowid, body) VALUES (?, ?)",
+        (message_id, _fts_segment(content)),
     )
-    conn.commit()
-    conn.close()
+    return message_id
+
+
+def add_message(role: str, content: str, session_id: str = "default",
+                cat_id: Optional[str] = None) -> Future:
+    """记录一条消息（进入写队列，合并提交）
+
+    返回的 Future 在消息落盘后完成，结果是消息 id；需要立即读到这条消息时
+    用 flush_writes() 或带 barrier 的读取函数。
+
+    Args:
+        cat_id: 这是猫猫的回复时传入，在同一个写操作里把该猫的发言高水位
+            推进到这条消息（相当于顺带做了 update_cat_last_spoke）
+    """
+    now = time.time()
+
+    def _op(conn: sqlite3.Connection):
+        message_id = _insert_message(conn, session_id, role, content, now)
+        # 更新会话的 updated_at 和 message_count
+        conn.execute(
+            "UPDATE sessions SET updated_at = ?, message_count = message_count + 1 WHERE id = ?",
+            (now, session_id),
+        )
+        if cat_id is not None:
+            _set_last_spoke(conn, cat_id, session_id, message_id, now)
+        return message_id
+
+    return _storage.submit(_op)
 
 
 def get_recent_messages(session_id: str = "default",
                         limit: int = MAX_RECENT_MESSAGES) -> list[dict]:
-    conn = _get_conn()
-    rows = conn.execute(
-        "SELECT role, content, timestamp FROM chat_history "
-        "WHERE session_id = ? ORDER BY timestamp DESC LIMIT ?",
-        (session_id, limit),
-    ).fetchall()
-    conn.close()
+    with _read_conn(barrier=True) as conn:
+        rows = conn.execute(
+            _MESSAGE_SELECT +
+            f"WHERE m.session_key = {_SESSION_KEY} ORDER BY m.timestamp DESC, m.id DESC LIMIT ?",
+            (session_id, limit),
+        ).fetchall()
+        rows = [dict(r) for r in rows]
+        if len(rows) < limit:
+            # 热表不够时再去归档里补（大多数会话不会走到这里）
+            rows = _merge_newest_first(rows, _archived_messages(conn, session_id, limit=limit), limit)
     return [{"role": r["role"], "content": r["content"], "timestamp": r["timestamp"]} for r in reversed(rows)]
 
 
+def _encode_page_token(timestamp: float, message_id: int) -> str:
+    """把 (timestamp, id) 游标编码成不透明的翻页标记"""
+    raw = f"{timestamp!r}:{message_id}".encode("ascii")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_page_token(token: str) -> Optional[tuple[float, int]]:
+    """解析翻页标记，格式不对返回 None"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        ts, msg_id = base64.urlsafe_b64decode(padded.encode("ascii")).decode("ascii").split(":")
+        return float(ts), int(msg_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
 def get_messages_paginated(session_id: str = "default",
-                           offset: int = 0,
-                           limit: int = 20) -> list[dict]:
-    """分页获取历史消息（按时间倒序，返回时正序显示）"""
-    conn = _get_conn()
-    rows = conn.execute(
-        "SELECT role, content, timestamp FROM chat_history "
-        "WHERE session_id = ? ORDER BY timestamp DESC LIMIT ? OFFSET ?",
-        (session_id, limit, offset),
-    ).fetchall()
-    conn.close()
-    return [{"role": r["role"], "content": r["content"], "timestamp": r["timestamp"]} for r in reversed(rows)]
+                           cursor: Optional[str] = None,
+                           limit: int = 20) -> tuple[list[dict], Optional[str]]:
+    """按 (timestamp, id) 游标分页获取历史消息（从新到旧翻页，返回时正序显示）
+
+    游标翻页直接在 (session_key, timestamp) 索引上定位，
+    第 N 页和第 1 页的代价相同，不会像 OFFSET 那样扫描并丢弃前面的行。
+
+    Args:
+        session_id: 会话ID
+        cursor: 上一页返回的翻页标记，None 表示最新一页
+        limit: 每页条数
+
+    Returns:
+        (消息列表, 下一页（更早消息）的翻页标记，没有更多时为 None)
+
+    Raises:
+        ValueError: 翻页标记无效
+    """
+    params: list = [session_id]
+    where = f"m.session_key = {_SESSION_KEY}"
+    if cursor:
+        position = _decode_page_token(cursor)
+        if position is None:
+            raise ValueError(f"无效的翻页标记: {cursor}")
+        where += " AND (m.timestamp, m.id) < (?, ?)"
+        params.extend(position)
+
+    with _read_conn(barrier=True) as conn:
+        rows = conn.execute(
+            _MESSAGE_SELECT +
+            f"WHERE {where} ORDER BY m.timestamp DESC, m.id DESC LIMIT ?",
+            (*params, limit + 1),
+        ).fetchall()
+        rows = [dict(r) for r in rows]
+        if len(rows) <= limit:
+            # 翻到热表尽头后无缝接上归档消息
+            archived = _archived_messages(conn, session_id, before=position if cursor else None, limit=limit + 1)
+            rows = _merge_newest_first(rows, archived, limit + 1)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_page_token(rows[-1]["timestamp"], rows[-1]["id"])
+
+    messages = [
+        {"id": r["id"], "role": r["role"], "content": r["content"], "timestamp": r["timestamp"]}
+        for r in reversed(rows)
+    ]
+    return messages, next_cursor
 
 
 def get_message_count(session_id: str = "default") -> int:
     """获取消息总数"""
-    conn = _get_conn()
-    row = conn.execute(
-        "SELECT COUNT(*) as count FROM chat_history WHERE session_id = ?",
-        (session_id,),
-    ).fetchone()
-    conn.close()
-    return row["count"] if row else 0
+    with _read_conn(barrier=True) as conn:
+        row = conn.execute(
+            f"SELECT COUNT(*) as count FROM chat_messages WHERE session_key = {_SESSION_KEY}",
+            (session_id,),
+        ).fetchone()
+        archived = conn.execute(
+            "SELECT COALESCE(SUM(message_count), 0) FROM chat_archive WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()[0]
+    return (row["count"] if row else 0) + archived
 
 
 def format_chat_context(session_id: str = "default") -> str:
@@ -357,48 +1190,704 @@ def format_chat_context(session_id: str = "default") -> str:
 
 def clear_session(session_id: str = "default"):
     """清空会话历史"""
-    conn = _get_conn()
-    conn.execute("DELETE FROM chat_history WHERE session_id = ?", (session_id,))
-    conn.commit()
-    conn.close()
+    with _write_conn() as conn:
+        conn.execute(f"DELETE FROM chat_messages WHERE session_key = {_SESSION_KEY}", (session_id,))
+        _delete_archived_sessions(conn, [session_id])
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 冷数据归档
+# ═══════════════════════════════════════════════════════════════════════
+#
+# 超过 ARCHIVE_AFTER_DAYS 的消息、以及已归档会话的全部消息，由维护任务
+# 按会话打包成压缩块移到 chat_archive。读取函数在热表不够时自动补上
+# 归档消息，调用方无感知。全文索引保留归档消息的条目（rowid 不变）。
+
+def _encode_archive_block(messages: list[dict]) -> bytes:
+    payload = [[m["id"], m["role"], m["content"], m["timestamp"]] for m in messages]
+    return zlib.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8"), 6)
+
+
+def _decode_archive_block(data: bytes, session_id: str) -> list[dict]:
+    return [
+        {"id": mid, "role": role, "content": content, "timestamp": ts, "session_id": session_id}
+        for mid, role, content, ts in json.loads(zlib.decompress(data))
+    ]
+
+
+def _merge_newest_first(rows: list[dict], archived: list[dict], limit: int) -> list[dict]:
+    """合并热数据和归档数据，按 (timestamp, id) 从新到旧取前 limit 条"""
+    if not archived:
+        return rows
+    merged = sorted(rows + archived, key=lambda m: (m["timestamp"], m["id"]), reverse=True)
+    return merged[:limit]
+
+
+def _archived_messages(conn: sqlite3.Connection, session_id: str,
+                       before: Optional[tuple[float, int]] = None,
+                       after_ts: Optional[float] = None,
+                       limit: Optional[int] = None,
+                       after_id: Optional[int] = None) -> list[dict]:
+    """读取会话的归档消息，按 (timestamp, id) 从新到旧返回
+
+    Args:
+        before: 只要 (timestamp, id) 小于它的消息（翻页游标）
+        after_ts: 只要时间戳大于它的消息
+        limit: 最多返回条数；够数后不再解压更旧的块
+        after_id: 只要 id 大于它的消息
+    """
+    sql = "SELECT last_ts, data FROM chat_archive WHERE session_id = ?"
+    params: list = [session_id]
+    if before is not None:
+        sql += " AND first_ts <= ?"
+        params.append(before[0])
+    if after_ts is not None:
+        sql += " AND last_ts > ?"
+        params.append(after_ts)
+    if after_id is not None:
+        sql += " AND last_id > ?"
+        params.append(after_id)
+    sql += " ORDER BY last_ts DESC"
+
+    messages: list[dict] = []
+    for block in conn.execute(sql, params).fetchall():
+        if limit and len(messages) >= limit and block["last_ts"] < messages[limit - 1]["timestamp"]:
+            break
+        for m in _decode_archive_block(block["data"], session_id):
+            if before is not None and (m["timestamp"], m["id"]) >= tuple(before):
+                continue
+            if after_ts is not None and m["timestamp"] <= after_ts:
+                continue
+            if after_id is not None and m["id"] <= after_id:
+                continue
+            messages.append(m)
+        messages.sort(key=lambda m: (m["timestamp"], m["id"]), reverse=True)
+    return messages[:limit] if limit else messages
+
+
+def _load_archived_by_id(conn: sqlite3.Connection, message_ids: list[int]) -> dict[int, dict]:
+    """按消息 id 从归档块中取回消息"""
+    found: dict[int, dict] = {}
+    decoded: set[int] = set()
+    for message_id in message_ids:
+        if message_id in found:
+            continue
+        blocks = conn.execute(
+            "SELECT id, session_id, data FROM chat_archive WHERE first_id <= ? AND last_id >= ?",
+            (message_id, message_id),
+        ).fetchall()
+        for block in blocks:
+            if block["id"] in decoded:
+                continue
+            decoded.add(block["id"])
+            for m in _decode_archive_block(block["data"], block["session_id"]):
+                found[m["id"]] = m
+    return found
+
+
+def _session_messages(conn: sqlite3.Connection, session_id: str) -> list[dict]:
+    """会话的全部消息（归档 + 热数据），按时间正序"""
+    rows = [dict(r) for r in conn.execute(
+        _MESSAGE_SELECT +
+        f"WHERE m.session_key = {_SESSION_KEY} ORDER BY m.timestamp ASC, m.id ASC",
+        (session_id,),
+    ).fetchall()]
+    archived = _archived_messages(conn, session_id)
+    if not archived:
+        return rows
+    return sorted(archived + rows, key=lambda m: (m["timestamp"], m["id"]))
+
+
+def _delete_archived_sessions(conn: sqlite3.Connection, session_ids: list[str]):
+    """删除会话的归档块，连同它们在全文索引里的条目"""
+    if not session_ids:
+        return
+    ph = ",".join("?" * len(session_ids))
+    blocks = conn.execute(
+        f"SELECT session_id, data FROM chat_archive WHERE session_id IN ({ph})", session_ids,
+    ).fetchall()
+    if not blocks:
+        return
+    for block in blocks:
+        conn.executemany(
+            "DELETE FROM chat_fts WHERE rowid = ?",
+            [(m["id"],) for m in _decode_archive_block(block["data"], block["session_id"])],
+        )
+    conn.execute(f"DELETE FROM chat_archive WHERE session_id IN ({ph})", session_ids)
+
+
+def delete_archived_message(message_id: int) -> bool:
+    """从归档块中删除单条消息（重写所在的块），返回是否找到"""
+    with _write_conn() as conn:
+        blocks = conn.execute(
+            "SELECT id, session_id, data FROM chat_archive WHERE first_id <= ? AND last_id >= ?",
+            (message_id, message_id),
+        ).fetchall()
+        for block in blocks:
+            messages = _decode_archive_block(block["data"], block["session_id"])
+            remaining = [m for m in messages if m["id"] != message_id]
+            if len(remaining) == len(messages):
+                continue
+            if remaining:
+                conn.execute(
+                    "UPDATE chat_archive SET first_id = ?, last_id = ?, first_ts = ?, last_ts = ?, "
+                    "message_count = ?, data = ? WHERE id = ?",
+                    (remaining[0]["id"], remaining[-1]["id"],
+                     min(m["timestamp"] for m in remaining), max(m["timestamp"] for m in remaining),
+                     len(remaining), _encode_archive_block(remaining), block["id"]),
+                )
+            else:
+                conn.execute("DELETE FROM chat_archive WHERE id = ?", (block["id"],))
+            conn.execute("DELETE FROM chat_fts WHERE rowid = ?", (message_id,))
+            return True
+    return False
+
+
+def archive_old_messages(max_age_days: float = ARCHIVE_AFTER_DAYS,
+                         block_size: int = ARCHIVE_BLOCK_MESSAGES) -> int:
+    """把旧消息 / 已归档会话的消息移进压缩归档，返回归档的消息数
+
+    每个块单独一个短事务，不会长时间占住写锁。多个 worker 共用 PostgreSQL 时
+    同一时间只有一个在归档，避免同一批消息被打包两次。
+    """
+    with _exclusive_job("archive_messages") as acquired:
+        if not acquired:
+            return 0
+        return _archive_old_messages(max_age_days, block_size)
+
+
+def _archive_old_messages(max_age_days: float, block_size: int) -> int:
+    cutoff = time.time() - max_age_days * 86400
+    with _read_conn(barrier=True) as conn:
+        archived_sessions = {
+            r["id"] for r in conn.execute("""
+                SELECT s.id FROM sessions s
+                JOIN session_keys k ON k.session_id = s.id
+                WHERE s.is_archived = 1
+                AND EXISTS (SELECT 1 FROM chat_messages m WHERE m.session_key = k.key)
+            """).fetchall()
+        }
+        session_ids = archived_sessions | {
+            r["session_id"] for r in conn.execute("""
+                SELECT k.session_id FROM session_keys k
+                WHERE EXISTS (
+                    SELECT 1 FROM chat_messages m
+                    WHERE m.session_key = k.key AND m.timestamp < ?
+                )
+            """, (cutoff,)).fetchall()
+        }
+
+    total = 0
+    for session_id in session_ids:
+        # 已归档的会话整体移走，其余会话只移走过期的部分
+        session_cutoff = float("inf") if session_id in archived_sessions else cutoff
+        while True:
+            with _write_conn() as conn:
+                rows = [dict(r) for r in conn.execute(
+                    _MESSAGE_SELECT +
+                    f"WHERE m.session_key = {_SESSION_KEY} AND m.timestamp < ? "
+                    "ORDER BY m.timestamp ASC, m.id ASC LIMIT ?",
+                    (session_id, session_cutoff, block_size),
+                ).fetchall()]
+                if not rows:
+                    break
+                ids = [r["id"] for r in rows]
+                conn.execute(
+                    "INSERT INTO chat_archive "
+                    "(session_id, first_id, last_id, first_ts, last_ts, message_count, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (session_id, min(ids), max(ids), rows[0]["timestamp"], rows[-1]["timestamp"],
+                     len(rows), _encode_archive_block(rows)),
+                )
+                ph = ",".join("?" * len(ids))
+                conn.execute(f"DELETE FROM chat_messages WHERE id IN ({ph})", ids)
+                # 删除触发器会连带删掉索引条目，归档消息仍要能搜到，重新写回
+                conn.executemany(
+                    "INSERT INTO chat_fts (rowid, body) VALUES (?, ?)",
+                    [(r["id"], _fts_segment(r["content"])) for r in rows],
+                )
+            total += len(rows)
+            if len(rows) < block_size:
+                break
+
+    if total:
+        _log(f"[MeowDev] 归档了 {total} 条旧消息（{len(session_ids)} 个会话）")
+    return total
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 全文搜索
+# ═══════════════════════════════════════════════════════════════════════
+
+# 中日韩文字逐字切开，其余文本交给 unicode61 按单词切分
+_CJK_CHAR = re.compile(r"([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af])")
+SEARCH_SNIPPET_RADIUS = 40
+
+
+def _fts_segment(text: str) -> str:
+    """把文本转成写入 chat_fts 的形式（汉字之间插空格）"""
+    return _CJK_CHAR.sub(r" \1 ", text)
+
+
+def _fts_query(query: str) -> str:
+    """把用户输入转成 FTS5 查询：每个词一个短语，词之间 AND
+
+    用户输入里的引号、运算符都按普通文本处理，不会触发 FTS5 语法错误。
+    英文 / 数字结尾的词做前缀匹配（deploy 能搜到 deployment）。
+    """
+    phrases = []
+    for term in query.split():
+        if not re.search(r"\w", term):
+            continue
+        phrase = '"' + _fts_segment(term).replace('"', '""') + '"'
+        if term[-1].isascii() and term[-1].isalnum():
+            phrase += "*"
+        phrases.append(phrase)
+    return " AND ".join(phrases)
+
+
+def _pg_tsquery(query: str) -> str:
+    """PostgreSQL 版的 _fts_query：每个词一个短语（<->），词之间 &，英文结尾做前缀匹配"""
+    phrases = []
+    for term in query.split():
+        tokens = re.findall(r"\w+", _fts_segment(term).lower())
+        if not tokens:
+            continue
+        quoted = ["'" + t.replace("'", "''") + "'" for t in tokens]
+        if term[-1].isascii() and term[-1].isalnum():
+            quoted[-1] += ":*"
+        phrases.append("(" + " <-> ".join(quoted) + ")")
+    return " & ".join(phrases)
+
+
+def _make_snippet(content: str, terms: list[str], radius: int = SEARCH_SNIPPET_RADIUS) -> str:
+    """截取第一个命中词附近的片段，命中词用 ** 标出"""
+    text = " ".join(content.split())
+    lowered = text.lower()
+    hits = [(lowered.find(t.lower()), t) for t in terms]
+    hits = [(pos, t) for pos, t in hits if pos >= 0]
+    if hits:
+        pos, term = min(hits)
+        start = max(0, pos - radius)
+        end = min(len(text), pos + len(term) + radius)
+    else:
+        start, end = 0, min(len(text), radius * 2)
+
+    snippet = text[start:end]
+    if terms:
+        pattern = "|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True))
+        snippet = re.sub(f"({pattern})", r"**\1**", snippet, flags=re.IGNORECASE)
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(text) else "")
+
+
+def search_messages(query: str, session_id: Optional[str] = None, limit: int = 20) -> list[dict]:
+    """全文搜索对话历史，按相关度（bm25）排序
+
+    Returns:
+        [{id, session_id, session_name, role, timestamp, snippet}, ...]
+    """
+    postgres = _storage.dialect == "postgres"
+    match = _pg_tsquery(query) if postgres else _fts_query(query)
+    if not match:
+        return []
+
+    # 归档消息不在 chat_messages 里（m.id IS NULL），之后从归档块中取回
+    sql = (
+        "SELECT chat_fts.rowid AS id, k.session_id, r.name AS role, m.content, m.timestamp "
+        "FROM chat_fts "
+        "LEFT JOIN chat_messages m ON m.id = chat_fts.rowid "
+        "LEFT JOIN session_keys k ON k.key = m.session_key "
+        "LEFT JOIN roles r ON r.id = m.role_id "
+        + ("WHERE chat_fts.tsv @@ to_tsquery('simple', ?)" if postgres else "WHERE chat_fts MATCH ?")
+    )
+    params: list = [match]
+    if session_id:
+        sql += (
+            f" AND (m.session_key = {_SESSION_KEY} OR (m.id IS NULL AND EXISTS ("
+            "SELECT 1 FROM chat_archive a WHERE a.session_id = ? "
+            "AND chat_fts.rowid BETWEEN a.first_id AND a.last_id)))"
+        )
+        params.extend([session_id, session_id])
+    if postgres:
+        sql += " ORDER BY ts_rank(chat_fts.tsv, to_tsquery('simple', ?)) DESC LIMIT ?"
+        params.extend([match, limit])
+    else:
+        sql += " ORDER BY chat_fts.rank LIMIT ?"
+        params.append(limit)
+
+    with _read_conn(barrier=True) as conn:
+        rows = [dict(r) for r in conn.execute(sql, params).fetchall()]
+        missing = [r["id"] for r in rows if r["session_id"] is None]
+        if missing:
+            archived = _load_archived_by_id(conn, missing)
+            rows = [archived.get(r["id"]) if r["session_id"] is None else r for r in rows]
+            rows = [r for r in rows if r and (not session_id or r["session_id"] == session_id)]
+        session_ids = list({r["session_id"] for r in rows})
+        names = {}
+        if session_ids:
+            ph = ",".join("?" * len(session_ids))
+            names = dict(conn.execute(
+                f"SELECT id, name FROM sessions WHERE id IN ({ph})", session_ids,
+            ).fetchall())
+
+    terms = [t.strip('"') for t in query.split() if re.search(r"\w", t)]
+    return [
+        {
+            "id": r["id"],
+            "session_id": r["session_id"],
+            "session_name": names.get(r["session_id"]) or r["session_id"],
+            "role": r["role"],
+            "timestamp": r["timestamp"],
+            "snippet": _make_snippet(r["content"], terms),
+        }
+        for r in rows
+    ]
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 进程内缓存（猫猫记忆 / 用户画像）
+# ═══════════════════════════════════════════════════════════════════════
+
+# 这两张表几乎只在猫猫打 [记住] / [用户] 标记时才写，却在每一轮、每只猫
+# 组装 prompt 时都要读。写入都经过本模块，所以缓存由写函数负责更新：
+# 提交后把新行直接写进缓存（write-through），清空时整体失效。
+
+class _VersionedCache:
+    """按键缓存，未命中时调用 loader 从数据库加载
+
+    每次写入 / 失效都让版本号 +1。加载期间版本号变了，说明可能读到了写入
+    之前的数据，这次加载的结果只返回给调用方，不放进缓存。
+
+    缓存的值按不可变对象对待：update() 传入的函数必须返回新对象，
+    不能原地修改，这样已经拿到旧值的读者不受影响。
+
+    max_age 不为 None 时，条目加载后最多使用这么久（其他进程的写入
+    不会通知到这里，只能靠过期）。
+    """
+
+    def __init__(self, max_age: Optional[float] = None):
+        self._lock = threading.Lock()
+        self._entries: dict = {}     # key → (value, 加载时间)
+        self._version = 0
+        self._max_age = max_age
+
+    def get(self, key, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self._max_age is None
+                                      or time.monotonic() - entry[1] < self._max_age):
+                return entry[0]
+            version = self._version
+        loaded_at = time.monotonic()
+        value = loader()
+        with self._lock:
+            if self._version == version:
+                self._entries[key] = (value, loaded_at)
+        return value
+
+    def update(self, key, func: Callable[[Any], Any]):
+        """写穿透：已缓存时用 func(旧值) 替换；未缓存时只让进行中的加载作废"""
+        with self._lock:
+            self._version += 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (func(entry[0]), entry[1])
+
+    def invalidate(self, key=None):
+        """失效一个键（不传则全部失效）"""
+        with self._lock:
+            self._version += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+
+# cat_id → 该猫全部记忆（_CatMemories）
+_memory_cache = _VersionedCache(SHARED_CACHE_TTL if _storage.shared else None)
+# 唯一的键 _PROFILE_GROUP → {rowid: (key, value)}，按 rowid 升序
+_profile_cache = _VersionedCache(SHARED_CACHE_TTL if _storage.shared else None)
+
+_MEMORY_COLUMNS = "id, memory, importance, timestamp, hit_count"
+
+
+@dataclass(frozen=True)
+class _CatMemories:
+    """一只猫的全部记忆：按 id 直接取，"非常重要"的 id 单独列出，挑选记忆时不用遍历"""
+    by_id: dict[int, dict]      # id → 记忆行，按 id 升序
+    important: tuple[int, ...]  # importance ≥ 3 的 id
+
+    @classmethod
+    def of(cls, rows: Iterable[dict]) -> "_CatMemories":
+        by_id = {r["id"]: r for r in sorted(rows, key=lambda r: r["id"])}
+        return cls(by_id, tuple(i for i, r in by_id.items() if r["importance"] >= 3))
+
+
+def _cached_cat_memories(cat_id: str) -> _CatMemories:
+    def load():
+        with _read_conn() as conn:
+            rows = conn.execute(
+                f"SELECT {_MEMORY_COLUMNS} FROM cat_memories WHERE cat_id = ? ORDER BY id",
+                (cat_id,),
+            ).fetchall()
+        return _CatMemories.of(dict(r) for r in rows)
+
+    return _memory_cache.get(cat_id, load)
+
+
+def _cached_user_profile() -> dict[int, tuple[str, str]]:
+    def load():
+        with _read_conn() as conn:
+            rows = conn.execute("SELECT rowid, key, value FROM user_profile ORDER BY rowid").fetchall()
+        return {r[0]: (r[1], r[2]) for r in rows}
+
+    return _profile_cache.get(_PROFILE_GROUP, load)
+
+
+def _with_memory_row(memories: _CatMemories, row: dict) -> _CatMemories:
+    """返回替换 / 追加了 row 之后的新记忆集合"""
+    return _CatMemories.of([*(r for i, r in memories.by_id.items() if i != row["id"]), row])
+
+
+def get_memory_cache_version() -> tuple[int, int]:
+    """返回 (猫猫记忆缓存版本号, 用户画像缓存版本号)"""
+    return _memory_cache.version, _profile_cache.version
 
 
 # ═══════════════════════════════════════════════════════════════════════
 # 猫猫记忆
 # ═══════════════════════════════════════════════════════════════════════
 
-def add_cat_memory(cat_id: str, memory: str, importance: int = 1):
-    """添加猫猫记忆
+# 记忆文本规范化：全角转半角、小写、去掉空白和标点，只比较"说了什么"
+_MEMORY_NOISE = re.compile(r"[\W_]+")
+_MEMORY_CJK_RUN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+")
+_MEMORY_WORD = re.compile(r"[a-z0-9]{2,}")
+
+
+def _normalize_memory(text: str) -> str:
+    return _MEMORY_NOISE.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def _memory_hash(text: str) -> str:
+    return hashlib.sha1(_normalize_memory(text).encode("utf-8")).hexdigest()
+
+
+def _memory_terms(text: str) -> set[str]:
+    """词项集合：英文 / 数字按单词，中日韩文字按相邻两字（单字成段时取单字）"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    terms = set(_MEMORY_WORD.findall(text))
+    for run in _MEMORY_CJK_RUN.findall(text):
+        if len(run) == 1:
+            terms.add(run)
+        else:
+            terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def _jaccard(a: set[str], b: set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def add_cat_memory(cat_id: str, memory: str, importance: int = 1) -> int:
+    """添加猫猫记忆（自动去重）
+
+    规范化后完全相同、或与已有记忆高度相似（词项 Jaccard ≥ MEMORY_DUP_THRESHOLD）
+    的记忆不再新增，而是合并到已有那条：重要性取最大，命中次数 +1，时间刷新。
+    完全相同的按 memory_hash 索引查；近似重复只和语义索引里最相近的
+    MEMORY_DUP_CANDIDATES 条比较（在拿写锁之前检索好）。
 
     Args:
         cat_id: 猫猫ID (arch/stack/pixel)
         memory: 记忆内容
         importance: 重要性 (1=普通, 2=重要, 3=非常重要)
+
+    Returns:
+        记忆 id（新增或被合并的那条）
     """
-    conn = _get_conn()
-    conn.execute(
-        "INSERT INTO cat_memories (cat_id, memory, importance, timestamp) VALUES (?, ?, ?, ?)",
-        (cat_id, memory, importance, time.time()),
-    )
-    conn.commit()
-    conn.close()
+    now = time.time()
+    memory_hash = _memory_hash(memory)
+    _ensure_semantic_index()
+    candidates = [i for i, _ in _memory_index.search(memory, group=cat_id, k=MEMORY_DUP_CANDIDATES)]
+    with _write_conn() as conn:
+        existing = conn.execute(
+            "SELECT id FROM cat_memories WHERE cat_id = ? AND memory_hash = ?",
+            (cat_id, memory_hash),
+        ).fetchone()
+
+        if existing is None and candidates:
+            terms = _memory_terms(memory)
+            best_id, best_score = None, 0.0
+            for r in conn.execute(
+                f"SELECT id, memory FROM cat_memories WHERE cat_id = ? "
+                f"AND id IN ({','.join('?' * len(candidates))})",
+                (cat_id, *candidates),
+            ).fetchall():
+                score = _jaccard(terms, _memory_terms(r["memory"]))
+                if score > best_score:
+                    best_id, best_score = r["id"], score
+            if best_score >= MEMORY_DUP_THRESHOLD:
+                existing = {"id": best_id}
+
+        if existing is not None:
+            memory_id = existing["id"]
+            conn.execute(
+                "UPDATE cat_memories SET importance = CASE WHEN importance < ? THEN ? ELSE importance END, "
+                "hit_count = hit_count + 1, timestamp = ? WHERE id = ?",
+                (importance, importance, now, memory_id),
+            )
+        else:
+            memory_id = _storage.insert(
+                conn,
+                "INSERT INTO cat_memories (cat_id, memory, importance, timestamp, memory_hash, hit_count) "
+                "VALUES (?, ?, ?, ?, ?, 1)",
+                (cat_id, memory, importance, now, memory_hash),
+            )
+        row = dict(conn.execute(
+            f"SELECT {_MEMORY_COLUMNS} FROM cat_memories WHERE id = ?", (memory_id,),
+        ).fetchone())
+
+    # 提交之后再更新缓存和语义索引，里面不会出现回滚掉的记忆
+    _memory_cache.update(cat_id, lambda memories: _with_memory_row(memories, row))
+    if existing is None:
+        _memory_index.upsert(memory_id, cat_id, memory)
+    return memory_id
 
 
 def get_cat_memories(cat_id: str, limit: int = 20) -> list[dict]:
-    """获取猫猫的记忆列表"""
-    conn = _get_conn()
-    rows = conn.execute(
-        "SELECT memory, importance, timestamp FROM cat_memories "
-        "WHERE cat_id = ? ORDER BY importance DESC, timestamp DESC LIMIT ?",
-        (cat_id, limit),
-    ).fetchall()
-    conn.close()
-    return [{"memory": r["memory"], "importance": r["importance"]} for r in rows]
+    """获取猫猫的记忆列表（按重要性、时间倒序）"""
+    rows = sorted(
+        _cached_cat_memories(cat_id).by_id.values(),
+        key=lambda r: (r["importance"], r["timestamp"]),
+        reverse=True,
+    )
+    return [{"memory": r["memory"], "importance": r["importance"]} for r in rows[:limit]]
+
+
+def _score_memory(relevance: float, importance: int, hit_count: int, age_days: float) -> float:
+    """综合得分 = 相关度 × 重要性加权 + 新鲜度
+
+    相关度为 0 的记忆得分只来自新鲜度，排在所有相关记忆之后。
+    """
+    weight = 1 + 0.25 * (importance - 1) + 0.1 * math.log1p(hit_count - 1)
+    recency = 0.5 ** (age_days / MEMORY_HALF_LIFE_DAYS)
+    return relevance * weight + 0.05 * recency
+
+
+_semantic_synced_at: Optional[float] = None
+_semantic_sync_lock = threading.Lock()
+
+
+def _semantic_index_fresh() -> bool:
+    if _semantic_synced_at is None:
+        return False
+    # 共用数据库时其他进程也会写记忆，隔一段时间重新对齐一次
+    return not _storage.shared or time.monotonic() - _semantic_synced_at < SHARED_CACHE_TTL
+
+
+def _invalidate_semantic_index():
+    """绕过 add_cat_memory / 画像写入直接改了数据库时调用：下次检索前重新和数据库对齐"""
+    global _semantic_synced_at
+    _semantic_synced_at = None
+
+
+def _ensure_semantic_index():
+    """每个进程第一次检索前，把语义索引和数据库对齐（只补差量）"""
+    global _semantic_synced_at
+    if _semantic_index_fresh():
+        return
+    with _semantic_sync_lock:
+        if _semantic_index_fresh():
+            return
+
+        def _fetch(sql: str, ids: list[int]) -> list[tuple[int, str, str]]:
+            items = []
+            with _read_conn() as conn:
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    items.extend(
+                        tuple(r) for r in conn.execute(
+                            sql.format(ph=",".join("?" * len(chunk))), chunk,
+                        ).fetchall()
+                    )
+            return items
+
+        with _read_conn(barrier=True) as conn:
+            memory_ids = {r[0] for r in conn.execute("SELECT id FROM cat_memories").fetchall()}
+            profile_ids = {r[0] for r in conn.execute("SELECT rowid FROM user_profile").fetchall()}
+
+        added, removed = _memory_index.sync(memory_ids, lambda ids: _fetch(
+            "SELECT id, cat_id, memory FROM cat_memories WHERE id IN ({ph})", ids,
+        ))
+        _profile_index.sync(profile_ids, lambda ids: _fetch(
+            f"SELECT rowid, '{_PROFILE_GROUP}', key || ': ' || value FROM user_profile WHERE rowid IN ({{ph}})", ids,
+        ))
+        if (added or removed) and not _storage.shared:
+            _log(f"[MeowDev] 记忆语义索引已同步（新增 {added}，移除 {removed}）")
+        _semantic_synced_at = time.monotonic()
+
+
+def get_relevant_cat_memories(cat_id: str, query: str,
+                              limit: int = MEMORY_CONTEXT_LIMIT) -> list[dict]:
+    """按与当前对话的相关度挑选记忆
+
+    候选来自语义索引（余弦相似度 ≥ MEMORY_SEMANTIC_MIN_SCORE），再用词项重合、
+    重要性和新鲜度重新排序。"非常重要"（importance ≥ 3）的记忆总在候选里。
+    候选行按 id 从记忆缓存里直接取，不遍历全部记忆，也不读数据库。
+    """
+    _ensure_semantic_index()
+    similarity = dict(_memory_index.search(
+        query, group=cat_id, k=limit * 4, min_score=MEMORY_SEMANTIC_MIN_SCORE,
+    ))
+
+    memories = _cached_cat_memories(cat_id)
+    # 共用数据库时索引可能比缓存新，缓存里还没有的先跳过
+    rows = [
+        memories.by_id[i] for i in dict.fromkeys([*memories.important, *similarity])
+        if i in memories.by_id
+    ]
+
+    query_terms = _memory_terms(query)
+    now = time.time()
+    scored = []
+    for r in rows:
+        terms = _memory_terms(r["memory"])
+        overlap = len(terms & query_terms) / len(terms) if terms else 0.0
+        relevance = 0.6 * similarity.get(r["id"], 0.0) + 0.4 * overlap
+        age_days = max(0.0, now - r["timestamp"]) / 86400
+        scored.append((_score_memory(relevance, r["importance"], r["hit_count"] or 1, age_days), r))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [
+        {"memory": r["memory"], "importance": r["importance"], "score": round(score, 4)}
+        for score, r in scored[:limit]
+    ]
+
+
+def _recent_query_text(session_id: str) -> str:
+    """最近几条消息拼起来，作为挑选记忆 / 画像的查询"""
+    recent = get_recent_messages(session_id, MEMORY_QUERY_MESSAGES)
+    return "\n".join(m["content"] for m in recent)
 
 
-def format_cat_memory_context(cat_id: str, limit: int = 10) -> str:
-    """格式化猫猫记忆，给 LLM 用"""
-    memories = get_cat_memories(cat_id, limit)
+def format_cat_memory_context(cat_id: str, limit: int = MEMORY_CONTEXT_LIMIT,
+                              session_id: Optional[str] = None,
+                              query: Optional[str] = None) -> str:
+    """格式化猫猫记忆，给 LLM 用
+
+    传了 query（或 session_id，此时用最近几条消息作为 query）时只挑和对话
+    相关的记忆；否则按重要性和时间取前几条。
+    """
+    if query is None and session_id:
+        query = _recent_query_text(session_id)
+    if query is not None:
+        memories = get_relevant_cat_memories(cat_id, query, limit)
+    else:
+        memories = get_cat_memories(cat_id, limit)
     if not memories:
         return ""
 
@@ -412,13 +1901,16 @@ def format_cat_memory_context(cat_id: str, limit: int = 10) -> str:
 
 def clear_cat_memories(cat_id: Optional[str] = None):
     """清空猫猫记忆，不传 cat_id 则清空所有"""
-    conn = _get_conn()
+    with _write_conn() as conn:
+        if cat_id:
+            conn.execute("DELETE FROM cat_memories WHERE cat_id = ?", (cat_id,))
+        else:
+            conn.execute("DELETE FROM cat_memories")
+    _memory_cache.invalidate(cat_id or None)
     if cat_id:
-        conn.execute("DELETE FROM cat_memories WHERE cat_id = ?", (cat_id,))
+        _memory_index.remove_group(cat_id)
     else:
-        conn.execute("DELETE FROM cat_memories")
-    conn.commit()
-    conn.close()
+        _memory_index.clear()
 
 
 # ═══════════════════════════════════════════════════════════════════════
@@ -432,38 +1924,58 @@ def set_user_info(key: str, value: str):
         key: 信息类型 (如 name, preference, project 等)
         value: 信息内容
     """
-    conn = _get_conn()
-    conn.execute(
-        "INSERT OR REPLACE INTO user_profile (key, value, updated_at) VALUES (?, ?, ?)",
-        (key, value, time.time()),
-    )
-    conn.commit()
-    conn.close()
+    with _write_conn() as conn:
+        # ON CONFLICT 原地更新，rowid 不变，语义索引里按 rowid 覆盖向量即可
+        conn.execute(
+            "INSERT INTO user_profile (key, value, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+            (key, value, time.time()),
+        )
+        rowid = conn.execute("SELECT rowid FROM user_profile WHERE key = ?", (key,)).fetchone()[0]
+    _profile_cache.update(_PROFILE_GROUP, lambda profile: {**profile, rowid: (key, value)})
+    _profile_index.upsert(rowid, _PROFILE_GROUP, f"{key}: {value}")
 
 
 def get_user_info(key: str) -> Optional[str]:
     """获取用户信息"""
-    conn = _get_conn()
-    row = conn.execute(
-        "SELECT value FROM user_profile WHERE key = ?", (key,)
-    ).fetchone()
-    conn.close()
-    return row["value"] if row else None
+    return get_all_user_info().get(key)
 
 
 def get_all_user_info() -> dict:
     """获取所有用户信息"""
-    conn = _get_conn()
-    rows = conn.execute("SELECT key, value FROM user_profile").fetchall()
-    conn.close()
-    return {r["key"]: r["value"] for r in rows}
+    return dict(_cached_user_profile().values())
+
+
+def get_relevant_user_info(query: str, limit: int = PROFILE_CONTEXT_LIMIT) -> dict:
+    """按与 query 的语义相似度挑选用户画像条目"""
+    _ensure_semantic_index()
+    hits = _profile_index.search(query, group=_PROFILE_GROUP, k=limit)
+    if not hits:
+        return {}
+    profile = _cached_user_profile()
+    return dict(profile[item_id] for item_id, _ in hits if item_id in profile)
+
 
+def format_user_profile_context(session_id: Optional[str] = None,
+                                query: Optional[str] = None,
+                                profile: Optional[dict] = None) -> str:
+    """格式化用户画像，给 LLM 用
 
-def format_user_profile_context() -> str:
-    """格式化用户画像，给 LLM 用"""
-    profile = get_all_user_info()
+    画像条目不多时全部带上；超过 PROFILE_CONTEXT_LIMIT 条且传了 query
+    （或 session_id，此时用最近几条消息作为 query）时，只带最相关的几条。
+
+    Args:
+        profile: 已经读好的画像（例如来自上下文快照），不传则读取当前画像
+    """
+    if profile is None:
+        profile = get_all_user_info()
     if not profile:
         return ""
+    if len(profile) > PROFILE_CONTEXT_LIMIT and (query is not None or session_id):
+        if query is None:
+            query = _recent_query_text(session_id)
+        relevant = get_relevant_user_info(query)
+        profile = {k: v for k, v in profile.items() if k in relevant} or profile
 
     lines = ["用户画像"]
     for key, value in profile.items():
@@ -474,18 +1986,72 @@ def format_user_profile_context() -> str:
 
 def clear_user_profile():
     """清空用户画像"""
-    conn = _get_conn()
-    conn.execute("DELETE FROM user_profile")
-    conn.commit()
-    conn.close()
+    with _write_conn() as conn:
+        conn.execute("DELETE FROM user_profile")
+    _profile_cache.invalidate()
+    _profile_index.clear()
 
 
 # ═══════════════════════════════════════════════════════════════════════
 # 猫猫使用统计
 # ═══════════════════════════════════════════════════════════════════════
 
-def add_cat_usage(cat_id: str, usage_data: dict):
-    """记录猫猫使用统计
+ALL_CAT_IDS = ["arch", "stack", "pixel"]
+
+# 使用统计版本号：每次 add_cat_usage 提交后 +1，供统计缓存判断是否失效
+_usage_version = 0
+_usage_updated_at = time.time()
+
+
+def get_usage_version() -> tuple[int, float]:
+    """返回 (使用统计版本号, 最后一次写入的时间戳)"""
+    return _usage_version, _usage_updated_at
+
+
+def _bump_usage_version():
+    global _usage_version, _usage_updated_at
+    _usage_version += 1
+    _usage_updated_at = time.time()
+
+_USAGE_SUM_COLUMNS = (
+    "input_tokens", "output_tokens",
+    "cache_read_tokens", "cache_creation_tokens",
+    "cost_usd", "call_count",
+)
+
+
+def _insert_usage(conn: sqlite3.Connection, cat_id: str, values: tuple,
+                  hour_slot: str, date_slot: str, timestamp: float):
+    """写入一条原始使用记录，并累加到按小时 / 按天汇总表"""
+    conn.execute("""
+        INSERT INTO cat_usage
+        (cat_id, input_tokens, output_tokens,
+         cache_read_tokens, cache_creation_tokens, cost_usd,
+         hour_slot, date_slot, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (cat_id, *values, hour_slot, date_slot, timestamp))
+
+    for table, slot_col, slot in (("cat_usage_hourly", "hour_slot", hour_slot),
+                                  ("cat_usage_daily", "date_slot", date_slot)):
+        conn.execute(f"""
+            INSERT INTO {table}
+            ({slot_col}, cat_id, input_tokens, output_tokens,
+             cache_read_tokens, cache_creation_tokens, cost_usd, call_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT ({slot_col}, cat_id) DO UPDATE SET
+                input_tokens = {table}.input_tokens + excluded.input_tokens,
+                output_tokens = {table}.output_tokens + excluded.output_tokens,
+                cache_read_tokens = {table}.cache_read_tokens + excluded.cache_read_tokens,
+                cache_creation_tokens = {table}.cache_creation_tokens + excluded.cache_creation_tokens,
+                cost_usd = {table}.cost_usd + excluded.cost_usd,
+                call_count = {table}.call_count + 1
+        """, (slot, cat_id, *values))
+
+
+def add_cat_usage(cat_id: str, usage_data: dict) -> Future:
+    """记录猫猫使用统计（进入写队列，合并提交）
+
+    原始记录和按小时 / 按天汇总表在同一个事务里更新。
 
     Args:
         cat_id: 猫猫ID (arch/stack/pixel)
@@ -496,24 +2062,40 @@ def add_cat_usage(cat_id: str, usage_data: dict):
     hour_slot = dt.strftime("%Y-%m-%d-%H")
     date_slot = dt.strftime("%Y-%m-%d")
 
-    conn = _get_conn()
-    conn.execute("""
-        INSERT INTO cat_usage
-        (cat_id, input_tokens, output_tokens,
-         cache_read_tokens, cache_creation_tokens, cost_usd,
-         hour_slot, date_slot, timestamp)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        cat_id,
+    values = (
         usage_data.get("inputTokens", 0),
         usage_data.get("outputTokens", 0),
         usage_data.get("cacheReadInputTokens", 0),
         usage_data.get("cacheCreationInputTokens", 0),
         usage_data.get("costUSD", 0),
-        hour_slot, date_slot, now
-    ))
-    conn.commit()
-    conn.close()
+    )
+
+    def _op(conn: sqlite3.Connection):
+        _insert_usage(conn, cat_id, values, hour_slot, date_slot, now)
+
+    # 事务提交后才让统计缓存失效，避免缓存读到旧数据却记成新版本
+    return _storage.submit(_op, on_commit=_bump_usage_version)
+
+
+def _usage_range(range_type: str) -> tuple[str, str, str]:
+    """根据时间范围选择汇总表，返回 (表名, 时间槽列, 起始时间槽)
+
+    - day: 当天（今天 0 点起），按小时汇总表
+    - week: 最近 7 个自然日（含今天），按天汇总表
+    - month: 最近 30 个自然日（含今天），按天汇总表
+
+    统计和趋势（get_trend）共用这里的起点，两边的范围总是一致。
+    """
+    now = datetime.now()
+    if range_type == "day":
+        return "cat_usage_hourly", "hour_slot", now.strftime("%Y-%m-%d-00")
+    days = 7 if range_type == "week" else 30
+    start = datetime.fromtimestamp(now.timestamp() - (days - 1) * 24 * 60 * 60)
+    return "cat_usage_daily", "date_slot", start.strftime("%Y-%m-%d")
+
+
+def _empty_stats() -> dict:
+    return {col: 0 for col in _USAGE_SUM_COLUMNS}
 
 
 def get_cat_stats(cat_id: str, range_type: str = "day") -> dict:
@@ -523,38 +2105,46 @@ def get_cat_stats(cat_id: str, range_type: str = "day") -> dict:
         cat_id: 猫猫ID (arch/stack/pixel)
         range_type: 时间范围 (day/week/month)
     """
-    conn = _get_conn()
-
-    # 根据时间范围计算时间戳
-    now = time.time()
-    if range_type == "day":
-        start_ts = now - 24 * 60 * 60
-    elif range_type == "week":
-        start_ts = now - 7 * 24 * 60 * 60
-    else:  # month
-        start_ts = now - 30 * 24 * 60 * 60
-
-    row = conn.execute("""
-        SELECT
-            COALESCE(SUM(input_tokens), 0) as input_tokens,
-            COALESCE(SUM(output_tokens), 0) as output_tokens,
-            COALESCE(SUM(cache_read_tokens), 0) as cache_read_tokens,
-            COALESCE(SUM(cache_creation_tokens), 0) as cache_creation_tokens,
-            COALESCE(SUM(cost_usd), 0) as cost_usd,
-            COUNT(*) as call_count
-        FROM cat_usage WHERE cat_id = ? AND timestamp >= ?
-    """, (cat_id, start_ts)).fetchone()
-    conn.close()
-    return dict(row) if row else {}
+    table, slot_col, start_slot = _usage_range(range_type)
+    with _read_conn() as conn:
+        row = conn.execute(f"""
+            SELECT
+                COALESCE(SUM(input_tokens), 0) as input_tokens,
+                COALESCE(SUM(output_tokens), 0) as output_tokens,
+                COALESCE(SUM(cache_read_tokens), 0) as cache_read_tokens,
+                COALESCE(SUM(cache_creation_tokens), 0) as cache_creation_tokens,
+                COALESCE(SUM(cost_usd), 0) as cost_usd,
+                COALESCE(SUM(call_count), 0) as call_count
+            FROM {table} WHERE {slot_col} >= ? AND cat_id = ?
+        """, (start_slot, cat_id)).fetchone()
+    return dict(row) if row else _empty_stats()
 
 
 def get_all_cats_stats(range_type: str = "day") -> dict:
-    """获取所有猫猫的统计
+    """获取所有猫猫的统计（一次查询汇总表）
 
     Args:
         range_type: 时间范围 (day/week/month)
     """
-    return {cat_id: get_cat_stats(cat_id, range_type) for cat_id in ["arch", "stack", "pixel"]}
+    table, slot_col, start_slot = _usage_range(range_type)
+    with _read_conn() as conn:
+        rows = conn.execute(f"""
+            SELECT cat_id,
+                SUM(input_tokens) as input_tokens,
+                SUM(output_tokens) as output_tokens,
+                SUM(cache_read_tokens) as cache_read_tokens,
+                SUM(cache_creation_tokens) as cache_creation_tokens,
+                SUM(cost_usd) as cost_usd,
+                SUM(call_count) as call_count
+            FROM {table} WHERE {slot_col} >= ?
+            GROUP BY cat_id
+        """, (start_slot,)).fetchall()
+
+    stats = {cat_id: _empty_stats() for cat_id in ALL_CAT_IDS}
+    for r in rows:
+        if r["cat_id"] in stats:
+            stats[r["cat_id"]] = {col: r[col] for col in _USAGE_SUM_COLUMNS}
+    return stats
 
 
 def get_trend(range_type: str = "day") -> list:
@@ -569,77 +2159,116 @@ def get_trend(range_type: str = "day") -> list:
     Returns:
         list of dict: 每个时间点的各猫猫统计数据
     """
-    conn = _get_conn()
+    _, _, start_slot = _usage_range(range_type)
+    with _read_conn() as conn:
+        if range_type == "day":
+            # 当天按小时
+            rows = conn.execute("""
+                SELECT hour_slot, cat_id, input_tokens, output_tokens, cost_usd
+                FROM cat_usage_hourly
+                WHERE hour_slot >= ?
+                ORDER BY hour_slot
+            """, (start_slot,)).fetchall()
+        else:
+            # 7天 / 30天按天
+            rows = conn.execute("""
+                SELECT date_slot as time_slot, cat_id, input_tokens, output_tokens, cost_usd
+                FROM cat_usage_daily
+                WHERE date_slot >= ?
+                ORDER BY date_slot
+            """, (start_slot,)).fetchall()
+    return [dict(r) for r in rows]
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# CLI 会话 id
+# ═══════════════════════════════════════════════════════════════════════
+
+# 猫猫在 thread 里第一次发消息给 CLI 之后记下用的 CLI 会话 id（见 cats.CatAgent），
+# app 重启后按它 --resume，预热进程的随机 id 也不会丢。
+
+def get_cli_session(cat_id: str, session_id: str) -> tuple[Optional[str], bool]:
+    """返回 (记下的 CLI 会话 id，没有为 None, 猫猫是否在这个 thread 发过言)
+
+    没有记录却发过言的是记录 CLI 会话 id 之前的老 thread，用的是按 thread
+    生成的确定性 id。
+    """
+    with _read_conn() as conn:
+        row = conn.execute(
+            "SELECT cli_session_id FROM cli_sessions WHERE cat_id = ? AND session_id = ?",
+            (cat_id, session_id),
+        ).fetchone()
+        if row:
+            return row["cli_session_id"], True
+        spoke = conn.execute(
+            "SELECT 1 FROM cat_last_spoke WHERE cat_id = ? AND session_id = ?",
+            (cat_id, session_id),
+        ).fetchone()
+    return None, spoke is not None
+
+
+def set_cli_session(cat_id: str, session_id: str, cli_session_id: str) -> Future:
+    """记下 thread 对应的 CLI 会话 id（进入写队列，合并提交）"""
     now = time.time()
 
-    if range_type == "day":
-        # 当天按小时
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        rows = conn.execute("""
-            SELECT hour_slot, cat_id,
-                   SUM(input_tokens) as input_tokens,
-                   SUM(output_tokens) as output_tokens,
-                   SUM(cost_usd) as cost_usd
-            FROM cat_usage
-            WHERE date_slot = ?
-            GROUP BY hour_slot, cat_id
-            ORDER BY hour_slot
-        """, (date_str,)).fetchall()
-    elif range_type == "week":
-        # 7天按天
-        start_ts = now - 7 * 24 * 60 * 60
-        rows = conn.execute("""
-            SELECT date_slot as time_slot, cat_id,
-                   SUM(input_tokens) as input_tokens,
-                   SUM(output_tokens) as output_tokens,
-                   SUM(cost_usd) as cost_usd
-            FROM cat_usage
-            WHERE timestamp >= ?
-            GROUP BY date_slot, cat_id
-            ORDER BY date_slot
-        """, (start_ts,)).fetchall()
-    else:  # month
-        # 30天按天
-        start_ts = now - 30 * 24 * 60 * 60
-        rows = conn.execute("""
-            SELECT date_slot as time_slot, cat_id,
-                   SUM(input_tokens) as input_tokens,
-                   SUM(output_tokens) as output_tokens,
-                   SUM(cost_usd) as cost_usd
-            FROM cat_usage
-            WHERE timestamp >= ?
-            GROUP BY date_slot, cat_id
-            ORDER BY date_slot
-        """, (start_ts,)).fetchall()
+    def _op(conn: sqlite3.Connection):
+        conn.execute("""
+            INSERT INTO cli_sessions (cat_id, session_id, cli_session_id, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (cat_id, session_id) DO UPDATE SET
+                cli_session_id = excluded.cli_session_id,
+                updated_at = excluded.updated_at
+        """, (cat_id, session_id, cli_session_id, now))
 
-    conn.close()
-    return [dict(r) for r in rows]
+    return _storage.submit(_op)
 
 
 # ═══════════════════════════════════════════════════════════════════════
 # 猫猫发言时间戳（增量读取）
 # ═══════════════════════════════════════════════════════════════════════
 
-def update_cat_last_spoke(cat_id: str, session_id: str):
-    """更新猫猫发言时间戳"""
-    conn = _get_conn()
+# 高水位 = 猫猫上次发言时会话里最后一条消息的 id，之后的消息就是它错过的。
+# 猫猫回复时由 add_message(cat_id=...) 顺带推进；跳过发言时用 update_cat_last_spoke。
+
+def _set_last_spoke(conn: sqlite3.Connection, cat_id: str, session_id: str,
+                    message_id: int, now: float):
     conn.execute("""
-        INSERT OR REPLACE INTO cat_last_spoke (cat_id, session_id, last_spoke_at)
-        VALUES (?, ?, ?)
-    """, (cat_id, session_id, time.time()))
-    conn.commit()
-    conn.close()
+        INSERT INTO cat_last_spoke (cat_id, session_id, last_spoke_at, last_message_id)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (cat_id, session_id) DO UPDATE SET
+            last_spoke_at = excluded.last_spoke_at,
+            last_message_id = excluded.last_message_id
+    """, (cat_id, session_id, now, message_id))
 
 
-def get_cat_last_spoke(cat_id: str, session_id: str) -> Optional[float]:
-    """获取猫猫上次发言时间戳，没有记录返回 None"""
-    conn = _get_conn()
-    row = conn.execute(
-        "SELECT last_spoke_at FROM cat_last_spoke WHERE cat_id = ? AND session_id = ?",
-        (cat_id, session_id),
-    ).fetchone()
-    conn.close()
-    return row["last_spoke_at"] if row else None
+def update_cat_last_spoke(cat_id: str, session_id: str) -> Future:
+    """把猫猫的发言高水位推进到会话当前最后一条消息（进入写队列，合并提交）"""
+    now = time.time()
+
+    def _op(conn: sqlite3.Connection):
+        row = conn.execute(
+            f"SELECT MAX(id) FROM chat_messages WHERE session_key = {_SESSION_KEY}", (session_id,),
+        ).fetchone()
+        last_id = row[0]
+        if last_id is None:
+            # 热表为空（全部归档或还没有消息）
+            row = conn.execute(
+                "SELECT MAX(last_id) FROM chat_archive WHERE session_id = ?", (session_id,),
+            ).fetchone()
+            last_id = row[0] or 0
+        _set_last_spoke(conn, cat_id, session_id, last_id, now)
+
+    return _storage.submit(_op)
+
+
+def get_cat_last_spoke(cat_id: str, session_id: str) -> Optional[int]:
+    """获取猫猫的发言高水位（消息 id），从没发过言返回 None"""
+    with _read_conn(barrier=True) as conn:
+        row = conn.execute(
+            "SELECT last_message_id FROM cat_last_spoke WHERE cat_id = ? AND session_id = ?",
+            (cat_id, session_id),
+        ).fetchone()
+    return row["last_message_id"] if row else None
 
 
 def clear_cat_last_spoke(session_id: str = None, cat_id: str = None):
@@ -649,91 +2278,98 @@ def clear_cat_last_spoke(session_id: str = None, cat_id: str = None):
         session_id: 清空指定会话的记录，None 表示所有会话
         cat_id: 清空指定猫猫的记录，None 表示所有猫猫
     """
-    conn = _get_conn()
-    if session_id and cat_id:
-        conn.execute("DELETE FROM cat_last_spoke WHERE session_id = ? AND cat_id = ?", (session_id, cat_id))
-    elif session_id:
-        conn.execute("DELETE FROM cat_last_spoke WHERE session_id = ?", (session_id,))
-    elif cat_id:
-        conn.execute("DELETE FROM cat_last_spoke WHERE cat_id = ?", (cat_id,))
-    else:
-        conn.execute("DELETE FROM cat_last_spoke")
-    conn.commit()
-    conn.close()
+    with _write_conn() as conn:
+        if session_id and cat_id:
+            conn.execute("DELETE FROM cat_last_spoke WHERE session_id = ? AND cat_id = ?", (session_id, cat_id))
+        elif session_id:
+            conn.execute("DELETE FROM cat_last_spoke WHERE session_id = ?", (session_id,))
+        elif cat_id:
+            conn.execute("DELETE FROM cat_last_spoke WHERE cat_id = ?", (cat_id,))
+        else:
+            conn.execute("DELETE FROM cat_last_spoke")
 
 
 # ═══════════════════════════════════════════════════════════════════════
 # 会话摘要（冷启动用）
 # ═══════════════════════════════════════════════════════════════════════
 
-def get_session_summary(session_id: str) -> Optional[dict]:
-    """获取会话摘要"""
-    import json as _json
-    conn = _get_conn()
+def _load_session_summary(conn: sqlite3.Connection, session_id: str) -> Optional[dict]:
     row = conn.execute(
         "SELECT summary, key_goals, key_decisions, updated_at FROM session_summaries WHERE session_id = ?",
         (session_id,),
     ).fetchone()
-    conn.close()
     if not row:
         return None
     return {
         "summary": row["summary"],
-        "key_goals": _json.loads(row["key_goals"]) if row["key_goals"] else [],
-        "key_decisions": _json.loads(row["key_decisions"]) if row["key_decisions"] else [],
+        "key_goals": json.loads(row["key_goals"]) if row["key_goals"] else [],
+        "key_decisions": json.loads(row["key_decisions"]) if row["key_decisions"] else [],
         "updated_at": row["updated_at"],
     }
 
 
+def get_session_summary(session_id: str) -> Optional[dict]:
+    """获取会话摘要"""
+    with _read_conn() as conn:
+        return _load_session_summary(conn, session_id)
+
+
 def update_session_summary(session_id: str, summary: str, goals: list[str] = None, decisions: list[str] = None):
     """更新会话摘要"""
-    import json as _json
-    conn = _get_conn()
-    conn.execute("""
-        INSERT OR REPLACE INTO session_summaries (session_id, summary, key_goals, key_decisions, updated_at)
-        VALUES (?, ?, ?, ?, ?)
-    """, (
-        session_id,
-        summary,
-        _json.dumps(goals or [], ensure_ascii=False),
-        _json.dumps(decisions or [], ensure_ascii=False),
-        time.time(),
-    ))
-    conn.commit()
-    conn.close()
+    with _write_conn() as conn:
+        conn.execute("""
+            INSERT INTO session_summaries (session_id, summary, key_goals, key_decisions, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (session_id) DO UPDATE SET
+                summary = excluded.summary,
+                key_goals = excluded.key_goals,
+                key_decisions = excluded.key_decisions,
+                updated_at = excluded.updated_at
+        """, (
+            session_id,
+            summary,
+            json.dumps(goals or [], ensure_ascii=False),
+            json.dumps(decisions or [], ensure_ascii=False),
+            time.time(),
+        ))
 
 
 def delete_session_summary(session_id: str):
     """删除会话摘要"""
-    conn = _get_conn()
-    conn.execute("DELETE FROM session_summaries WHERE session_id = ?", (session_id,))
-    conn.commit()
-    conn.close()
+    with _write_conn() as conn:
+        conn.execute("DELETE FROM session_summaries WHERE session_id = ?", (session_id,))
 
 
 # ═══════════════════════════════════════════════════════════════════════
 # 增量对话历史
 # ═══════════════════════════════════════════════════════════════════════
 
-def get_messages_since(timestamp: float, session_id: str, exclude_role: str = None) -> list[dict]:
-    """获取指定时间后的消息，可选排除特定角色"""
-    conn = _get_conn()
-    if exclude_role:
-        rows = conn.execute(
-            "SELECT role, content, timestamp FROM chat_history "
-            "WHERE session_id = ? AND timestamp > ? AND role != ? "
-            "ORDER BY timestamp ASC",
-            (session_id, timestamp, exclude_role),
-        ).fetchall()
-    else:
-        rows = conn.execute(
-            "SELECT role, content, timestamp FROM chat_history "
-            "WHERE session_id = ? AND timestamp > ? "
-            "ORDER BY timestamp ASC",
-            (session_id, timestamp),
-        ).fetchall()
-    conn.close()
-    return [{"role": r["role"], "content": r["content"], "timestamp": r["timestamp"]} for r in rows]
+def _messages_after_id(conn: sqlite3.Connection, session_id: str, message_id: int) -> list[dict]:
+    """会话里 id 大于 message_id 的消息（归档 + 热数据），按 id 正序
+
+    热表部分是 (session_key, id) 索引上的一次范围扫描。
+    """
+    rows = [dict(r) for r in conn.execute(
+        _MESSAGE_SELECT +
+        f"WHERE m.session_key = {_SESSION_KEY} AND m.id > ? ORDER BY m.id ASC",
+        (session_id, message_id),
+    ).fetchall()]
+    # 很久没发言的猫猫，起点可能已经落进归档
+    archived = _archived_messages(conn, session_id, after_id=message_id)
+    if archived:
+        rows = sorted(archived, key=lambda m: m["id"]) + rows
+    return rows
+
+
+def get_messages_since(message_id: int, session_id: str, exclude_role: str = None) -> list[dict]:
+    """获取 id 大于 message_id 的消息，可选排除特定角色"""
+    with _read_conn(barrier=True) as conn:
+        rows = _messages_after_id(conn, session_id, message_id)
+    return [
+        {"id": r["id"], "role": r["role"], "content": r["content"], "timestamp": r["timestamp"]}
+        for r in rows
+        if not exclude_role or r["role"] != exclude_role
+    ]
 
 
 def format_chat_context_since(cat_id: str, cat_name: str, session_id: str = "default") -> tuple[str, bool]:
@@ -785,49 +2421,643 @@ def _format_summary_context(summary: dict) -> str:
 
 
 # ═══════════════════════════════════════════════════════════════════════
-# 调试工具
+# 每轮上下文快照
 # ═══════════════════════════════════════════════════════════════════════
 
-def print_all_memories():
-    """打印所有记忆（调试用）"""
-    conn = _get_conn()
+# 一轮群聊里几只猫猫依次回复，各自的 prompt 需要的数据几乎相同：画像、摘要、
+# 发言时间戳和最近一段消息。每轮开始时在一个读事务里把它们一次读好，
+# 每只猫猫在内存里切出自己的增量部分；本轮前面的猫猫回复后由调用方
+# 追加进快照，后面的猫猫照样能看到。
+
+@dataclass
+class ContextSnapshot:
+    """一轮群聊开始时的会话上下文"""
+    session_id: str
+    profile: dict
+    summary: Optional[dict]
+    last_spoke: dict[str, int]    # cat_id → 发言高水位（消息 id）
+    # 最近 MEMORY_QUERY_MESSAGES 条和本轮猫猫上次发言之后的全部消息，按时间正序
+    messages: list[dict] = field(default_factory=list)
+
+    def add_message(self, role: str, content: str, message_id: Optional[int] = None):
+        """追加本轮新产生的消息（数据库写入另走写队列）
+
+        写队列还没提交时拿不到 id，此时 id 为 None，视为比快照里所有消息都新。
+        """
+        self.messages.append(
+            {"id": message_id, "role": role, "content": content, "timestamp": time.time()}
+        )
+
+    def mark_spoke(self, cat_id: str):
+        """把猫猫的高水位推进到快照里已知的最后一条消息"""
+        ids = [m["id"] for m in self.messages if m["id"] is not None]
+        self.last_spoke[cat_id] = max(ids, default=self.last_spoke.get(cat_id, 0))
+
+    def query_text(self) -> str:
+        """最近几条消息拼起来，作为挑选记忆 / 画像的查询"""
+        return "\n".join(m["content"] for m in self.messages[-MEMORY_QUERY_MESSAGES:])
+
+    def chat_context_since(self, cat_id: str, cat_name: str) -> tuple[str, bool]:
+        """与 format_chat_context_since 相同，只是从快照里取数据"""
+        since = self.last_spoke.get(cat_id)
+        if since is None:
+            if self.summary:
+                return _format_summary_context(self.summary), True
+            return "", True
+
+        messages = [
+            m for m in self.messages
+            if (m["id"] is None or m["id"] > since) and m["role"] != cat_name
+        ]
+        return "\n".join(f"{m['role']}：{m['content']}" for m in messages), False
+
+
+def get_context_snapshot(session_id: str, cat_ids: list[str]) -> ContextSnapshot:
+    """在一个读事务里读出本轮所有猫猫组装 prompt 需要的数据"""
+    with _read_conn(barrier=True) as conn:
+        conn.execute("BEGIN")
+        try:
+            ph = ",".join("?" * len(cat_ids))
+            last_spoke = {
+                r["cat_id"]: r["last_message_id"] for r in conn.execute(
+                    f"SELECT cat_id, last_message_id FROM cat_last_spoke WHERE session_id = ? AND cat_id IN ({ph})",
+                    (session_id, *cat_ids),
+                ).fetchall()
+            } if cat_ids else {}
+            summary = _load_session_summary(conn, session_id)
+
+            rows = [dict(r) for r in conn.execute(
+                _MESSAGE_SELECT +
+                f"WHERE m.session_key = {_SESSION_KEY} ORDER BY m.timestamp DESC, m.id DESC LIMIT ?",
+                (session_id, MEMORY_QUERY_MESSAGES),
+            ).fetchall()]
+            if len(rows) < MEMORY_QUERY_MESSAGES:
+                rows = _merge_newest_first(
+                    rows, _archived_messages(conn, session_id, limit=MEMORY_QUERY_MESSAGES),
+                    MEMORY_QUERY_MESSAGES,
+                )
+
+            if last_spoke:
+                since = min(last_spoke.values())
+                seen = {r["id"] for r in rows}
+                rows += [m for m in _messages_after_id(conn, session_id, since) if m["id"] not in seen]
+        finally:
+            conn.rollback()
+
+    rows.sort(key=lambda m: m["id"])
+    return ContextSnapshot(
+        session_id=session_id,
+        profile=get_all_user_info(),
+        summary=summary,
+        last_spoke=last_spoke,
+        messages=[
+            {"id": r["id"], "role": r["role"], "content": r["content"], "timestamp": r["timestamp"]}
+            for r in rows
+        ],
+    )
 
-    print("\n=== 猫猫记忆 ===")
-    rows = conn.execute(
-        "SELECT cat_id, memory, importance FROM cat_memories ORDER BY cat_id, importance DESC"
-    ).fetchall()
-    if rows:
-        for r in rows:
-            print(f"  [{r['cat_id']}] ({r['importance']}) {r['memory']}")
-    else:
-        print("  (空)")
 
-    print("\n=== 用户画像 ===")
-    rows = conn.execute("SELECT key, value FROM user_profile").fetchall()
-    if rows:
+def format_snapshot_context(snapshot: ContextSnapshot, cat_id: str,
+                            cat_name: str) -> tuple[str, str, str, bool]:
+    """从快照组装一只猫猫的上下文，不再读数据库里的对话 / 摘要 / 画像
+
+    Returns:
+        (记忆, 用户画像, 对话历史, 是否是冷启动)
+    """
+    query = snapshot.query_text()
+    chat_ctx, is_cold_start = snapshot.chat_context_since(cat_id, cat_name)
+    return (
+        format_cat_memory_context(cat_id, query=query),
+        format_user_profile_context(query=query, profile=snapshot.profile),
+        chat_ctx,
+        is_cold_start,
+    )
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 数据库维护（由 maintenance.py 定期调用）
+# ═══════════════════════════════════════════════════════════════════════
+#
+# 这些操作只对 SQLite 有意义；PostgreSQL 由服务端的 autovacuum / autoanalyze
+# 负责，除孤儿清理外都直接跳过。
+
+def checkpoint_wal() -> Optional[tuple[int, int, int]]:
+    """把 WAL 写回主库并截断 WAL 文件
+
+    Returns:
+        (busy, WAL 页数, 已写回页数)；有读者占着旧快照时 busy=1，只写回了一部分
+    """
+    if _storage.dialect != "sqlite":
+        return None
+    with _write_conn() as conn:
+        row = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    return tuple(row)
+
+
+def optimize_db():
+    """更新查询规划器统计信息（SQLite 只重新分析确实需要的表）"""
+    if _storage.dialect != "sqlite":
+        return
+    with _write_conn() as conn:
+        conn.execute("PRAGMA optimize")
+
+
+def incremental_vacuum(max_pages: int = VACUUM_MAX_PAGES) -> int:
+    """归还空闲页给文件系统，返回释放前的空闲页数
+
+    每次最多回收 max_pages 页，不会长时间占住写锁。数据库不是
+    auto_vacuum=INCREMENTAL 模式时什么都不做（见 enable_incremental_vacuum）。
+    """
+    if _storage.dialect != "sqlite":
+        return 0
+    with _write_conn() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            _log("[MeowDev] 数据库不是增量 VACUUM 模式，跳过（停服后执行 python -m memory vacuum 切换）")
+            return 0
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if free:
+            conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})")
+    return free
+
+
+def enable_incremental_vacuum() -> bool:
+    """把旧库切换为 auto_vacuum=INCREMENTAL，返回是否做了切换
+
+    需要整体 VACUUM 重写整个数据库文件，期间一直占着写锁，只在停服时
+    通过 python -m memory vacuum 执行；新库建表时已经是这个模式。
+    """
+    if _storage.dialect != "sqlite":
+        return False
+    with _write_conn() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    _log("[MeowDev] 数据库已切换为增量 VACUUM 模式")
+    return True
+
+
+def cleanup_orphans() -> int:
+    """清理会话已不存在的附属记录（发言高水位、摘要、CLI 会话 id），返回删除行数"""
+    with _exclusive_job("orphan_cleanup") as acquired:
+        if not acquired:
+            return 0
+        with _write_conn() as conn:
+            removed = 0
+            for table in ("cat_last_spoke", "session_summaries", "cli_sessions"):
+                removed += conn.execute(
+                    f"DELETE FROM {table} WHERE NOT EXISTS "
+                    f"(SELECT 1 FROM sessions s WHERE s.id = {table}.session_id)"
+                ).rowcount
+    if removed:
+        _log(f"[MeowDev] 清理了 {removed} 条孤儿记录")
+    return removed
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 导出 / 导入（JSONL）
+# ═══════════════════════════════════════════════════════════════════════
+#
+# 每行一个 JSON 记录，"type" 字段区分种类，顺序为：
+#   meta → 每个会话（session → summary → last_spoke* → message*）→ memory* → profile* → usage*
+# 同一会话的记录连续出现，消息按 (timestamp, id) 正序，热表和归档块边读边合并。
+#
+# 导出在一个只读事务里按 EXPORT_BATCH_ROWS 键集分页查询（一致快照），
+# 导入每 IMPORT_BATCH_RECORDS 条记录一个写事务，内存占用都与数据量无关。
+# 消息在目标库里会分配新的 id，发言高水位按"源 id 不超过高水位的最后一条消息"换算。
+
+EXPORT_FORMAT = "meowdev-export"
+EXPORT_VERSION = 1
+
+
+def _iter_keyset(conn: sqlite3.Connection, sql: str, key: str, start: Any,
+                 batch: int, params: tuple = ()) -> Iterator[dict]:
+    """键集分页逐批读取：sql 的最后两个占位符依次是 "key > ?" 和 "LIMIT ?" """
+    after = start
+    while True:
+        rows = conn.execute(sql, (*params, after, batch)).fetchall()
         for r in rows:
-            print(f"  {r['key']}: {r['value']}")
-    else:
-        print("  (空)")
+            yield dict(r)
+        if len(rows) < batch:
+            return
+        after = rows[-1][key]
+
+
+def _export_messages(conn: sqlite3.Connection, session_id: str, batch: int) -> Iterator[dict]:
+    """会话的全部消息（归档 + 热数据），按 (timestamp, id) 正序逐条产出"""
+
+    def hot():
+        after = None
+        while True:
+            sql = _MESSAGE_SELECT + f"WHERE m.session_key = {_SESSION_KEY}"
+            params: list = [session_id]
+            if after is not None:
+                sql += " AND (m.timestamp, m.id) > (?, ?)"
+                params.extend(after)
+            rows = conn.execute(sql + " ORDER BY m.timestamp, m.id LIMIT ?", (*params, batch)).fetchall()
+            for r in rows:
+                yield dict(r)
+            if len(rows) < batch:
+                return
+            after = (rows[-1]["timestamp"], rows[-1]["id"])
+
+    def archived():
+        # 归档块按时间先后生成，块内已按 (timestamp, id) 排好；每次只解压一小批块
+        after = None
+        blocks_per_batch = max(1, batch // ARCHIVE_BLOCK_MESSAGES)
+        while True:
+            sql = "SELECT id, first_ts, data FROM chat_archive WHERE session_id = ?"
+            params: list = [session_id]
+            if after is not None:
+                sql += " AND (first_ts, id) > (?, ?)"
+                params.extend(after)
+            blocks = conn.execute(sql + " ORDER BY first_ts, id LIMIT ?", (*params, blocks_per_batch)).fetchall()
+            for block in blocks:
+                yield from sorted(_decode_archive_block(block["data"], session_id),
+                                  key=lambda m: (m["timestamp"], m["id"]))
+            if len(blocks) < blocks_per_batch:
+                return
+            after = (blocks[-1]["first_ts"], blocks[-1]["id"])
+
+    for m in heapq.merge(archived(), hot(), key=lambda m: (m["timestamp"], m["id"])):
+        yield {
+            "type": "message", "session_id": session_id, "id": m["id"],
+            "role": m["role"], "content": m["content"], "timestamp": m["timestamp"],
+        }
 
-    print("\n=== 最近对话 ===")
-    rows = conn.execute(
-        "SELECT role, content FROM chat_history ORDER BY timestamp DESC LIMIT 10"
-    ).fetchall()
-    if rows:
-        for r in reversed(rows):
-            content = r['content'][:50] + "..." if len(r['content']) > 50 else r['content']
-            print(f"  {r['role']}: {content}")
+
+def _export_session(conn: sqlite3.Connection, session: dict, batch: int) -> Iterator[dict]:
+    session_id = session["id"]
+    yield {"type": "session", **session}
+    summary = _load_session_summary(conn, session_id)
+    if summary:
+        yield {"type": "summary", "session_id": session_id, **summary}
+    for r in conn.execute(
+        "SELECT cat_id, last_spoke_at, last_message_id FROM cat_last_spoke WHERE session_id = ? ORDER BY cat_id",
+        (session_id,),
+    ).fetchall():
+        yield {"type": "last_spoke", "session_id": session_id, **dict(r)}
+    yield from _export_messages(conn, session_id, batch)
+
+
+_SESSION_EXPORT_SELECT = "SELECT id, name, created_at, updated_at, is_archived FROM sessions "
+_USAGE_EXPORT_COLUMNS = (
+    "cat_id", "input_tokens", "output_tokens", "cache_read_tokens", "cache_creation_tokens",
+    "cost_usd", "hour_slot", "date_slot", "timestamp",
+)
+
+
+def iter_export(session_ids: Optional[Iterable[str]] = None,
+                include_global: bool = True,
+                batch: int = EXPORT_BATCH_ROWS) -> Iterator[dict]:
+    """逐条产出导出记录（dict），整个导出在同一个只读事务里完成
+
+    Args:
+        session_ids: 只导出这些会话，None 表示全部会话
+        include_global: 是否带上猫猫记忆、用户画像和使用统计
+        batch: 每次查询读取的行数
+    """
+    yield {
+        "type": "meta", "format": EXPORT_FORMAT, "version": EXPORT_VERSION,
+        "schema_version": SCHEMA_VERSION, "exported_at": time.time(),
+    }
+    with _read_conn(barrier=True) as conn:
+        conn.execute("BEGIN")
+        try:
+            if session_ids is None:
+                sessions = _iter_keyset(
+                    conn, _SESSION_EXPORT_SELECT + "WHERE id > ? ORDER BY id LIMIT ?", "id", "", batch,
+                )
+            else:
+                sessions = (
+                    dict(row) for row in (
+                        conn.execute(_SESSION_EXPORT_SELECT + "WHERE id = ?", (sid,)).fetchone()
+                        for sid in dict.fromkeys(session_ids)
+                    ) if row
+                )
+            for session in sessions:
+                yield from _export_session(conn, session, batch)
+
+            if not include_global:
+                return
+            for r in _iter_keyset(
+                conn,
+                "SELECT id, cat_id, memory, importance, hit_count, timestamp FROM cat_memories "
+                "WHERE id > ? ORDER BY id LIMIT ?",
+                "id", 0, batch,
+            ):
+                del r["id"]
+                yield {"type": "memory", **r}
+            for r in _iter_keyset(
+                conn, "SELECT key, value, updated_at FROM user_profile WHERE key > ? ORDER BY key LIMIT ?",
+                "key", "", batch,
+            ):
+                yield {"type": "profile", **r}
+            for r in _iter_keyset(
+                conn,
+                f"SELECT id, {', '.join(_USAGE_EXPORT_COLUMNS)} FROM cat_usage WHERE id > ? ORDER BY id LIMIT ?",
+                "id", 0, batch,
+            ):
+                del r["id"]
+                yield {"type": "usage", **r}
+        finally:
+            conn.rollback()
+
+
+def export_jsonl(out: TextIO, session_ids: Optional[Iterable[str]] = None,
+                 include_global: bool = True) -> int:
+    """把 iter_export 的记录逐行写进文本流，返回记录数"""
+    count = 0
+    for record in iter_export(session_ids, include_global):
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+@dataclass
+class _ImportSession:
+    """导入中的会话：已写入的消息数、发言高水位的换算"""
+    session_id: str
+    skipped: bool
+    last_spoke: dict[str, tuple[int, float]] = field(default_factory=dict)  # cat_id → (源高水位, 发言时间)
+    mapped: dict[str, int] = field(default_factory=dict)                    # cat_id → 目标库高水位
+    pending_messages: int = 0
+
+    def map_message(self, source_id: int, message_id: int):
+        for cat_id, (high_water, _) in self.last_spoke.items():
+            if source_id <= high_water and message_id > self.mapped.get(cat_id, 0):
+                self.mapped[cat_id] = message_id
+
+    def flush(self, conn: sqlite3.Connection):
+        """把消息数和换算后的高水位写进当前事务（每批提交前调用）"""
+        if self.skipped:
+            return
+        if self.pending_messages:
+            conn.execute(
+                "UPDATE sessions SET message_count = message_count + ? WHERE id = ?",
+                (self.pending_messages, self.session_id),
+            )
+            self.pending_messages = 0
+        for cat_id, (_, spoke_at) in self.last_spoke.items():
+            _set_last_spoke(conn, cat_id, self.session_id, self.mapped.get(cat_id, 0), spoke_at)
+
+
+# 跟在 session 记录后面、属于这个会话的记录
+_SESSION_CHILD_RECORDS = ("summary", "last_spoke", "message")
+
+
+def _import_record(conn: sqlite3.Connection, record: dict,
+                   current: Optional[_ImportSession], counts: dict[str, int]) -> Optional[_ImportSession]:
+    """导入一条记录，返回之后的当前会话"""
+    kind = record.get("type")
+
+    if kind == "meta":
+        if record.get("format") != EXPORT_FORMAT or record.get("version", 0) > EXPORT_VERSION:
+            raise ValueError(f"不支持的导出格式: {record.get('format')} v{record.get('version')}")
+        return current
+
+    if kind == "session":
+        if current is not None:
+            current.flush(conn)
+        session_id = record["id"]
+        # 已存在的会话整体跳过，同一文件重复导入不会产生重复消息
+        skipped = conn.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is not None
+        if skipped:
+            counts["skipped"] += 1
+        else:
+            conn.execute(
+                "INSERT INTO sessions (id, name, created_at, updated_at, message_count, is_archived) "
+                "VALUES (?, ?, ?, ?, 0, ?)",
+                (session_id, record["name"], record["created_at"], record["updated_at"],
+                 record.get("is_archived", 0)),
+            )
+            counts["session"] += 1
+        return _ImportSession(session_id, skipped)
+
+    if kind in _SESSION_CHILD_RECORDS:
+        if current is None or current.session_id != record["session_id"]:
+            raise ValueError(f"{kind} 记录出现在会话 {record['session_id']} 的 session 记录之外")
+        if current.skipped:
+            return current
+        if kind == "summary":
+            conn.execute("""
+                INSERT INTO session_summaries (session_id, summary, key_goals, key_decisions, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (session_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    key_goals = excluded.key_goals,
+                    key_decisions = excluded.key_decisions,
+                    updated_at = excluded.updated_at
+            """, (
+                current.session_id,
+                record["summary"],
+                json.dumps(record.get("key_goals") or [], ensure_ascii=False),
+                json.dumps(record.get("key_decisions") or [], ensure_ascii=False),
+                record["updated_at"],
+            ))
+        elif kind == "last_spoke":
+            current.last_spoke[record["cat_id"]] = (record["last_message_id"], record["last_spoke_at"])
+        else:
+            message_id = _insert_message(
+                conn, current.session_id, record["role"], record["content"], record["timestamp"],
+            )
+            current.map_message(record["id"], message_id)
+            current.pending_messages += 1
+        counts[kind] += 1
+        return current
+
+    if kind == "memory":
+        # 与目标库已有的同一条记忆合并：重要性、命中次数、时间都取较大的
+        conn.execute("""
+            INSERT INTO cat_memories (cat_id, memory, importance, timestamp, memory_hash, hit_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (cat_id, memory_hash) DO UPDATE SET
+                importance = CASE WHEN cat_memories.importance < excluded.importance
+                                  THEN excluded.importance ELSE cat_memories.importance END,
+                hit_count = CASE WHEN cat_memories.hit_count < excluded.hit_count
+                                 THEN excluded.hit_count ELSE cat_memories.hit_count END,
+                timestamp = CASE WHEN cat_memories.timestamp < excluded.timestamp
+                                 THEN excluded.timestamp ELSE cat_memories.timestamp END
+        """, (
+            record["cat_id"], record["memory"], record.get("importance", 1), record["timestamp"],
+            _memory_hash(record["memory"]), record.get("hit_count", 1),
+        ))
+    elif kind == "profile":
+        # 目标库里更新过的画像条目保留
+        conn.execute("""
+            INSERT INTO user_profile (key, value, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            WHERE user_profile.updated_at < excluded.updated_at
+        """, (record["key"], record["value"], record["updated_at"]))
+    elif kind == "usage":
+        # 原始使用记录没有业务主键，按 (猫猫, 时间戳) 去重
+        if conn.execute(
+            "SELECT 1 FROM cat_usage WHERE cat_id = ? AND timestamp = ?",
+            (record["cat_id"], record["timestamp"]),
+        ).fetchone():
+            return current
+        dt = datetime.fromtimestamp(record["timestamp"])
+        _insert_usage(
+            conn, record["cat_id"],
+            tuple(record.get(col, 0) for col in _USAGE_EXPORT_COLUMNS[1:6]),
+            record.get("hour_slot") or dt.strftime("%Y-%m-%d-%H"),
+            record.get("date_slot") or dt.strftime("%Y-%m-%d"),
+            record["timestamp"],
+        )
     else:
-        print("  (空)")
+        raise ValueError(f"未知的记录类型: {kind}")
+    counts[kind] += 1
+    return current
+
+
+def _parse_records(source: Iterable) -> Iterator[dict]:
+    for lineno, item in enumerate(source, 1):
+        if isinstance(item, dict):
+            yield item
+            continue
+        if not item.strip():
+            continue
+        try:
+            yield json.loads(item)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"第 {lineno} 行不是合法的 JSON: {e}") from None
+
+
+def import_jsonl(source: Iterable, batch_size: int = IMPORT_BATCH_RECORDS) -> dict[str, int]:
+    """导入 export_jsonl 的输出，返回各类记录的导入条数（skipped 为跳过的会话数）
+
+    source 可以是文本流 / 行的可迭代对象，也可以直接是 iter_export 产出的 dict。
+    大约每 batch_size 条记录一个写事务，只在会话之间切分：一个会话的 session
+    记录和它的消息、摘要、高水位总在同一个事务里。中途失败时已提交的批次保留，
+    再导入一次同一个文件即可补齐：已存在的会话都是完整的，整体跳过；记忆按
+    去重哈希合并，画像保留较新的值，使用记录按 (猫猫, 时间戳) 去重。
+    """
+    counts = dict.fromkeys(
+        ("session", "summary", "last_spoke", "message", "memory", "profile", "usage", "skipped"), 0,
+    )
+    current: Optional[_ImportSession] = None
+
+    def _commit(records: list[dict]):
+        nonlocal current
+        usage_before = counts["usage"]
+        with _write_conn() as conn:
+            for record in records:
+                current = _import_record(conn, record, current, counts)
+            if current is not None:
+                current.flush(conn)
+        # 记忆 / 画像绕过了写穿透缓存，整体失效，语义索引下次检索前补差量
+        _memory_cache.invalidate()
+        _profile_cache.invalidate()
+        _invalidate_semantic_index()
+        if counts["usage"] != usage_before:
+            _bump_usage_version()
+
+    batch: list[dict] = []
+    for record in _parse_records(source):
+        # 会话的附属记录不切开，攒够了也要等到下一个会话 / 全局记录再提交
+        if len(batch) >= batch_size and record.get("type") not in _SESSION_CHILD_RECORDS:
+            _commit(batch)
+            batch = []
+        batch.append(record)
+    if batch:
+        _commit(batch)
+
+    _log(
+        f"[MeowDev] 导入完成：{counts['session']} 个会话（跳过已存在的 {counts['skipped']} 个），"
+        f"{counts['message']} 条消息，{counts['memory']} 条记忆，"
+        f"{counts['profile']} 条画像，{counts['usage']} 条使用记录"
+    )
+    return counts
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# 调试工具
+# ═══════════════════════════════════════════════════════════════════════
 
-    conn.close()
+def print_all_memories():
+    """打印所有记忆（调试用）"""
+    with _read_conn(barrier=True) as conn:
+        print("\n=== 猫猫记忆 ===")
+        rows = conn.execute(
+            "SELECT cat_id, memory, importance FROM cat_memories ORDER BY cat_id, importance DESC"
+        ).fetchall()
+        if rows:
+            for r in rows:
+                print(f"  [{r['cat_id']}] ({r['importance']}) {r['memory']}")
+        else:
+            print("  (空)")
+
+        print("\n=== 用户画像 ===")
+        rows = conn.execute("SELECT key, value FROM user_profile").fetchall()
+        if rows:
+            for r in rows:
+                print(f"  {r['key']}: {r['value']}")
+        else:
+            print("  (空)")
+
+        print("\n=== 最近对话 ===")
+        rows = conn.execute(
+            "SELECT role, content FROM chat_history ORDER BY timestamp DESC LIMIT 10"
+        ).fetchall()
+        if rows:
+            for r in reversed(rows):
+                content = r['content'][:50] + "..." if len(r['content']) > 50 else r['content']
+                print(f"  {r['role']}: {content}")
+        else:
+            print("  (空)")
 
 
 # 初始化数据库
 init_db()
 
 
+def _open_text(path: str, mode: str) -> ContextManager[TextIO]:
+    """"-" 表示标准输入 / 输出，.gz 结尾的文件自动压缩 / 解压"""
+    if path == "-":
+        return nullcontext(sys.stdout if "w" in mode else sys.stdin)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def main(argv: Optional[list[str]] = None):
+    """命令行入口：
+
+    python -m memory                              # 打印所有记忆
+    python -m memory export -o backup.jsonl.gz    # 导出全部数据
+    python -m memory export -s SESSION_ID         # 只导出指定会话到标准输出
+    python -m memory import backup.jsonl.gz       # 导入
+    python -m memory vacuum                       # 旧库切换为增量 VACUUM 模式（停服后执行）
+    """
+    parser = argparse.ArgumentParser(prog="python -m memory", description="MeowDev 记忆库工具")
+    commands = parser.add_subparsers(dest="command")
+
+    export_parser = commands.add_parser("export", help="导出为 JSONL")
+    export_parser.add_argument("-o", "--output", default="-", help="输出文件（.gz 结尾自动压缩），默认标准输出")
+    export_parser.add_argument("-s", "--session", action="append", dest="sessions", metavar="ID",
+                               help="只导出指定会话（可重复）")
+    export_parser.add_argument("--no-global", action="store_true", help="不导出猫猫记忆、用户画像和使用统计")
+
+    import_parser = commands.add_parser("import", help="从 JSONL 导入")
+    import_parser.add_argument("input", nargs="?", default="-", help="输入文件（.gz 自动解压），默认标准输入")
+    import_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_RECORDS, help="每个事务导入的记录数")
+
+    commands.add_parser("vacuum", help="把旧库切换为增量 VACUUM 模式（会重写整个数据库，停服后执行）")
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        with _open_text(args.output, "w") as out:
+            count = export_jsonl(out, args.sessions, include_global=not args.no_global)
+        _log(f"[MeowDev] 导出了 {count} 条记录")
+    elif args.command == "import":
+        with _open_text(args.input, "r") as source:
+            import_jsonl(source, args.batch_size)
+    elif args.command == "vacuum":
+        if not enable_incremental_vacuum():
+            _log("[MeowDev] 数据库已经是增量 VACUUM 模式（或不是 SQLite），无需切换")
+    else:
+        print_all_memories()
+
+
 if __name__ == "__main__":
-    # 测试
-    print_all_memories()
+    main()
@@ -0,0 +1,146 @@
+"""
+记忆系统 —— 异步接口
+
+memory.py 的函数都是同步阻塞的（SQLite + 磁盘 fsync），直接在 Chainlit
+的 async handler 里调用会卡住事件循环，拖慢所有用户的流式输出。
+
+这里把它们包装成 awaitable 版本，数据库操作全部在专用线程中执行：
+- 写操作：单线程 executor，写入严格按提交顺序执行
+- 读操作：与只读连接池等大的线程池
+
+用法：
+    from memory_async import add_message, get_recent_messages
+    await add_message("用户", text, session_id)
+    messages = await get_recent_messages(session_id)
+
+同步代码里需要"写了就走"时，用 submit_write()，它立即返回一个 Future。
+
+add_message / update_cat_last_spoke / add_cat_usage / set_cli_session 本身就是
+写队列操作（见 memory.py 的合并写入），调用时立即入队，不占用写线程；
+await 它们会等到所在批次提交，拿到结果（add_message 是消息 id），写入失败
+时抛出异常。不关心结果时直接调用 memory 里的同名函数（返回 Future）。
+"""
+
+import asyncio
+import functools
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+import memory
+from config import DB_READ_POOL_SIZE
+
+# 单写线程：保证写入顺序，也正好对应连接池里唯一的写连接
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="meowdev-db-write")
+# 读线程数与只读连接池大小一致，每个线程都能直接拿到连接
+_read_executor = ThreadPoolExecutor(max_workers=DB_READ_POOL_SIZE, thread_name_prefix="meowdev-db-read")
+
+
+async def run_read(func: Callable, *args, **kwargs) -> Any:
+    """在读线程池中执行同步函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_read_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_write(func: Callable, *args, **kwargs) -> Any:
+    """在写线程中执行同步函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_write_executor, functools.partial(func, *args, **kwargs))
+
+
+def submit_write(func: Callable, *args, **kwargs) -> Future:
+    """从同步代码提交写操作，不等待结果"""
+    future = _write_executor.submit(func, *args, **kwargs)
+    future.add_done_callback(_log_write_error)
+    return future
+
+
+def _log_write_error(future: Future):
+    exc = future.exception()
+    if exc is not None:
+        print(f"[MeowDev] 后台写入失败: {exc}", file=sys.stderr)
+
+
+def _reader(func: Callable) -> Callable:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_read(func, *args, **kwargs)
+    return wrapper
+
+
+def _writer(func: Callable) -> Callable:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_write(func, *args, **kwargs)
+    return wrapper
+
+
+def _queued(func: Callable) -> Callable:
+    """写队列操作：入队只是追加到内存列表，直接在事件循环里调用
+
+    返回可 await 的 asyncio.Future，完成时带上写操作的结果或异常。
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> asyncio.Future:
+        return asyncio.wrap_future(func(*args, **kwargs))
+    return wrapper
+
+
+init_db = _writer(memory.init_db)
+flush_writes = _reader(memory.flush_writes)
+
+# ── 会话管理 ──────────────────────────────────────────────
+create_session = _writer(memory.create_session)
+get_session = _reader(memory.get_session)
+update_session = _writer(memory.update_session)
+list_sessions = _reader(memory.list_sessions)
+delete_session = _writer(memory.delete_session)
+delete_sessions = _writer(memory.delete_sessions)
+archive_sessions = _writer(memory.archive_sessions)
+restore_sessions = _writer(memory.restore_sessions)
+
+# ── 对话历史 ──────────────────────────────────────────────
+add_message = _queued(memory.add_message)
+get_recent_messages = _reader(memory.get_recent_messages)
+get_messages_paginated = _reader(memory.get_messages_paginated)
+get_message_count = _reader(memory.get_message_count)
+format_chat_context = _reader(memory.format_chat_context)
+clear_session = _writer(memory.clear_session)
+search_messages = _reader(memory.search_messages)
+
+# ── 猫猫记忆 ──────────────────────────────────────────────
+add_cat_memory = _writer(memory.add_cat_memory)
+get_cat_memories = _reader(memory.get_cat_memories)
+get_relevant_cat_memories = _reader(memory.get_relevant_cat_memories)
+format_cat_memory_context = _reader(memory.format_cat_memory_context)
+clear_cat_memories = _writer(memory.clear_cat_memories)
+
+# ── 用户画像 ──────────────────────────────────────────────
+set_user_info = _writer(memory.set_user_info)
+get_user_info = _reader(memory.get_user_info)
+get_all_user_info = _reader(memory.get_all_user_info)
+get_relevant_user_info = _reader(memory.get_relevant_user_info)
+format_user_profile_context = _reader(memory.format_user_profile_context)
+clear_user_profile = _writer(memory.clear_user_profile)
+
+# ── 使用统计 ──────────────────────────────────────────────
+add_cat_usage = _queued(memory.add_cat_usage)
+get_cat_stats = _reader(memory.get_cat_stats)
+get_all_cats_stats = _reader(memory.get_all_cats_stats)
+get_trend = _reader(memory.get_trend)
+
+# ── 增量读取 / 摘要 ───────────────────────────────────────
+update_cat_last_spoke = _queued(memory.update_cat_last_spoke)
+get_cat_last_spoke = _reader(memory.get_cat_last_spoke)
+clear_cat_last_spoke = _writer(memory.clear_cat_last_spoke)
+get_session_summary = _reader(memory.get_session_summary)
+update_session_summary = _writer(memory.update_session_summary)
+delete_session_summary = _writer(memory.delete_session_summary)
+get_messages_since = _reader(memory.get_messages_since)
+format_chat_context_since = _reader(memory.format_chat_context_since)
+get_cli_session = _reader(memory.get_cli_session)
+set_cli_session = _queued(memory.set_cli_session)
+
+# ── 每轮上下文快照 ────────────────────────────────────────
+get_context_snapshot = _reader(memory.get_context_snapshot)
+format_snapshot_context = _reader(memory.format_snapshot_context)
@@ -242,18 +242,36 @@
     document.body.appendChild(btn);
   }
 
+  // 按范围缓存上次的响应和 ETag，数据没变时服务端返回 304
+  var statsCache = {};
+
   function fetchStats() {
     var container = document.getElementById('cat-stats');
-    if (container) container.innerHTML = '<div class="empty-state">加载中...</div>';
-
     var range = getActiveRange();
+    var cached = statsCache[range];
+
+    if (cached) {
+      renderCatStats(cached.data.stats || {});
+    } else if (container) {
+      container.innerHTML = '<div class="empty-state">加载中...</div>';
+    }
+
+    var headers = {};
+    if (cached && cached.etag) headers['If-None-Match'] = cached.etag;
 
-    fetch('/api/stats?range=' + range)
+    fetch('/api/stats?range=' + range, { headers: headers, cache: 'no-store' })
       .then(function(res) {
+        if (res.status === 304 && cached) return cached.data;
         if (!res.ok) throw new Error('HTTP ' + res.status);
-        return res.json();
+        var etag = res.headers.get('ETag');
+        return res.json().then(function(data) {
+          statsCache[range] = { etag: etag, data: data };
+          return data;
+        });
+      })
+      .then(function(data) {
+        if (getActiveRange() === range) renderCatStats(data.stats || {});
       })
-      .then(function(data) { renderCatStats(data.stats || {}); })
       .catch(function(e) {
         if (container) {
           container.innerHTML = '<div class="empty-state">加载失败<br><small>' + e.message + '</small></div>';
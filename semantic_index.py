@@ -0,0 +1,305 @@
+"""
+本地语义索引（猫猫记忆 / 用户画像）
+
+纯本地、无网络、无 GPU：
+- 向量：字符 n-gram 哈希到固定维度（中日韩文字取 1~3 字，英文取单词和词内三字母），
+  带符号累加后做 L2 归一化
+- 存储：一块连续的 float32 矩阵，memmap 到数据库旁边的文件里，进程重启直接映射
+- 检索：矩阵乘一次得到全部余弦相似度，argpartition 取 top-k
+
+每条向量带一个整数 id（数据库主键）和分组（例如 cat_id），删除只打墓碑，
+墓碑过多时整理一次。prefix 传 None 时只放在内存里，不落盘。
+
+用法：
+    index = SemanticIndex(BASE_DIR / "meowdev.cat_memories")
+    index.upsert(42, "arch", "用户喜欢 PostgreSQL")
+    index.search("数据库选型", group="arch", k=10)   # [(id, score), ...]
+"""
+
+import json
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+from config import SEMANTIC_DIM
+
+_CJK_RUN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+")
+_WORD = re.compile(r"[a-z0-9]{2,}")
+
+# 不同粒度特征的权重：单字信息量低，整词最能区分
+_WEIGHT_CJK = (0.5, 1.0, 1.0)   # 1 字 / 2 字 / 3 字
+_WEIGHT_WORD = 1.5
+_WEIGHT_WORD_GRAM = 0.5
+
+
+def _features(text: str) -> Iterable[tuple[str, float]]:
+    text = unicodedata.normalize("NFKC", text).lower()
+    for run in _CJK_RUN.findall(text):
+        for n, weight in enumerate(_WEIGHT_CJK, start=1):
+            for i in range(len(run) - n + 1):
+                yield run[i:i + n], weight
+    for word in _WORD.findall(text):
+        yield "w:" + word, _WEIGHT_WORD
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            yield "g:" + padded[i:i + 3], _WEIGHT_WORD_GRAM
+
+
+def embed(text: str, dim: int = SEMANTIC_DIM) -> np.ndarray:
+    """把文本哈希成 dim 维单位向量（空文本返回零向量）"""
+    vec = np.zeros(dim, dtype=np.float32)
+    for feature, weight in _features(text):
+        h = zlib.crc32(feature.encode("utf-8"))
+        # 低位选桶，高位决定符号，减少哈希冲突带来的系统性偏差
+        vec[h % dim] += weight if (h >> 31) & 1 else -weight
+    norm = float(np.linalg.norm(vec))
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
+class SemanticIndex:
+    """可增量更新、memmap 持久化的向量索引
+
+    文件布局（prefix 为构造参数）：
+        prefix.vec   float32 [capacity, dim]
+        prefix.ids   int64   [capacity]     -1 表示空位 / 墓碑
+        prefix.grp   int32   [capacity]     分组编号
+        prefix.json  元数据：dim / 已用行数 / 容量 / 分组名 → 编号
+    """
+
+    def __init__(self, prefix: Optional[Path], dim: int = SEMANTIC_DIM, initial_capacity: int = 1024):
+        self.prefix = Path(prefix) if prefix is not None else None
+        self.dim = dim
+        self._initial_capacity = initial_capacity
+        self._lock = threading.RLock()
+        self._loaded = False
+
+        self._vectors: Optional[np.ndarray] = None
+        self._ids: Optional[np.ndarray] = None
+        self._groups: Optional[np.ndarray] = None
+        self._count = 0          # 已使用的行数（含墓碑）
+        self._capacity = 0
+        self._group_codes: dict[str, int] = {}
+        self._row_of: dict[int, int] = {}
+
+    # ── 文件 ──────────────────────────────────────────────
+
+    def _path(self, suffix: str) -> Path:
+        return self.prefix.with_name(self.prefix.name + suffix)
+
+    def _map(self, capacity: int, mode: str):
+        if self.prefix is None:
+            return (np.zeros((capacity, self.dim), dtype=np.float32),
+                    np.zeros(capacity, dtype=np.int64), np.zeros(capacity, dtype=np.int32))
+        vectors = np.memmap(self._path(".vec"), dtype=np.float32, mode=mode, shape=(capacity, self.dim))
+        ids = np.memmap(self._path(".ids"), dtype=np.int64, mode=mode, shape=(capacity,))
+        groups = np.memmap(self._path(".grp"), dtype=np.int32, mode=mode, shape=(capacity,))
+        return vectors, ids, groups
+
+    def _load(self):
+        if self._loaded:
+            return
+        meta = None
+        try:
+            if self.prefix is None:
+                raise OSError("内存索引")
+            meta = json.loads(self._path(".json").read_text(encoding="utf-8"))
+            if meta.get("dim") != self.dim:
+                meta = None  # 维度变了，旧向量不可用
+        except (OSError, ValueError):
+            pass
+
+        if meta is not None:
+            try:
+                self._capacity = meta["capacity"]
+                self._count = meta["count"]
+                self._group_codes = meta["groups"]
+                self._vectors, self._ids, self._groups = self._map(self._capacity, "r+")
+            except (OSError, ValueError, KeyError):
+                meta = None
+
+        if meta is None:
+            self._create(self._initial_capacity)
+
+        self._row_of = {
+            int(i): row for row, i in enumerate(self._ids[:self._count]) if i >= 0
+        }
+        self._loaded = True
+
+    def _create(self, capacity: int):
+        self._capacity = capacity
+        self._count = 0
+        self._group_codes = {}
+        self._vectors, self._ids, self._groups = self._map(capacity, "w+")
+        self._ids[:] = -1
+        self._save_meta()
+
+    def _save_meta(self):
+        if self.prefix is None:
+            return
+        meta = {
+            "dim": self.dim,
+            "count": self._count,
+            "capacity": self._capacity,
+            "groups": self._group_codes,
+        }
+        tmp = self._path(".json.tmp")
+        tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self._path(".json"))
+
+    def _flush(self):
+        if self.prefix is None:
+            return
+        self._vectors.flush()
+        self._ids.flush()
+        self._groups.flush()
+        self._save_meta()
+
+    def _grow(self, needed: int):
+        """容量翻倍：把现有数据搬进更大的文件"""
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        old = (np.array(self._vectors[:self._count]), np.array(self._ids[:self._count]),
+               np.array(self._groups[:self._count]))
+        count = self._count
+        self._vectors = self._ids = self._groups = None  # 释放旧映射
+        self._capacity = capacity
+        self._vectors, self._ids, self._groups = self._map(capacity, "w+")
+        self._ids[:] = -1
+        self._vectors[:count], self._ids[:count], self._groups[:count] = old
+
+    # ── 写入 ──────────────────────────────────────────────
+
+    def _group_code(self, group: str) -> int:
+        code = self._group_codes.get(group)
+        if code is None:
+            code = len(self._group_codes)
+            self._group_codes[group] = code
+        return code
+
+    def _put(self, item_id: int, group: str, text: str):
+        row = self._row_of.get(item_id)
+        if row is None:
+            if self._count >= self._capacity:
+                self._grow(self._count + 1)
+            row = self._count
+            self._count += 1
+            self._row_of[item_id] = row
+        self._vectors[row] = embed(text, self.dim)
+        self._ids[row] = item_id
+        self._groups[row] = self._group_code(group)
+
+    def upsert(self, item_id: int, group: str, text: str):
+        """新增或替换一条向量"""
+        with self._lock:
+            self._load()
+            self._put(item_id, group, text)
+            self._flush()
+
+    def upsert_many(self, items: Iterable[tuple[int, str, str]]):
+        """批量新增 / 替换 (id, group, text)，最后只落盘一次"""
+        with self._lock:
+            self._load()
+            for item_id, group, text in items:
+                self._put(item_id, group, text)
+            self._flush()
+
+    def remove(self, item_ids: Iterable[int]):
+        """删除（打墓碑）；墓碑超过一半时整理"""
+        with self._lock:
+            self._load()
+            for item_id in item_ids:
+                row = self._row_of.pop(int(item_id), None)
+                if row is not None:
+                    self._ids[row] = -1
+                    self._vectors[row] = 0
+            if self._count and len(self._row_of) < self._count // 2:
+                self._compact()
+            self._flush()
+
+    def remove_group(self, group: str):
+        with self._lock:
+            self._load()
+            code = self._group_codes.get(group)
+            if code is None:
+                return
+            rows = np.nonzero((self._groups[:self._count] == code) & (self._ids[:self._count] >= 0))[0]
+            self.remove(int(self._ids[r]) for r in rows)
+
+    def clear(self):
+        with self._lock:
+            self._vectors = self._ids = self._groups = None
+            self._create(self._initial_capacity)
+            self._row_of = {}
+            self._loaded = True
+
+    def _compact(self):
+        live = np.nonzero(self._ids[:self._count] >= 0)[0]
+        n = len(live)
+        self._vectors[:n] = self._vectors[live]
+        self._ids[:n] = self._ids[live]
+        self._groups[:n] = self._groups[live]
+        self._ids[n:self._count] = -1
+        self._vectors[n:self._count] = 0
+        self._count = n
+        self._row_of = {int(i): row for row, i in enumerate(self._ids[:n])}
+
+    # ── 同步 / 查询 ───────────────────────────────────────
+
+    def ids(self) -> set[int]:
+        with self._lock:
+            self._load()
+            return set(self._row_of)
+
+    def sync(self, db_ids: set[int], fetch_texts) -> tuple[int, int]:
+        """与数据库对齐：补上缺失的向量，删掉数据库里已经没有的
+
+        Args:
+            db_ids: 数据库里当前的全部 id
+            fetch_texts: 回调，传入缺失的 id 列表，返回 [(id, group, text), ...]
+
+        Returns:
+            (新增数, 删除数)
+        """
+        with self._lock:
+            current = self.ids()
+            missing = sorted(db_ids - current)
+            stale = current - db_ids
+            if stale:
+                self.remove(stale)
+            if missing:
+                self.upsert_many(fetch_texts(missing))
+            return len(missing), len(stale)
+
+    def search(self, query: str, group: Optional[str] = None, k: int = 10,
+               min_score: float = 0.0) -> list[tuple[int, float]]:
+        """余弦相似度 top-k，返回 [(id, score), ...]，按相似度从高到低"""
+        q = embed(query, self.dim)
+        if not q.any():
+            return []
+        with self._lock:
+            self._load()
+            if not self._count:
+                return []
+            scores = self._vectors[:self._count] @ q
+            ids = self._ids[:self._count]
+            mask = ids >= 0
+            if group is not None:
+                code = self._group_codes.get(group)
+                if code is None:
+                    return []
+                mask &= self._groups[:self._count] == code
+            scores = np.where(mask, scores, -1.0)
+
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(ids[i]), float(scores[i])) for i in top if scores[i] > min_score]
@@ -0,0 +1,101 @@
+"""
+/api/stats 的进程内缓存
+
+- 按时间范围（day/week/month）缓存序列化好的响应体
+- 并发的相同请求合并成一次计算（single-flight）
+- add_cat_usage 提交后统计版本号变化，缓存自动失效
+  （多 worker 共用数据库时，其他进程的写入看不到，缓存最多保留 SHARED_CACHE_TTL 秒）
+- 响应带 ETag / Last-Modified，前端可以拿到 304
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from config import SHARED_CACHE_TTL
+from memory import get_usage_version, is_shared_storage
+from memory_async import get_all_cats_stats, get_trend
+
+STATS_RANGES = ("day", "week", "month")
+
+
+@dataclass
+class StatsSnapshot:
+    """一份可直接返回的统计响应"""
+    key: tuple
+    body: bytes
+    etag: str
+    last_modified: float
+
+
+def _normalize_range(range_type: str) -> str:
+    # 与 get_trend 的分支一致：未知范围按 month 处理
+    return range_type if range_type in STATS_RANGES else "month"
+
+
+def _cache_key(range_type: str) -> tuple:
+    """缓存键 = 范围 + 统计版本号 + 当前时间窗
+
+    即使没有新的用量，统计窗口也会随时间滑动：三种范围都按自然日计算，跨天时变化。
+    """
+    version, _ = get_usage_version()
+    window = datetime.now().strftime("%Y-%m-%d")
+    if is_shared_storage():
+        window += f"/{int(time.time() // SHARED_CACHE_TTL)}"
+    return range_type, version, window
+
+
+class StatsCache:
+    """按范围缓存统计结果，合并并发计算"""
+
+    def __init__(self):
+        self._entries: dict[str, StatsSnapshot] = {}
+        self._inflight: dict[tuple, asyncio.Task] = {}
+
+    async def get(self, range_type: str) -> StatsSnapshot:
+        range_type = _normalize_range(range_type)
+        key = _cache_key(range_type)
+
+        entry = self._entries.get(range_type)
+        if entry and entry.key == key:
+            return entry
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._compute(range_type, key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield：某个请求断开不应取消其他请求在等的计算
+        return await asyncio.shield(task)
+
+    async def _compute(self, range_type: str, key: tuple) -> StatsSnapshot:
+        _, updated_at = get_usage_version()
+        # 时间窗滑动也算一次"修改"，否则 If-Modified-Since 会误判为未变化
+        window_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        stats, trend = await asyncio.gather(get_all_cats_stats(range_type), get_trend(range_type))
+        body = json.dumps(
+            {"stats": stats, "trend": trend, "range": range_type},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        snapshot = StatsSnapshot(
+            key=key,
+            body=body,
+            etag=f'"{hashlib.sha1(body).hexdigest()}"',
+            last_modified=max(updated_at, window_start.timestamp()),
+        )
+        self._entries[range_type] = snapshot
+        return snapshot
+
+    def invalidate(self, range_type: Optional[str] = None):
+        """手动清空缓存（不传范围则全部清空）"""
+        if range_type is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(_normalize_range(range_type), None)
+
+
+stats_cache = StatsCache()
@@ -0,0 +1,101 @@
+"""
+存储后端
+
+memory.py 和 data_layer.py 都通过这里访问数据库，不直接创建连接：
+- SQLite（默认）：BASE_DIR/meowdev.db，适合单进程部署
+- PostgreSQL：设置环境变量 MEOWDEV_DATABASE_URL=postgresql://...，
+  多个 app worker 可以放在负载均衡后面共用同一个库
+
+两种后端的连接池接口相同（见 db.ConnectionPool / db_postgres.PostgresPool），
+高频小写入都走同一个合并写入队列（WriteBehindQueue）。SQL 统一按 SQLite
+的写法（? 占位符），少数方言差异由调用方按 storage.dialect 分支处理。
+
+用法：
+    storage = get_storage()
+    with storage.reader(barrier=True) as conn:
+        conn.execute("SELECT ...")
+    with storage.writer() as conn:
+        message_id = storage.insert(conn, "INSERT INTO ... VALUES (?, ?)", (a, b))
+    storage.submit(lambda conn: conn.execute("UPDATE ..."))
+"""
+
+import atexit
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, ContextManager, Optional, Sequence
+
+from config import BASE_DIR, DATABASE_URL
+from db import ConnectionPool, WriteBehindQueue, WriteOp
+
+DB_PATH = BASE_DIR / "meowdev.db"
+
+
+class Storage:
+    """一个连接池 + 一个合并写入队列"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.dialect: str = pool.dialect
+        # 其他进程也会写同一个库：进程内缓存不能只靠本进程的写入来失效
+        self.shared = self.dialect != "sqlite"
+        self._queue = WriteBehindQueue(pool)
+
+    def reader(self, barrier: bool = False) -> ContextManager:
+        """借一个只读连接（with 语句结束自动归还）
+
+        Args:
+            barrier: 先等待写队列落盘，保证能读到本进程之前提交的写入
+        """
+        if barrier:
+            self._queue.flush()
+        return self.pool.reader()
+
+    def writer(self) -> ContextManager:
+        """获取写连接（with 语句结束自动提交，异常回滚）
+
+        直接写之前先清空写队列，保证与排队中的写入保持提交顺序。
+        """
+        if not self.pool.holds_writer():
+            self._queue.flush()
+        return self.pool.writer()
+
+    def submit(self, op: WriteOp, on_commit: Optional[Callable[[], None]] = None) -> Future:
+        """把写操作放进合并写入队列，立即返回 Future"""
+        return self._queue.submit(op, on_commit)
+
+    def flush(self):
+        """写屏障：等待所有排队中的写入提交"""
+        self._queue.flush()
+
+    def insert(self, conn, sql: str, params: Sequence[Any] = ()) -> int:
+        """执行 INSERT 并返回新行的 id"""
+        if self.dialect == "postgres":
+            return conn.execute(sql + " RETURNING id", params).fetchone()[0]
+        return conn.execute(sql, params).lastrowid
+
+    def close(self):
+        self._queue.close()
+        self.pool.close()
+
+
+def open_storage(url: str = DATABASE_URL) -> Storage:
+    """按连接串创建存储后端：postgres(ql):// 用 PostgreSQL，否则是 SQLite 文件路径（空串为默认路径）"""
+    if url.startswith(("postgres://", "postgresql://")):
+        from db_postgres import PostgresPool
+        return Storage(PostgresPool(url))
+    return Storage(ConnectionPool(url.removeprefix("sqlite:///") if url else DB_PATH))
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """进程内共享的存储后端（第一次调用时按配置创建）"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = open_storage()
+                atexit.register(_storage.close)
+    return _storage
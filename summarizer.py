@@ -9,6 +9,7 @@
 import json
 from typing import Optional
 
+import memory_async
 from memory import get_recent_messages, update_session_summary
 
 
@@ -197,7 +198,7 @@ async def update_summary_for_session_async(session_id: str, llm_func_async, mess
     Returns:
         是否成功更新
     """
-    messages = get_recent_messages(session_id, limit=message_limit)
+    messages = await memory_async.get_recent_messages(session_id, limit=message_limit)
     if not messages:
         return False
 
@@ -205,7 +206,7 @@ async def update_summary_for_session_async(session_id: str, llm_func_async, mess
     if not summary:
         return False
 
-    update_session_summary(
+    await memory_async.update_session_summary(
         session_id,
         summary["summary"],
         summary["key_goals"],
@@ -22,6 +22,7 @@ from pathlib import Path
 from typing import Awaitable, Callable, Optional
 
 from cats import arch, stack, pixel, CatAgent
+from cli_process import Priority
 from config import MAX_REVIEW_ROUNDS, OUTPUT_DIR
 from feature_list import FeatureList, Feature
 from progress import Progress
@@ -106,7 +107,7 @@ class MeowDevTeam:
         async def cat_speak(cat: CatAgent, phase: Phase, task: str) -> str:
             if on_cat_speak:
                 return await on_cat_speak(cat, phase, task)
-            response = await cat.chat_in_group(session_id, cwd=work_dir)
+            response = await cat.chat_in_group(session_id, cwd=work_dir, priority=Priority.TEAM)
             clean_text, _, _ = cat.process_response(response)
             return clean_text or response
 
@@ -0,0 +1,28 @@
+"""
+测试环境
+
+- 设置了 MEOWDEV_DATABASE_URL：就用它（PostgreSQL 测试需要一个专门的测试库）
+- MEOWDEV_TEST_POSTGRES=1：用 pgserver（pip install pgserver）在临时目录里起一个
+  本地 PostgreSQL，测试结束后删掉，PostgreSQL 测试不用另外准备数据库
+- 都没有：用临时目录里的新 SQLite 库，不会碰到 BASE_DIR/meowdev.db
+
+memory 导入时就会按 MEOWDEV_DATABASE_URL 连库，所以要在测试模块导入前设置好。
+"""
+
+import atexit
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+if not os.getenv("MEOWDEV_DATABASE_URL"):
+    if os.getenv("MEOWDEV_TEST_POSTGRES") == "1":
+        import pgserver
+
+        _server = pgserver.get_server(tempfile.mkdtemp(prefix="meowdev-pg-"), cleanup_mode="delete")
+        atexit.register(_server.cleanup)
+        os.environ["MEOWDEV_DATABASE_URL"] = _server.get_uri()
+    else:
+        os.environ["MEOWDEV_DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='meowdev-test-')}/meowdev.db"
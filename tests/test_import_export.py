@@ -0,0 +1,63 @@
+"""
+JSONL 导出 / 导入测试
+
+跑在 MEOWDEV_DATABASE_URL 指向的库上（没设置时是 conftest 建的临时 SQLite 库），
+每个用例用随机的会话 ID / 猫猫 ID，不依赖库里原有的数据。
+"""
+
+import uuid
+
+import pytest
+
+import memory
+
+
+def _uid(prefix: str) -> str:
+    return f"{prefix}-{uuid.uuid4().hex[:12]}"
+
+
+def test_imported_memories_are_retrievable():
+    cat_id = _uid("cat")
+    # 语义索引先和数据库对齐过一次，导入之后也要能检索到新记忆
+    memory.add_cat_memory(cat_id, "部署用 docker compose", 1)
+    assert memory.get_relevant_cat_memories(cat_id, "docker 部署")
+
+    records = [
+        {"type": "memory", "cat_id": cat_id, "memory": "用户喜欢用 pytest 写单元测试",
+         "importance": 2, "timestamp": 1.0, "hit_count": 1},
+    ]
+    assert memory.import_jsonl(records)["memory"] == 1
+
+    relevant = memory.get_relevant_cat_memories(cat_id, "单元测试用什么框架")
+    assert "用户喜欢用 pytest 写单元测试" in [m["memory"] for m in relevant]
+    # 近似重复检查也能看到导入的记忆
+    merged = memory.add_cat_memory(cat_id, "用户很喜欢用 pytest 写单元测试", 1)
+    assert [m["memory"] for m in memory.get_cat_memories(cat_id)].count("用户喜欢用 pytest 写单元测试") == 1
+    assert merged in memory._memory_index.ids()
+    memory.clear_cat_memories(cat_id)
+
+
+def test_rerun_after_failed_import_restores_whole_sessions():
+    session_id = memory.create_session("导入测试", session_id=_uid("test"))
+    contents = [f"消息 {i}" for i in range(6)]
+    for c in contents:
+        memory.add_message("用户", c, session_id).result()
+    records = list(memory.iter_export([session_id], include_global=False))
+    memory.delete_session(session_id)
+
+    def failing():
+        # 在会话的消息中间失败，批次很小，会话跨好几个批次
+        for i, record in enumerate(records):
+            if i == len(records) - 2:
+                raise RuntimeError("导入中断")
+            yield record
+
+    with pytest.raises(RuntimeError):
+        memory.import_jsonl(failing(), batch_size=2)
+    # 没导完的会话整体回滚，不会留下半截
+    assert memory.get_session(session_id) is None
+
+    counts = memory.import_jsonl(records, batch_size=2)
+    assert counts["session"] == 1 and counts["message"] == 6
+    assert [m["content"] for m in memory.get_recent_messages(session_id)] == contents
+    memory.delete_session(session_id)
@@ -0,0 +1,38 @@
+"""
+异步接口测试：写队列操作 await 后拿到结果，失败时能看到异常
+"""
+
+import asyncio
+import uuid
+
+import pytest
+
+import memory
+import memory_async
+
+
+def test_queued_writes_return_results():
+    async def run():
+        session_id = await memory_async.create_session("异步测试", session_id=f"test-{uuid.uuid4().hex[:12]}")
+        first = await memory_async.add_message("用户", "第一条", session_id)
+        second = await memory_async.add_message("用户", "第二条", session_id)
+        messages = await memory_async.get_messages_since(0, session_id)
+        await memory_async.delete_session(session_id)
+        return first, second, messages
+
+    first, second, messages = asyncio.run(run())
+    assert isinstance(first, int) and first < second
+    assert [(m["id"], m["content"]) for m in messages] == [(first, "第一条"), (second, "第二条")]
+
+
+def test_queued_write_failure_is_raised():
+    def _failing_op(*args, **kwargs):
+        return memory._storage.submit(lambda conn: conn.execute("SELECT * FROM no_such_table"))
+
+    failing = memory_async._queued(_failing_op)
+
+    async def run():
+        await failing()
+
+    with pytest.raises(Exception, match="no_such_table"):
+        asyncio.run(run())